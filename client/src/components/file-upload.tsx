@@ -7,6 +7,17 @@ import { apiRequest } from "@/lib/queryClient";
 import { useToast } from "@/hooks/use-toast";
 import type { Session, Document } from "@shared/schema";
 
+interface IngestionJob {
+  id: string;
+  status: "queued" | "running" | "completed" | "failed";
+  pagesDone: number;
+  pagesTotal: number | null;
+  document: Document | null;
+  error: string | null;
+}
+
+const POLL_INTERVAL_MS = 1000;
+
 interface FileUploadProps {
   onSessionCreated: (session: Session) => void;
 }
@@ -14,6 +25,7 @@ interface FileUploadProps {
 export function FileUpload({ onSessionCreated }: FileUploadProps) {
   const [dragActive, setDragActive] = useState(false);
   const [uploadedDocument, setUploadedDocument] = useState<Document | null>(null);
+  const [ingestProgress, setIngestProgress] = useState<string | null>(null);
   const queryClient = useQueryClient();
   const { toast } = useToast();
 
@@ -42,8 +54,32 @@ export function FileUpload({ onSessionCreated }: FileUploadProps) {
         const error = await response.json();
         throw new Error(error.message || "Upload failed");
       }
-      
-      return response.json();
+
+      // The upload returns a queued ingestion job; poll it until the document is ready
+      let job: IngestionJob = await response.json();
+      while (job.status === "queued" || job.status === "running") {
+        setIngestProgress(
+          job.status === "queued"
+            ? "Waiting in queue..."
+            : job.pagesTotal
+              ? `Processing page ${job.pagesDone} of ${job.pagesTotal}...`
+              : "Processing...",
+        );
+        await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL_MS));
+        const statusResponse = await fetch(`/api/ingest/jobs/${job.id}`, { credentials: "include" });
+        if (!statusResponse.ok) {
+          throw new Error("Lost track of the upload");
+        }
+        job = await statusResponse.json();
+      }
+
+      if (job.status === "failed" || !job.document) {
+        throw new Error(job.error || "Processing failed");
+      }
+      return job.document;
+    },
+    onSettled: () => {
+      setIngestProgress(null);
     },
     onSuccess: (document: Document) => {
       setUploadedDocument(document);
@@ -149,7 +185,7 @@ export function FileUpload({ onSessionCreated }: FileUploadProps) {
         <div className="flex flex-col items-center">
           <CloudUpload className="text-4xl text-slate-400 mb-4" size={48} />
           <h3 className="text-lg font-semibold text-slate-700 mb-2">
-            {isUploading ? "Uploading Document..." : "Upload Document"}
+            {isUploading ? ingestProgress || "Uploading Document..." : "Upload Document"}
           </h3>
           <p className="text-slate-500 mb-4">
             Drag & drop your PDF or TXT files here, or click to browse
@@ -1,6 +1,8 @@
 import express, { type Request, Response, NextFunction } from "express";
 import { registerRoutes } from "./routes";
 import { setupVite, serveStatic, log } from "./vite";
+import { pythonRunner } from "./services/python-runner";
+import { ingestionQueue } from "./services/ingestion-queue";
 
 const app = express();
 app.use(express.json());
@@ -68,4 +70,13 @@ app.use((req, res, next) => {
   }, () => {
     log(`serving on port ${port}`);
   });
+
+  // Let resident Python workers finish in-flight requests before exiting
+  for (const signal of ["SIGINT", "SIGTERM"] as const) {
+    process.once(signal, async () => {
+      server.close();
+      await Promise.all([pythonRunner.shutdown(), ingestionQueue.shutdown()]);
+      process.exit(0);
+    });
+  }
 })();
@@ -2,8 +2,8 @@ import type { Express } from "express";
 import { createServer, type Server } from "http";
 import { storage } from "./storage";
 import { pythonRunner } from "./services/python-runner";
-import { ragManager } from "./services/rag-manager";
-import { aiRequestSchema, insertSessionSchema, insertMessageSchema, insertDocumentSchema } from "@shared/schema";
+import { ingestionQueue, QueueFullError } from "./services/ingestion-queue";
+import { aiRequestSchema, insertSessionSchema, insertMessageSchema } from "@shared/schema";
 import { z } from "zod";
 import multer from "multer";
 import path from "path";
@@ -115,67 +115,53 @@ export async function registerRoutes(app: Express): Promise<Server> {
     }
   });
 
-  // Upload file
+  // Upload file; extraction and indexing run as a queued ingestion job
   app.post("/api/sessions/:id/upload", upload.single("file"), async (req, res) => {
-    try {
-      if (!req.file) {
-        return res.status(400).json({ message: "No file uploaded" });
-      }
-
-      const sessionId = req.params.id;
-      const { originalname, mimetype, size, path: filePath } = req.file;
-
-      // Process file content based on type
-      let content = "";
-      try {
-        if (mimetype === "application/pdf") {
-          // Use Python script to extract PDF content
-          const fs = await import("fs");
-          content = await pythonRunner.processFileContent(filePath, mimetype);
-        } else if (mimetype === "text/plain") {
-          const fs = await import("fs");
-          content = fs.readFileSync(filePath, "utf-8");
-        }
-      } catch (error) {
-        // Clean up uploaded file
-        fs.unlinkSync(filePath);
-        return res.status(500).json({ message: "Failed to process file content" });
-      }
+    if (!req.file) {
+      return res.status(400).json({ message: "No file uploaded" });
+    }
 
-      // Store document in database
-      const documentData = insertDocumentSchema.parse({
-        sessionId,
+    const { originalname, mimetype, size, path: filePath } = req.file;
+    try {
+      const job = ingestionQueue.enqueue({
+        sessionId: req.params.id,
         filename: originalname,
-        content,
-        size: `${(size / 1024).toFixed(1)} KB`,
         mimeType: mimetype,
+        size,
+        filePath,
       });
-
-      const document = await storage.createDocument(documentData);
-
-      // Index document for RAG capabilities (async operation)
-      ragManager.indexDocument(document).catch(error => {
-        console.error(`Failed to index document ${document.id} for RAG:`, error);
-      });
-
+      res.status(202).location(`/api/ingest/jobs/${job.id}`).json(job);
+    } catch (error) {
       // Clean up uploaded file
       fs.unlinkSync(filePath);
 
-      res.status(201).json(document);
-    } catch (error) {
-      // Clean up uploaded file on error
-      if (req.file) {
-        fs.unlinkSync(req.file.path);
-      }
-      
-      if (error instanceof z.ZodError) {
-        res.status(400).json({ message: "Invalid document data", errors: error.errors });
+      if (error instanceof QueueFullError) {
+        res.setHeader("Retry-After", String(error.retryAfterSeconds));
+        res.status(503).json({ message: "Too many uploads in progress, try again shortly" });
       } else {
         res.status(500).json({ message: "Failed to upload file" });
       }
     }
   });
 
+  // Status of an ingestion job; completed jobs carry the stored document
+  app.get("/api/ingest/jobs/:id", (req, res) => {
+    const job = ingestionQueue.get(req.params.id);
+    if (!job) {
+      return res.status(404).json({ message: "Ingestion job not found" });
+    }
+    res.json(job);
+  });
+
+  // Queue depth and ingestion worker health
+  app.get("/api/ingest/stats", async (req, res) => {
+    try {
+      res.json(await ingestionQueue.stats());
+    } catch (error) {
+      res.status(500).json({ message: "Failed to fetch ingestion stats" });
+    }
+  });
+
   // Send message and get AI response
   app.post("/api/ai/chat", async (req, res) => {
     try {
@@ -220,6 +206,101 @@ export async function registerRoutes(app: Express): Promise<Server> {
     }
   });
 
+  // Send message and stream the AI response as server-sent events
+  app.post("/api/ai/chat/stream", async (req, res) => {
+    const parsed = aiRequestSchema.safeParse(req.body);
+    if (!parsed.success) {
+      res.status(400).json({ message: "Invalid AI request", errors: parsed.error.errors });
+      return;
+    }
+    const aiRequest = parsed.data;
+
+    res.writeHead(200, {
+      "Content-Type": "text/event-stream",
+      "Cache-Control": "no-cache",
+      Connection: "keep-alive",
+      "X-Accel-Buffering": "no",
+    });
+    res.flushHeaders();
+
+    // The request's "close" fires as soon as its body has been read, so only
+    // the response tells whether the client went away before the stream ended
+    let clientClosed = false;
+    res.on("close", () => {
+      if (!res.writableEnded) {
+        clientClosed = true;
+      }
+    });
+    const sendEvent = (event: string, data: unknown) => {
+      if (!clientClosed && !res.writableEnded) {
+        res.write(`event: ${event}\ndata: ${JSON.stringify(data)}\n\n`);
+      }
+    };
+
+    try {
+      // Store user message
+      const userMessage = await storage.createMessage({
+        sessionId: aiRequest.sessionId,
+        role: "user",
+        content: aiRequest.query,
+        metadata: { toolType: aiRequest.toolType },
+      });
+      sendEvent("user", userMessage);
+
+      const aiResponse = await pythonRunner.streamAIAgent(aiRequest, (event) => {
+        sendEvent(event.type, event);
+      });
+
+      // The full response is stored even if the client went away mid-stream
+      const assistantMessage = await storage.createMessage({
+        sessionId: aiRequest.sessionId,
+        role: "assistant",
+        content: aiResponse.response,
+        metadata: aiResponse.metadata,
+      });
+
+      await storage.updateSession(aiRequest.sessionId, {});
+
+      sendEvent("done", { userMessage, assistantMessage, aiResponse });
+    } catch (error) {
+      sendEvent("error", {
+        message: "Failed to process AI request",
+        error: error instanceof Error ? error.message : "Unknown error",
+      });
+    } finally {
+      res.end();
+    }
+  });
+
+  // Health of the resident Python AI workers
+  app.get("/api/ai/health", async (req, res) => {
+    try {
+      const workers = await pythonRunner.healthCheck();
+      res.json({ workers });
+    } catch (error) {
+      res.status(500).json({ message: "Failed to check AI workers" });
+    }
+  });
+
+  // Per-stage latency, token and batching histograms of the AI workers, for Prometheus
+  app.get("/metrics", async (req, res) => {
+    try {
+      res.type("text/plain; version=0.0.4").send(await pythonRunner.metrics());
+    } catch (error) {
+      res.status(500).json({ message: "Failed to collect AI worker metrics" });
+    }
+  });
+
+  // Restart the Python AI workers one at a time
+  app.post("/api/ai/restart", async (req, res) => {
+    try {
+      await pythonRunner.restartWorkers();
+      res.status(202).json({ message: "AI workers restarted" });
+    } catch (error) {
+      res.status(500).json({ message: "Failed to restart AI workers" });
+    }
+  });
+
   const httpServer = createServer(app);
   return httpServer;
 }
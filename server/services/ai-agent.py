@@ -3,82 +3,508 @@
 import sys
 import json
 import os
-import subprocess
-from transformers import pipeline, AutoModelForSeq2SeqLM, AutoTokenizer
+from transformers import pipeline, AutoModelForSeq2SeqLM, AutoTokenizer, TextIteratorStreamer
 import torch
 from duckduckgo_search import DDGS
 import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
 from bs4 import BeautifulSoup
 import re
 import PyMuPDF as fitz  # fitz
 import time
+import threading
+import gc
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from service_loader import load_service_module
+
+
+rag_service = load_service_module("rag-service.py", "rag_service")
+web_cache = load_service_module("web-cache.py", "web_cache")
+response_cache = load_service_module("response-cache.py", "response_cache")
+model_optimization = load_service_module("model-optimization.py", "model_optimization")
+request_metrics = load_service_module("request-metrics.py", "request_metrics")
+
+BATCH_SIZES = request_metrics.registry.histogram(
+    "ai_agent_batch_size", "Inputs per batched forward pass", [1, 2, 4, 8, 16, 32, 64]
+)
+BATCH_QUEUE_WAIT = request_metrics.registry.histogram(
+    "ai_agent_batch_queue_wait_seconds", "Time inputs wait for their batch to be dispatched",
+    [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1],
+)
+
+class ModelRegistry:
+    """Load pipelines on first use and evict least-recently-used ones over a memory budget"""
+
+    def __init__(self, memory_budget_mb=None):
+        budget = float(memory_budget_mb) if memory_budget_mb else 0
+        self.memory_budget = int(budget * 1024 * 1024) if budget > 0 else None
+        self._loaders = {}
+        self._resident = OrderedDict()  # name -> (pipeline, size in bytes)
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self.loads = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+
+    def register(self, name: str, loader):
+        """Register a zero-argument callable that builds the named pipeline"""
+        with self._lock:
+            self._loaders[name] = loader
+            self._load_locks[name] = threading.Lock()
+
+    def get(self, name: str):
+        """Return the named pipeline, loading it (and evicting others) if needed"""
+        with self._lock:
+            if name in self._resident:
+                self._resident.move_to_end(name)
+                return self._resident[name][0]
+            if name not in self._loaders:
+                raise KeyError(f"Unknown model: {name}")
+            load_lock = self._load_locks[name]
+
+        # Load outside the registry lock so resident models stay available meanwhile
+        with load_lock:
+            with self._lock:
+                if name in self._resident:
+                    self._resident.move_to_end(name)
+                    return self._resident[name][0]
+
+            start = time.time()
+            with request_metrics.stage("model_load"):
+                model_pipeline = self._loaders[name]()
+            size = self.estimate_size(model_pipeline)
+
+            with self._lock:
+                self.loads += 1
+                self.load_seconds += time.time() - start
+                self._resident[name] = (model_pipeline, size)
+                evicted = self._evict(keep=name)
+
+        if evicted:
+            print(f"Evicted models to stay within memory budget: {', '.join(evicted)}", file=sys.stderr)
+            gc.collect()
+        return model_pipeline
+
+    def _evict(self, keep: str) -> list:
+        """Drop least-recently-used pipelines until the budget is met. Caller holds the lock."""
+        evicted = []
+        if self.memory_budget is None:
+            return evicted
+        while self.resident_bytes() > self.memory_budget and len(self._resident) > 1:
+            name = next(n for n in self._resident if n != keep)
+            del self._resident[name]
+            self.evictions += 1
+            evicted.append(name)
+        return evicted
+
+    @staticmethod
+    def estimate_size(model_pipeline) -> int:
+        """Approximate resident size from the weights and buffers of the pipeline's model"""
+        model = getattr(model_pipeline, "model", None)
+        if model is None or not hasattr(model, "state_dict"):
+            return 0
+        return model_optimization.model_size_bytes(model)
+
+    def resident_bytes(self) -> int:
+        return sum(size for _, size in self._resident.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "resident": {name: size for name, (_, size) in self._resident.items()},
+                "residentBytes": self.resident_bytes(),
+                "budgetBytes": self.memory_budget,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "loadSeconds": round(self.load_seconds, 2),
+            }
+
+
+class _BatchItem:
+    __slots__ = ("value", "key", "kwargs", "enqueued_at", "contended", "captured", "done", "result", "error")
+
+    def __init__(self, value, kwargs):
+        self.value = value
+        self.kwargs = kwargs
+        self.key = tuple(sorted(kwargs.items()))
+        self.enqueued_at = time.perf_counter()
+        # Whether other items were queued or running when this one arrived
+        self.contended = False
+        # The submitting request, so work done for its batch is timed as part of it
+        self.captured = request_metrics.capture()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """Collect concurrent calls to one pipeline and run them as a single padded forward pass.
+
+    Callers block in ``submit``. Items submitted while the batcher is idle run
+    at once, so uncontended calls pay no batching delay. Items that queue up
+    while a batch runs are batched next: the dispatcher thread waits until
+    ``max_batch_size`` compatible items (same call kwargs) are queued or the
+    oldest has waited ``max_wait_ms``, then hands the batch to ``run_batch``,
+    which must return one output per input.
+    """
+
+    def __init__(self, name: str, run_batch, max_batch_size: int = 8, max_wait_ms: float = 10):
+        self.name = name
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.batch_sizes = BATCH_SIZES.labels(batcher=name)
+        self.queue_wait = BATCH_QUEUE_WAIT.labels(batcher=name)
+        self._queue = []
+        self._running = False  # a batch is being run
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def submit(self, value, **kwargs):
+        """Queue one input and block until its batch has run"""
+        return self.submit_many([value], **kwargs)[0]
+
+    def submit_many(self, values, **kwargs) -> list:
+        """Queue several inputs at once and block until all of them have run"""
+        with request_metrics.stage("generation"):
+            items = [_BatchItem(value, kwargs) for value in values]
+            with self._cond:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._dispatch_loop, name=f"batcher-{self.name}", daemon=True)
+                    self._thread.start()
+                contended = self._running or bool(self._queue)
+                for item in items:
+                    item.contended = contended
+                self._queue.extend(items)
+                self._cond.notify_all()
+            for item in items:
+                item.done.wait()
+        for item in items:
+            if item.error is not None:
+                raise item.error
+        return [item.result for item in items]
+
+    def _next_batch(self) -> list:
+        with self._cond:
+            self._running = False
+            while not self._queue:
+                self._cond.wait()
+            self._running = True
+            first = self._queue[0]
+            # Items that arrived at an idle batcher run at once; there is nothing to batch them with
+            deadline = first.enqueued_at + (self.max_wait if first.contended else 0)
+            while True:
+                matching = [item for item in self._queue if item.key == first.key][:self.max_batch_size]
+                remaining = deadline - time.perf_counter()
+                if len(matching) >= self.max_batch_size or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            taken = set(map(id, matching))
+            self._queue = [item for item in self._queue if id(item) not in taken]
+            return matching
+
+    def _dispatch_loop(self):
+        while True:
+            batch = self._next_batch()
+            dispatched_at = time.perf_counter()
+            self.batch_sizes.observe(len(batch))
+            for item in batch:
+                self.queue_wait.observe(dispatched_at - item.enqueued_at)
+
+            try:
+                with request_metrics.attach(item.captured for item in batch):
+                    outputs = self.run_batch([item.value for item in batch], **batch[0].kwargs)
+                if len(outputs) != len(batch):
+                    raise RuntimeError(f"{self.name} returned {len(outputs)} outputs for {len(batch)} inputs")
+                for item, output in zip(batch, outputs):
+                    item.result = output
+            except Exception as e:
+                for item in batch:
+                    item.error = e
+            finally:
+                for item in batch:
+                    item.done.set()
+
+    def stats(self) -> dict:
+        with self._cond:
+            queued = len(self._queue)
+        return {
+            "queued": queued,
+            "maxBatchSize": self.max_batch_size,
+            "maxWaitMs": self.max_wait * 1000,
+            "batchSize": self.batch_sizes.snapshot(),
+            "queueWaitSeconds": self.queue_wait.snapshot(),
+        }
+
+
+PageResult = namedtuple("PageResult", ["url", "text", "error", "status", "headers"])
+
+
+class PageFetcher:
+    """Fetch pages concurrently over pooled keep-alive connections.
+
+    At most ``per_host_limit`` requests run against one host at a time, and
+    ``fetch_all`` gives up on whatever has not finished by its deadline.
+    """
+
+    def __init__(self, max_workers: int = 8, per_host_limit: int = 2, timeout: float = 5.0):
+        self.timeout = timeout
+        self.per_host_limit = max(1, per_host_limit)
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = "Mozilla/5.0"
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=self.per_host_limit)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="fetch")
+        self._host_slots = {}
+        self._lock = threading.Lock()
+
+    def _host_slot(self, host: str) -> threading.Semaphore:
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.Semaphore(self.per_host_limit)
+            return self._host_slots[host]
+
+    def fetch_all(self, urls: list, deadline: float) -> list:
+        """Return a PageResult for each URL in order; fetches unfinished at the deadline fail"""
+        expires_at = time.monotonic() + deadline
+        futures = [self._executor.submit(self.fetch, url, expires_at) for url in urls]
+        done, _ = wait(futures, timeout=deadline)
+
+        pages = []
+        for url, future in zip(urls, futures):
+            if future in done:
+                pages.append(future.result())
+            else:
+                future.cancel()
+                pages.append(PageResult(url, None, f"no response within the {deadline:g}s search deadline", None, {}))
+        return pages
+
+    def fetch(self, url: str, expires_at: float = None, headers: dict = None) -> PageResult:
+        """Fetch one page in the calling thread, respecting the per-host limit"""
+        if expires_at is None:
+            expires_at = time.monotonic() + self.timeout
+        slot = self._host_slot(urlparse(url).netloc)
+        remaining = expires_at - time.monotonic()
+        if remaining <= 0 or not slot.acquire(timeout=remaining):
+            return PageResult(url, None, "search deadline exceeded while waiting for the host", None, {})
+        try:
+            remaining = expires_at - time.monotonic()
+            response = self.session.get(url, headers=headers, timeout=max(0.1, min(self.timeout, remaining)))
+            return PageResult(url, response.text, None, response.status_code, dict(response.headers))
+        except Exception as e:
+            return PageResult(url, None, str(e), None, {})
+        finally:
+            slot.release()
+
 
 class HybridAIAgent:
+    # Checkpoint behind each registered pipeline
+    MODEL_IDS = {
+        "flan": "google/flan-t5-base",
+        "blender": "facebook/blenderbot-400M-distill",
+        "summarizer": "google/flan-t5-large",
+        "qa": "distilbert-base-uncased-distilled-squad",
+    }
+
     def __init__(self):
+        # Thread pools must be sized before the first inference runs
+        self.threads = model_optimization.configure_threads(
+            os.environ.get("AI_AGENT_INTRA_OP_THREADS"), os.environ.get("AI_AGENT_INTER_OP_THREADS")
+        )
+        self.precision = os.environ.get("AI_AGENT_PRECISION", "fp32")
+        self.models = ModelRegistry(os.environ.get("AI_AGENT_MODEL_MEMORY_MB"))
         self.initialize_models()
-        self.rag_service_path = os.path.join(os.path.dirname(__file__), "rag-service.py")
+        self.rag_cache = rag_service.RAGIndexCache(
+            max_entries=int(os.environ.get("RAG_INDEX_CACHE_SIZE", "16")),
+            ttl_seconds=float(os.environ.get("RAG_INDEX_CACHE_TTL", "3600")),
+        )
+        self.fetcher = PageFetcher(
+            max_workers=int(os.environ.get("WEB_FETCH_WORKERS", "8")),
+            per_host_limit=int(os.environ.get("WEB_FETCH_PER_HOST", "2")),
+            timeout=float(os.environ.get("WEB_FETCH_TIMEOUT", "5")),
+        )
+        self.search_deadline = float(os.environ.get("WEB_SEARCH_DEADLINE", "10"))
+        self.qa_mode = os.environ.get("QA_MODE", "context")
+        self.qa_top_k = int(os.environ.get("QA_TOP_K", "5"))
+        self.qa_retrieval_weight = float(os.environ.get("QA_RETRIEVAL_WEIGHT", "0.3"))
+        self.summary_mode = os.environ.get("SUMMARY_MODE", "rag")
+        self.summary_window_tokens = int(os.environ.get("SUMMARY_WINDOW_TOKENS", "512"))
+        self.summary_map_tokens = int(os.environ.get("SUMMARY_MAP_TOKENS", "96"))
+        self.summary_batch_size = int(os.environ.get("SUMMARY_BATCH_SIZE", "8"))
+        self._summary_pool = ThreadPoolExecutor(
+            max_workers=max(1, int(os.environ.get("SUMMARY_PARALLELISM", "1"))), thread_name_prefix="summary"
+        )
+        self.web_cache = web_cache.WebCache(
+            path=os.path.join(os.environ.get("WEB_CACHE_DIR", os.path.join(os.getcwd(), ".web-cache")), "cache.sqlite3"),
+            max_bytes=int(float(os.environ.get("WEB_CACHE_MAX_MB", "256")) * 1024 * 1024),
+            stale_seconds=float(os.environ.get("WEB_CACHE_STALE_SECONDS", "86400")),
+        )
+        similarity = float(os.environ.get("RESPONSE_CACHE_SIMILARITY", "0"))
+        self.response_cache = response_cache.ResponseCache(
+            max_entries=int(os.environ.get("RESPONSE_CACHE_SIZE", "1024")),
+            ttl_seconds=float(os.environ.get("RESPONSE_CACHE_TTL", "3600")),
+            persist_path=os.environ.get("RESPONSE_CACHE_PATH") or None,
+            vectorizer=rag_service.hashing_vectorizer() if similarity > 0 else None,
+            similarity_threshold=similarity if similarity > 0 else None,
+        )
+        self.search_ttl = float(os.environ.get("WEB_CACHE_SEARCH_TTL", "3600"))
+        self.page_ttl = float(os.environ.get("WEB_CACHE_PAGE_TTL", "3600"))
+        self.profiler = request_metrics.RequestProfiler(
+            sample_rate=float(os.environ.get("AI_AGENT_PROFILE_SAMPLE_RATE", "0")),
+            directory=os.environ.get("AI_AGENT_PROFILE_DIR") or None,
+            fmt=os.environ.get("AI_AGENT_PROFILE_FORMAT", "cprofile"),
+        )
+        self._tokenizers = {}
+        self._tokenizers_lock = threading.Lock()
         
     def initialize_models(self):
-        """Initialize all AI models"""
-        try:
-            # FLAN-T5 for factual Q&A
-            print("Loading FLAN-T5 for factual responses...", file=sys.stderr)
-            flan_model_name = 'google/flan-t5-base'
-            self.flan_tokenizer = AutoTokenizer.from_pretrained(flan_model_name)
-            self.flan_model = AutoModelForSeq2SeqLM.from_pretrained(flan_model_name)
-            self.flan_pipeline = pipeline(
-                "text2text-generation",
-                model=self.flan_model,
-                tokenizer=self.flan_tokenizer
+        """Register loaders for all AI models; each is loaded the first time a tool needs it"""
+        self.models.register("flan", self._load_flan)
+        self.models.register("blender", self._load_blender)
+        self.models.register("summarizer", self._load_summarizer)
+        self.models.register("qa", self._load_qa)
+
+        # Concurrent requests to the same pipeline share one batched forward pass
+        max_batch_size = int(os.environ.get("AI_AGENT_BATCH_MAX_SIZE", "8"))
+        max_wait_ms = float(os.environ.get("AI_AGENT_BATCH_MAX_WAIT_MS", "10"))
+        self.batchers = {
+            name: MicroBatcher(name, run_batch, max_batch_size, max_wait_ms)
+            for name, run_batch in (
+                ("flan", self._generation_batch("flan")),
+                ("blender", self._generation_batch("blender")),
+                ("summarizer", self._generation_batch("summarizer")),
+                ("qa", self._qa_batch),
             )
-            
-            # BlenderBot for casual chat
-            print("Loading BlenderBot for casual conversations...", file=sys.stderr)
-            blender_model_name = "facebook/blenderbot-400M-distill"
-            self.blender_tokenizer = AutoTokenizer.from_pretrained(blender_model_name)
-            self.blender_model = AutoModelForSeq2SeqLM.from_pretrained(blender_model_name)
-            self.blender_pipeline = pipeline(
-                "text2text-generation",
-                model=self.blender_model,
-                tokenizer=self.blender_tokenizer
+        }
+
+    def _generation_batch(self, name: str):
+        """Batch runner for a generation pipeline; each output is that input's result list"""
+        def run(inputs, **kwargs):
+            with torch.inference_mode():
+                outputs = self.models.get(name)(inputs, batch_size=len(inputs), **kwargs)
+            return [output if isinstance(output, list) else [output] for output in outputs]
+        return run
+
+    def _qa_batch(self, inputs, **kwargs):
+        with torch.inference_mode():
+            outputs = self.qa_pipeline(
+                question=[item["question"] for item in inputs],
+                context=[item["context"] for item in inputs],
+                batch_size=len(inputs),
+                **kwargs
             )
-            
-            # Summarization pipeline
-            self.summarizer = pipeline("summarization", model="google/flan-t5-large", tokenizer="google/flan-t5-large")
-            
-            # Q&A pipeline
-            self.qa_pipeline = pipeline("question-answering", model="distilbert-base-uncased-distilled-squad")
-            
-            print("All models loaded successfully!", file=sys.stderr)
-            
+        # A single question comes back as a bare dict
+        return outputs if isinstance(outputs, list) else [outputs]
+
+    def _optimize(self, model_pipeline, allow_bf16: bool = True):
+        """Apply the configured precision to a freshly loaded pipeline's model"""
+        model_pipeline.model, applied = model_optimization.optimize_model(
+            model_pipeline.model, self.precision, allow_bf16=allow_bf16
+        )
+        print(f"Using {applied} weights for {type(model_pipeline.model).__name__}", file=sys.stderr)
+        return model_pipeline
+
+    def _load_flan(self):
+        # FLAN-T5 for factual Q&A
+        print("Loading FLAN-T5 for factual responses...", file=sys.stderr)
+        flan_model_name = self.MODEL_IDS["flan"]
+        flan_tokenizer = AutoTokenizer.from_pretrained(flan_model_name)
+        flan_model = AutoModelForSeq2SeqLM.from_pretrained(flan_model_name)
+        return self._optimize(pipeline(
+            "text2text-generation",
+            model=flan_model,
+            tokenizer=flan_tokenizer
+        ))
+
+    def _load_blender(self):
+        # BlenderBot for casual chat
+        print("Loading BlenderBot for casual conversations...", file=sys.stderr)
+        blender_model_name = self.MODEL_IDS["blender"]
+        blender_tokenizer = AutoTokenizer.from_pretrained(blender_model_name)
+        blender_model = AutoModelForSeq2SeqLM.from_pretrained(blender_model_name)
+        return self._optimize(pipeline(
+            "text2text-generation",
+            model=blender_model,
+            tokenizer=blender_tokenizer
+        ))
+
+    def _load_summarizer(self):
+        # Summarization pipeline
+        print("Loading FLAN-T5 Large for summarization...", file=sys.stderr)
+        return self._optimize(
+            pipeline("summarization", model=self.MODEL_IDS["summarizer"], tokenizer=self.MODEL_IDS["summarizer"])
+        )
+
+    def _load_qa(self):
+        # Q&A pipeline
+        print("Loading DistilBERT for question answering...", file=sys.stderr)
+        # QA post-processing converts logits to NumPy, which has no bf16
+        return self._optimize(
+            pipeline("question-answering", model=self.MODEL_IDS["qa"]), allow_bf16=False
+        )
+
+    @property
+    def flan_pipeline(self):
+        return self.models.get("flan")
+
+    @property
+    def blender_pipeline(self):
+        return self.models.get("blender")
+
+    @property
+    def summarizer(self):
+        return self.models.get("summarizer")
+
+    @property
+    def qa_pipeline(self):
+        return self.models.get("qa")
+
+    def tokenizer(self, name: str):
+        """Tokenizer of a registered model, loaded on its own so counting tokens never loads weights"""
+        with self._tokenizers_lock:
+            if name not in self._tokenizers:
+                self._tokenizers[name] = AutoTokenizer.from_pretrained(self.MODEL_IDS[name])
+            return self._tokenizers[name]
+
+    def token_counts(self, name: str, inputs: list, output: str) -> tuple:
+        """(input, output) token counts under a model's tokenizer; inputs are texts or (question, context) pairs.
+
+        Input counts include the model's special tokens and are not truncated;
+        (None, None) if the tokenizer is unavailable.
+        """
+        try:
+            with request_metrics.stage("tokenization"):
+                tokenizer = self.tokenizer(name)
+                input_tokens = sum(
+                    len(tokenizer(*item if isinstance(item, tuple) else (item,))["input_ids"]) for item in inputs
+                )
+                output_tokens = len(tokenizer(output, add_special_tokens=False)["input_ids"])
+            return input_tokens, output_tokens
         except Exception as e:
-            print(f"Error loading models: {e}", file=sys.stderr)
-            raise
+            print(f"Could not count {name} tokens: {e}", file=sys.stderr)
+            return None, None
 
     def clean_text(self, text: str) -> str:
         """Normalize whitespace in the text"""
         return re.sub(r'\s+', ' ', text).strip()
 
+    @staticmethod
+    def document_ref(doc: dict) -> dict:
+        """RAG document entry for a session document sent by reference (contentHash) or with its content"""
+        if doc.get("contentHash"):
+            return {"id": doc.get("id", ""), "content_hash": doc["contentHash"]}
+        return {"id": doc.get("id", ""), "content": doc.get("content", "")}
+
     def call_rag_service(self, action: str, data: dict) -> dict:
-        """Call the RAG service for vector operations"""
+        """Run a RAG action in-process, reusing cached indexes for known document sets"""
         try:
-            rag_request = {"action": action, **data}
-            process = subprocess.Popen(
-                ["python3", self.rag_service_path],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            
-            stdout, stderr = process.communicate(input=json.dumps(rag_request))
-            
-            if process.returncode == 0:
-                return json.loads(stdout)
-            else:
-                print(f"RAG service error: {stderr}", file=sys.stderr)
-                return {"status": "error", "message": f"RAG service failed: {stderr}"}
+            return rag_service.handle_request({"action": action, **data}, self.rag_cache)
         except Exception as e:
+            print(f"RAG service error: {e}", file=sys.stderr)
             return {"status": "error", "message": f"RAG service call failed: {e}"}
 
     def extract_text_from_pdf(self, file_path: str) -> str:
@@ -111,30 +537,35 @@ class HybridAIAgent:
             return ""
 
 
-    def summarize_text(self, text: str, max_new_tokens: int = 130, use_rag: bool = True) -> str:
+    def summary_input(self, text: str, use_rag: bool = True, rag_backend: str = None) -> str:
+        """Text the summarizer sees: RAG-selected key sections for long documents"""
+        # For long documents, use RAG to identify key sections
+        if not (use_rag and len(text) > 2000):
+            return text
+
+        rag_result = self.call_rag_service("retrieve_context", {
+            "query": "main points key information important details summary",
+            "backend": rag_backend,
+            "documents": [{"id": "summary_doc", "content": text}]
+        })
+
+        if rag_result.get("status") == "success" and rag_result.get("context"):
+            # Use RAG-identified key sections for summarization
+            print(f"RAG identified {rag_result.get('chunks_found', 0)} key sections for summarization", file=sys.stderr)
+            return rag_result["context"]
+
+        # Fallback to truncating long text
+        return text[:2000] + "..."
+
+    def summarize_text(self, text: str, max_new_tokens: int = 130, use_rag: bool = True, rag_backend: str = None) -> str:
         """Summarize text using Hugging Face summarization pipeline with optional RAG enhancement"""
         try:
             if not text or len(text.split()) < 5:
                 return "⚠️ Not enough content to summarize."
 
-            # For long documents, use RAG to identify key sections
-            if use_rag and len(text) > 2000:
-                rag_result = self.call_rag_service("retrieve_context", {
-                    "query": "main points key information important details summary",
-                    "documents": [{"id": "summary_doc", "content": text}]
-                })
-                
-                if rag_result.get("status") == "success" and rag_result.get("context"):
-                    # Use RAG-identified key sections for summarization
-                    text_to_summarize = rag_result["context"]
-                    print(f"RAG identified {rag_result.get('chunks_found', 0)} key sections for summarization", file=sys.stderr)
-                else:
-                    # Fallback to truncating long text
-                    text_to_summarize = text[:2000] + "..." if len(text) > 2000 else text
-            else:
-                text_to_summarize = text
+            text_to_summarize = self.summary_input(text, use_rag, rag_backend)
 
-            summary = self.summarizer(
+            summary = self.batchers["summarizer"].submit(
                 text_to_summarize,
                 max_new_tokens=max_new_tokens,
                 do_sample=False,
@@ -143,120 +574,433 @@ class HybridAIAgent:
         except Exception as e:
             return f"⚠️ Error summarizing content: {e}"
 
+    def summarize_document(self, text: str, max_new_tokens: int = 130, on_level=None) -> str:
+        """Summarize a whole document with map-reduce instead of a retrieved excerpt"""
+        try:
+            if not text or len(text.split()) < 5:
+                return "⚠️ Not enough content to summarize."
+            return self.summarize_hierarchical(text, max_new_tokens, on_level)
+        except Exception as e:
+            return f"⚠️ Error summarizing content: {e}"
+
+    def summarize_hierarchical(self, text: str, max_new_tokens: int = 130, on_level=None) -> str:
+        """Map-reduce summarization that covers the whole text.
+
+        The map step summarizes every chunk; each reduce level packs the partial
+        summaries into groups that fit the model window and summarizes those,
+        until everything fits in one final pass. No input is ever longer than the
+        window, so the model never truncates one. ``on_level`` receives a dict
+        with the level's input/output counts and timing as each level finishes.
+        """
+        tokenizer = self.summarizer.tokenizer
+
+        def count_tokens(text):
+            return len(tokenizer(text, add_special_tokens=False)["input_ids"])
+
+        # Chunk and pack by the summarizer's own token counts, leaving room for its special tokens
+        window = self.summary_window_tokens - tokenizer.num_special_tokens_to_add()
+        chunker = rag_service.TokenChunker(max_tokens=window, overlap=20, tokenizer=tokenizer)
+        inputs = chunker.chunk_text(text)
+
+        level = 0
+        while True:
+            final = len(inputs) == 1
+            start = time.time()
+            outputs = self.summarize_batches(inputs, max_new_tokens if final else self.summary_map_tokens)
+            report = {
+                "level": level,
+                "step": "final" if final else ("map" if level == 0 else "reduce"),
+                "inputs": len(inputs),
+                "outputs": len(outputs),
+                "seconds": round(time.time() - start, 2),
+            }
+            print(f"Summary {report['step']} level {level}: {len(inputs)} -> {len(outputs)} in {report['seconds']}s", file=sys.stderr)
+            if on_level:
+                on_level(report)
+            if final:
+                return outputs[0]
+
+            inputs = self._pack_summaries(outputs, window, count_tokens, chunker)
+            if len(inputs) >= len(outputs):
+                # Partial summaries too long to pair up would be reduced forever
+                raise ValueError(
+                    f"Partial summaries do not fit {window}-token reduce groups in pairs; "
+                    "raise SUMMARY_WINDOW_TOKENS or lower SUMMARY_MAP_TOKENS"
+                )
+            level += 1
+
+    @staticmethod
+    def _pack_summaries(summaries: list, window: int, count_tokens, chunker) -> list:
+        """Join consecutive summaries into groups of at most window tokens, separators included.
+
+        A summary that does not fit the window on its own is split into chunks by chunker.
+        """
+        groups, current = [], None
+        for summary in summaries:
+            if count_tokens(summary) > window:
+                if current is not None:
+                    groups.append(current)
+                    current = None
+                groups.extend(chunker.chunk_text(summary))
+                continue
+            candidate = summary if current is None else f"{current}\n{summary}"
+            if current is not None and count_tokens(candidate) > window:
+                groups.append(current)
+                candidate = summary
+            current = candidate
+        if current is not None:
+            groups.append(current)
+        return groups
+
+    def summarize_batches(self, texts: list, max_new_tokens: int) -> list:
+        """Summarize texts in fixed-size batches, running up to summary_parallelism batches at once"""
+        run_batch = self.batchers["summarizer"].run_batch
+        batches = [texts[i:i + self.summary_batch_size] for i in range(0, len(texts), self.summary_batch_size)]
+        captured = request_metrics.capture()
+
+        def run(batch):
+            with request_metrics.attach([captured]):
+                return run_batch(batch, max_new_tokens=max_new_tokens, do_sample=False)
+
+        with request_metrics.stage("generation"):
+            results = list(self._summary_pool.map(run, batches))
+        return [output[0]["summary_text"] for batch_outputs in results for output in batch_outputs]
+
+    def summarize_many(self, texts: list, max_new_tokens: int = 130) -> list:
+        """Summarize several short texts together in batched forward passes, reusing cached summaries"""
+        keys = [web_cache.content_key(text, max_new_tokens) for text in texts]
+        summaries = [self.web_cache.get("summary", key)[0] for key in keys]
+        missing = [i for i, summary in enumerate(summaries) if summary is None]
+        if not missing:
+            return summaries
+
+        try:
+            outputs = self.batchers["summarizer"].submit_many(
+                [texts[i] for i in missing], max_new_tokens=max_new_tokens, do_sample=False
+            )
+        except Exception as e:
+            for i in missing:
+                summaries[i] = f"⚠️ Error summarizing content: {e}"
+            return summaries
+
+        for i, output in zip(missing, outputs):
+            summaries[i] = output[0]['summary_text']
+            self.web_cache.put("summary", keys[i], summaries[i])
+        return summaries
+
     def web_search(self, query: str, summarize: bool = True, max_results: int = 2, max_text_length: int = 1500) -> str:
         """Search the web and return summarized or raw content from top pages"""
         blocked_domains = ["tiktok.com", "pinterest.com", "facebook.com", "instagram.com", "youtube.com"]
         
         try:
-            with DDGS() as ddgs:
-                results = ddgs.text(query, max_results=max_results)
-                if not results:
-                    return "❌ No relevant search results found."
+            results = self.web_cache.get_or_load(
+                "search",
+                f"{max_results}:{web_cache.normalize_query(query)}",
+                lambda: self.search_results(query, max_results),
+                ttl=self.search_ttl,
+                # No results is often a transient rate limit, so the next search retries
+                cacheable=bool,
+            )
+            if not results:
+                return "❌ No relevant search results found."
 
-                contents = []
-                seen_urls = set()
+            urls = []
+            for r in results:
+                url = r['href']
+                # Skip duplicates or blocked domains
+                if url in urls or any(domain in url for domain in blocked_domains):
+                    continue
+                urls.append(url)
 
-                for r in results:
-                    url = r['href']
+            return self.fetch_and_summarize(urls, summarize=summarize, max_text_length=max_text_length)
+        except Exception as e:
+            return f"❌ Error performing web search: {e}"
 
-                    # Skip duplicates or blocked domains
-                    if url in seen_urls or any(domain in url for domain in blocked_domains):
-                        continue
-                    seen_urls.add(url)
+    def search_results(self, query: str, max_results: int) -> list:
+        with request_metrics.stage("web_search"), DDGS() as ddgs:
+            return list(ddgs.text(query, max_results=max_results) or [])
 
-                    try:
-                        headers = {"User-Agent": "Mozilla/5.0"}
-                        response = requests.get(url, headers=headers, timeout=5)
-                        html = response.text
+    def page_text(self, page: PageResult) -> str:
+        """Extract a fetched page's main text and cache it under the page's validators"""
+        main_text = self.extract_main_text_from_html(page.text)
+        ttl = web_cache.max_age(page.headers, self.page_ttl)
+        if page.status == 200 and ttl is not None:
+            self.web_cache.put(
+                "page", page.url, main_text, ttl,
+                etag=page.headers.get("ETag"), last_modified=page.headers.get("Last-Modified"),
+            )
+        return main_text
 
-                        main_text = self.extract_main_text_from_html(html)
-                        if not main_text or len(main_text.split()) < 50:
-                            contents.append(f"From: {url}\n⚠️ Skipped — content too short or empty.\n")
-                            continue
+    def revalidate_page(self, url: str, validators: dict):
+        """Conditionally refetch a stale page; a 304 only extends the cached copy's lifetime"""
+        headers = {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
 
-                        if len(main_text) > max_text_length:
-                            main_text = main_text[:max_text_length] + "..."
+        page = self.fetcher.fetch(url, headers=headers)
+        if page.status == 304:
+            self.web_cache.touch("page", url, web_cache.max_age(page.headers, self.page_ttl) or self.page_ttl)
+        elif page.error is None:
+            self.page_text(page)
 
-                        summary = self.summarize_text(main_text) if summarize else "🔎 Summarization disabled."
+    def fetch_and_summarize(self, urls: list, summarize: bool = True, max_text_length: int = 1500) -> str:
+        """Fetch uncached pages concurrently within the search deadline, then summarize them in one batch"""
+        contents = [None] * len(urls)
+        page_texts = {}
+        errors = {}
 
-                        contents.append(
-                            f"From: {url}\n\n📝 Extracted Content:\n{main_text}\n\n🔍 Summary:\n{summary}"
-                        )
+        to_fetch = []
+        for url in urls:
+            main_text, state, validators = self.web_cache.get("page", url)
+            if state is None:
+                to_fetch.append(url)
+                continue
+            page_texts[url] = main_text
+            if state == web_cache.STALE:
+                self.web_cache.refresh("page", url, lambda url=url, validators=validators: self.revalidate_page(url, validators))
 
-                    except Exception as e:
-                        contents.append(f"From: {url}\n❌ Error fetching content: {e}")
+        with request_metrics.stage("web_fetch"):
+            pages = self.fetcher.fetch_all(to_fetch, self.search_deadline)
+        for page in pages:
+            if page.error is not None:
+                errors[page.url] = page.error
+            else:
+                page_texts[page.url] = self.page_text(page)
 
-                return "\n\n---\n\n".join(contents) if contents else "❌ No valid content could be fetched."
-        except Exception as e:
-            return f"❌ Error performing web search: {e}"
+        extracted = []  # (position, url, main text)
+        for i, url in enumerate(urls):
+            if url in errors:
+                contents[i] = f"From: {url}\n❌ Error fetching content: {errors[url]}"
+                continue
+
+            main_text = page_texts[url]
+            if not main_text or len(main_text.split()) < 50:
+                contents[i] = f"From: {url}\n⚠️ Skipped — content too short or empty.\n"
+                continue
 
-    def answer_question(self, context: str, question: str, use_rag: bool = True) -> str:
+            if len(main_text) > max_text_length:
+                main_text = main_text[:max_text_length] + "..."
+            extracted.append((i, url, main_text))
+
+        if summarize:
+            summaries = self.summarize_many([text for _, _, text in extracted])
+        else:
+            summaries = ["🔎 Summarization disabled."] * len(extracted)
+
+        for (i, url, main_text), summary in zip(extracted, summaries):
+            contents[i] = f"From: {url}\n\n📝 Extracted Content:\n{main_text}\n\n🔍 Summary:\n{summary}"
+
+        return "\n\n---\n\n".join(contents) if contents else "❌ No valid content could be fetched."
+
+    def qa_context(self, context: str, question: str, use_rag: bool = True, rag_backend: str = None) -> str:
+        """Context the QA model sees: the chunks most relevant to the question for longer documents"""
+        # Use RAG to find relevant context if enabled
+        if not (use_rag and len(context) > 1000):  # Only use RAG for longer documents
+            return context
+
+        rag_result = self.call_rag_service("retrieve_context", {
+            "query": question,
+            "backend": rag_backend,
+            "documents": [{"id": "current_doc", "content": context}]
+        })
+
+        if rag_result.get("status") == "success" and rag_result.get("context"):
+            print(f"RAG enhanced context with {rag_result.get('chunks_found', 0)} relevant chunks", file=sys.stderr)
+            return rag_result["context"]
+        return context
+
+    def answer_question(self, context: str, question: str, use_rag: bool = True, rag_backend: str = None) -> str:
         """Answer question based on context using Q&A pipeline with optional RAG enhancement"""
         try:
             if not context.strip():
                 return "❌ No context provided for answering the question."
             
-            enhanced_context = context
-            
-            # Use RAG to find relevant context if enabled
-            if use_rag and len(context) > 1000:  # Only use RAG for longer documents
-                rag_result = self.call_rag_service("retrieve_context", {
-                    "query": question,
-                    "documents": [{"id": "current_doc", "content": context}]
-                })
-                
-                if rag_result.get("status") == "success" and rag_result.get("context"):
-                    enhanced_context = rag_result["context"]
-                    print(f"RAG enhanced context with {rag_result.get('chunks_found', 0)} relevant chunks", file=sys.stderr)
+            enhanced_context = self.qa_context(context, question, use_rag, rag_backend)
             
             # Use the original Q&A pipeline but with enhanced context
-            result = self.qa_pipeline(question=question, context=enhanced_context)
+            result = self.batchers["qa"].submit({"question": question, "context": enhanced_context})
             return result['answer']
             
         except Exception as e:
             return f"❌ Error answering question: {e}"
 
+    def qa_chunks(self, context: str, question: str, k: int, rag_backend: str = None) -> list:
+        """The k chunks of the context most relevant to the question, best first"""
+        rag_result = self.call_rag_service("retrieve_batch", {
+            "queries": [question],
+            "k": k,
+            "backend": rag_backend,
+            "documents": [{"id": "current_doc", "content": context}]
+        })
+        if rag_result.get("status") != "success":
+            return []
+        return rag_result["results"][0]["relevant_chunks"]
+
+    def answer_from_chunks(self, question: str, chunks: list) -> dict:
+        """Run QA over each chunk separately in one batch and pick the best span.
+
+        Span scores are blended with the chunks' retrieval scores (normalized to
+        the best chunk) using qa_retrieval_weight. Offsets are character offsets
+        into the source chunk.
+        """
+        outputs = self.batchers["qa"].submit_many(
+            [{"question": question, "context": chunk["content"]} for chunk in chunks]
+        )
+        best_retrieval = max(chunk["similarity_score"] for chunk in chunks) or 1.0
+        best = None
+        for chunk, output in zip(chunks, outputs):
+            retrieval_score = chunk["similarity_score"] / best_retrieval
+            score = (1 - self.qa_retrieval_weight) * output["score"] + self.qa_retrieval_weight * retrieval_score
+            if best is None or score > best["score"]:
+                best = {
+                    "answer": output["answer"],
+                    "chunkId": chunk["chunk_id"],
+                    "documentId": chunk["document_id"],
+                    "start": int(output["start"]),
+                    "end": int(output["end"]),
+                    "score": round(float(score), 4),
+                    "spanScore": round(float(output["score"]), 4),
+                    "retrievalScore": round(float(chunk["similarity_score"]), 4),
+                }
+        return best
+
+    def answer_chunks_json(self, question: str, chunks: list) -> str:
+        try:
+            return json.dumps(self.answer_from_chunks(question, chunks))
+        except Exception as e:
+            return f"❌ Error answering question: {e}"
+
     def is_factual_question(self, text: str) -> bool:
         """Decide if the input looks like a factual query"""
         text_lower = text.lower().strip()
         return text_lower.startswith(("what", "how", "when", "where", "why")) or text_lower.endswith("?")
 
-    def flan_answer(self, user_input: str) -> str:
+    def flan_answer(self, user_input: str, on_token=None) -> str:
         """Use FLAN-T5 for factual Q&A"""
         try:
-            result = self.flan_pipeline(user_input, max_new_tokens=128, truncation=True)
+            if on_token is not None:
+                return self.stream_generate("flan", user_input, on_token, max_new_tokens=128)
+            result = self.batchers["flan"].submit(user_input, max_new_tokens=128, truncation=True)
             return result[0]["generated_text"]
         except Exception as e:
             return f"❌ Error generating factual response: {e}"
 
-    def blender_chat(self, user_input: str) -> str:
+    def blender_chat(self, user_input: str, on_token=None) -> str:
         """Use BlenderBot for casual conversation"""
         try:
             if not user_input.strip():
                 return "Please type something."
-            response = self.blender_pipeline(user_input, max_new_tokens=100)
+            if on_token is not None:
+                return self.stream_generate("blender", user_input, on_token, max_new_tokens=100).strip()
+            response = self.batchers["blender"].submit(user_input, max_new_tokens=100)
             return response[0]["generated_text"].strip()
         except Exception as e:
             return f"❌ Error generating chat response: {e}"
 
-    def process_request(self, request_data):
-        """Main processing function with RAG enhancement"""
+    def stream_generate(self, name: str, prompt: str, on_token, **generate_kwargs) -> str:
+        """Generate with the named pipeline's model, passing each decoded piece to on_token as it is produced.
+
+        Streaming requests skip the micro-batcher: generation runs on its own
+        thread and this thread relays text from a TextIteratorStreamer.
+        """
+        model_pipeline = self.models.get(name)
+        tokenizer = model_pipeline.tokenizer
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        with request_metrics.stage("tokenization"):
+            inputs = tokenizer(prompt, return_tensors="pt", truncation=True)
+        failure = []
+
+        def generate():
+            try:
+                with torch.inference_mode():
+                    model_pipeline.model.generate(**inputs, streamer=streamer, **generate_kwargs)
+            except Exception as e:
+                failure.append(e)
+                streamer.end()
+
+        generator = threading.Thread(target=generate, name=f"stream-{name}", daemon=True)
+        pieces = []
+        with request_metrics.stage("generation"):
+            generator.start()
+            for text in streamer:
+                if text:
+                    pieces.append(text)
+                    on_token(text)
+            generator.join()
+        if failure:
+            raise failure[0]
+        return "".join(pieces)
+
+    def process_request(self, request_data, on_event=None):
+        """Main processing function with RAG enhancement.
+
+        ``on_event`` receives streaming events; chat generation then reports
+        each new piece of text as ``{"type": "token", "text": ...}``.
+        Metadata carries the request's ``stageTimings`` and, for a request the
+        profiler sampled, the path of its ``profile``.
+        """
+        tool_type = request_data.get('toolType', 'chat')
+        start_time = time.time()
+        with request_metrics.trace() as request_trace, self.profiler.profile(tool_type) as profile:
+            result = self._process_request(request_data, on_event)
+
+        metadata = result["metadata"]
+        metadata["stageTimings"] = request_trace.timings()
+        if profile.get("path"):
+            metadata["profile"] = profile["path"]
+        failed = metadata["model"] == "Error" or result["response"].startswith(("❌", "⚠️"))
+        request_metrics.observe_request(
+            tool_type, time.time() - start_time, "error" if failed else "ok", metadata.get("cacheHit", False),
+            metadata.get("inputTokens"), metadata.get("outputTokens"),
+        )
+        return result
+
+    def _process_request(self, request_data, on_event=None):
         start_time = time.time()
+        first_token_at = []
+
+        def on_token(text):
+            if not first_token_at:
+                first_token_at.append(time.time())
+            on_event({"type": "token", "text": text})
         
         query = request_data.get('query', '').strip()
         tool_type = request_data.get('toolType', 'chat')
         document_content = request_data.get('documentContent', '')
         session_documents = request_data.get('sessionDocuments', [])
+        rag_backend = request_data.get('ragBackend')
         
         # Use RAG for enhanced context when session documents are available
         use_rag = len(session_documents) > 0
         rag_context = ""
+        query_embedding = None
+        cached = None
+        extra_metadata = {}
+        # Model whose tokenizer counts the request's tokens, and the inputs it was given
+        token_model, token_inputs = None, []
         
         try:
             if tool_type == 'summary':
-                if document_content:
-                    response = self.summarize_text(document_content, use_rag=use_rag)
+                if document_content and (request_data.get('summaryMode') or self.summary_mode) == 'hierarchical':
+                    levels = []
+                    response, cached = self.response_cache.get_or_generate(
+                        "summary:hierarchical", "", document_content,
+                        lambda: self.summarize_document(document_content, on_level=levels.append),
+                    )
+                    model_used = "FLAN-T5 Large (map-reduce)"
+                    extra_metadata["summaryLevels"] = levels
+                    token_model, token_inputs = "summarizer", [document_content]
+                elif document_content:
+                    # Cache on the text the model actually summarizes
+                    summary_input = self.summary_input(document_content, use_rag, rag_backend)
+                    response, cached = self.response_cache.get_or_generate(
+                        "summary", "", summary_input,
+                        lambda: self.summarize_text(summary_input, use_rag=False),
+                    )
                     model_used = "FLAN-T5 Large + RAG" if use_rag else "FLAN-T5 Large"
+                    token_model, token_inputs = "summarizer", [summary_input]
                 else:
                     response = "❌ No document content provided for summarization."
                     model_used = "None"
@@ -274,11 +1018,34 @@ class HybridAIAgent:
                 
                 response = self.web_search(search_query, summarize=summarize)
                 model_used = "FLAN-T5 Large + Web Search"
+                token_model, token_inputs = "summarizer", [search_query]
                 
             elif tool_type == 'qa':
-                if document_content:
-                    response = self.answer_question(document_content, query, use_rag=use_rag)
+                qa_chunks = []
+                if document_content and (request_data.get('qaMode') or self.qa_mode) == 'chunks':
+                    qa_chunks = self.qa_chunks(document_content, query, self.qa_top_k, rag_backend)
+
+                if qa_chunks:
+                    # Each chunk is its own model input, so no relevance markers reach the model
+                    chunk_key = "\n".join(f"{c['chunk_id']}:{c['content']}" for c in qa_chunks)
+                    response, cached = self.response_cache.get_or_generate(
+                        "qa:chunks", query, chunk_key, lambda: self.answer_chunks_json(query, qa_chunks)
+                    )
+                    if not response.startswith("❌"):
+                        # Cached as JSON so the answer's source survives a cache hit
+                        answer = json.loads(response)
+                        response = answer.pop("answer")
+                        extra_metadata["answerSource"] = answer
+                    model_used = "DistilBERT QA (top-k chunks)"
+                    token_model, token_inputs = "qa", [(query, c["content"]) for c in qa_chunks]
+                elif document_content:
+                    qa_context = self.qa_context(document_content, query, use_rag, rag_backend)
+                    response, cached = self.response_cache.get_or_generate(
+                        "qa", query, qa_context,
+                        lambda: self.answer_question(qa_context, query, use_rag=False),
+                    )
                     model_used = "DistilBERT QA + RAG" if use_rag else "DistilBERT QA"
+                    token_model, token_inputs = "qa", [(query, qa_context)]
                 else:
                     response = "❌ No document content provided for Q&A."
                     model_used = "None"
@@ -290,9 +1057,13 @@ class HybridAIAgent:
                     try:
                         rag_result = self.call_rag_service("retrieve_context", {
                             "query": query,
-                            "documents": [{"id": doc.get("id", ""), "content": doc.get("content", "")} for doc in session_documents]
+                            "session_id": request_data.get("sessionId"),
+                            "backend": rag_backend,
+                            "documents": [self.document_ref(doc) for doc in session_documents]
                         })
                         
+                        # The dense backend returns the query's embedding for the server to store
+                        query_embedding = rag_result.get("query_embedding")
                         if rag_result.get("status") == "success" and rag_result.get("context"):
                             rag_context = rag_result["context"]
                             enhanced_query = f"Context: {rag_context}\n\nQuestion: {query}"
@@ -300,13 +1071,29 @@ class HybridAIAgent:
                     except Exception as e:
                         print(f"RAG enhancement failed for chat: {e}", file=sys.stderr)
                 
+                stream = on_token if on_event is not None else None
                 if self.is_factual_question(query) or rag_context:
-                    response = self.flan_answer(enhanced_query)
+                    response, cached = self.response_cache.get_or_generate(
+                        "chat", query, rag_context, lambda: self.flan_answer(enhanced_query, on_token=stream)
+                    )
                     model_used = "FLAN-T5 Base + RAG" if rag_context else "FLAN-T5 Base"
+                    token_model, token_inputs = "flan", [enhanced_query]
                 else:
-                    response = self.blender_chat(query)
+                    response, cached = self.response_cache.get_or_generate(
+                        "chat", query, rag_context, lambda: self.blender_chat(query, on_token=stream)
+                    )
                     model_used = "BlenderBot 400M"
-            
+                    token_model, token_inputs = "blender", [query]
+
+            # Anything that was not streamed piece by piece arrives as one token
+            if on_event is not None and not first_token_at:
+                on_token(response)
+            if first_token_at:
+                extra_metadata["timeToFirstToken"] = round(first_token_at[0] - start_time, 3)
+
+            input_tokens, output_tokens = (
+                self.token_counts(token_model, token_inputs, response) if token_model else (None, None)
+            )
             processing_time = time.time() - start_time
             
             return {
@@ -314,10 +1101,17 @@ class HybridAIAgent:
                 "metadata": {
                     "model": model_used,
                     "processingTime": round(processing_time, 2),
-                    "tokenCount": len(query.split()) if query else 0,
+                    "tokenCount": (input_tokens or 0) + (output_tokens or 0),
+                    "inputTokens": input_tokens,
+                    "outputTokens": output_tokens,
                     "ragEnhanced": use_rag,
-                    "documentsUsed": len(session_documents) if session_documents else 0
-                }
+                    "documentsUsed": len(session_documents) if session_documents else 0,
+                    "cacheHit": cached is not None,
+                    **({"cacheMatch": cached["match"], "cacheSavedSeconds": round(cached["generation_seconds"], 2)}
+                       if cached else {}),
+                    **extra_metadata,
+                },
+                **({"queryEmbedding": query_embedding} if query_embedding else {}),
             }
             
         except Exception as e:
@@ -333,7 +1127,107 @@ class HybridAIAgent:
                 }
             }
 
+def run_worker():
+    """Serve newline-delimited JSON requests on stdin with models kept resident.
+
+    Each input line is a message ``{"id": ..., "type": ..., "payload": ...}``
+    where ``type`` is ``request`` (default), ``health``, ``metrics`` or
+    ``shutdown``. Each reply is written as one JSON line carrying the same
+    ``id``; a request whose payload sets ``stream`` first gets ``event`` lines
+    (e.g. generated tokens) before its ``result``. ``metrics`` replies with the
+    worker's metric families for the server's Prometheus endpoint. Requests are
+    handled concurrently on a small thread pool so a slow generation does not
+    block health checks or other callers.
+    """
+    # Keep stray prints from libraries off the protocol stream
+    protocol_out = sys.stdout
+    sys.stdout = sys.stderr
+    write_lock = threading.Lock()
+    in_flight = {"count": 0}
+    started_at = time.time()
+
+    def send(message):
+        line = json.dumps(message)
+        with write_lock:
+            protocol_out.write(line + "\n")
+            protocol_out.flush()
+
+    def handle(message_id, payload):
+        try:
+            on_event = None
+            if payload.get("stream"):
+                def on_event(event):
+                    send({"id": message_id, "type": "event", "event": event})
+            result = agent.process_request(payload, on_event=on_event)
+            send({"id": message_id, "type": "result", "result": result})
+        except Exception as e:
+            send({"id": message_id, "type": "error", "error": f"Worker error: {e}"})
+        finally:
+            with write_lock:
+                in_flight["count"] -= 1
+
+    try:
+        agent = HybridAIAgent()
+    except Exception as e:
+        send({"type": "fatal", "error": f"Failed to initialize agent: {e}"})
+        sys.exit(1)
+
+    concurrency = int(os.environ.get("AI_AGENT_WORKER_CONCURRENCY", "4"))
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+    send({"type": "ready", "pid": os.getpid()})
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            message = json.loads(line)
+        except json.JSONDecodeError as e:
+            send({"id": None, "type": "error", "error": f"Invalid message: {e}"})
+            continue
+
+        message_id = message.get("id")
+        message_type = message.get("type", "request")
+
+        if message_type == "health":
+            send({
+                "id": message_id,
+                "type": "health",
+                "status": "ok",
+                "pid": os.getpid(),
+                "uptime": round(time.time() - started_at, 2),
+                "inFlight": in_flight["count"],
+                "models": agent.models.stats(),
+                "precision": agent.precision,
+                "threads": agent.threads,
+                "ragCache": agent.rag_cache.stats(),
+                "batching": {name: batcher.stats() for name, batcher in agent.batchers.items()},
+                "webCache": agent.web_cache.stats(),
+                "responseCache": agent.response_cache.stats(),
+                "profiler": agent.profiler.stats(),
+            })
+        elif message_type == "metrics":
+            send({"id": message_id, "type": "metrics", "families": request_metrics.registry.collect()})
+        elif message_type == "shutdown":
+            send({"id": message_id, "type": "shutdown"})
+            break
+        elif message_type == "request":
+            with write_lock:
+                in_flight["count"] += 1
+            executor.submit(handle, message_id, message.get("payload") or {})
+        else:
+            send({"id": message_id, "type": "error", "error": f"Unknown message type: {message_type}"})
+
+    # Graceful exit: let in-flight requests finish before the process ends
+    executor.shutdown(wait=True)
+
+
 def main():
+    if "--worker" in sys.argv[1:]:
+        run_worker()
+        return
+
     try:
         # Read input from stdin
         input_data = sys.stdin.read()
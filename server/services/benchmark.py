@@ -0,0 +1,560 @@
+#!/usr/bin/env python3
+"""Offline benchmarks for the RAG engine and the agent's request paths.
+
+Three groups of benchmarks, each reporting the median, min and max seconds of
+repeated runs:
+
+- ``rag``: SimpleRAGService (batch TF-IDF and incremental) on synthetic corpora
+  of 10 to 100k chunks. It times chunk_text over the corpus, building the index
+  (index_documents), adding one more document (index_document), and
+  retrieve_relevant_chunks and generate_context per query.
+- ``agent``: HybridAIAgent.process_request for every tool type. Stub pipelines
+  stand in for the models, so the timings cover everything around them: RAG,
+  batching, caching, token counting and HTTP. Web search goes to a local fake
+  search and page server. The response cache is disabled, so every run does
+  the work; RAG indexes are reused after the warm-up run, as in a session.
+- ``startup``: importing rag-service.py and ai-agent.py and constructing the
+  agent in a fresh interpreter, and loading each model architecture from disk.
+  By default the models are tiny random configs saved locally; --pretrained
+  loads the production checkpoints from the local Hugging Face cache.
+
+Nothing touches the network. --json writes the results, including each
+group's regression threshold. --baseline compares a run against an earlier
+results file and exits with status 1 if any benchmark's median got slower by
+more than its group's threshold.
+
+    python3 server/services/benchmark.py --json bench-before.json
+    python3 server/services/benchmark.py --baseline bench-before.json --json bench-after.json
+    python3 server/services/benchmark.py --groups rag --sizes 10,1000
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import statistics
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from service_loader import SERVICES_DIR, load_service_module
+
+GROUPS = ("rag", "agent", "startup")
+# Largest relative slowdown of a median that does not count as a regression
+DEFAULT_THRESHOLDS = {"rag": 0.25, "agent": 0.30, "startup": 0.50}
+# Changes below this many seconds are timer noise, whatever the ratio
+NOISE_FLOOR_SECONDS = 0.0005
+RESULTS_VERSION = 1
+
+
+def measure(fn, repeat: int, warmup: int = 1) -> dict:
+    """Seconds per call of fn over repeat runs, after warmup untimed calls"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return {
+        "median": round(statistics.median(samples), 6),
+        "min": round(min(samples), 6),
+        "max": round(max(samples), 6),
+        "runs": len(samples),
+    }
+
+
+def result(group: str, name: str, params: dict, seconds: dict, **extra) -> dict:
+    return {"group": group, "name": name, "params": params, "seconds": seconds, **extra}
+
+
+def result_key(entry: dict) -> str:
+    return f"{entry['group']}/{entry['name']}/{json.dumps(entry['params'], sort_keys=True)}"
+
+
+# --- Synthetic text ----------------------------------------------------------------
+
+class SyntheticText:
+    """Seeded pseudo-word text with a Zipf-like word distribution, so TF-IDF sees common and rare terms"""
+
+    def __init__(self, seed: int = 0, vocabulary_size: int = 5000):
+        import numpy as np
+
+        self.rng = np.random.default_rng(seed)
+        letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+        words = {
+            "".join(self.rng.choice(letters, size=self.rng.integers(3, 10)))
+            for _ in range(vocabulary_size * 2)
+        }
+        self.words = np.array(sorted(words)[:vocabulary_size])
+        weights = 1.0 / (np.arange(len(self.words)) + 10)
+        self.probabilities = weights / weights.sum()
+
+    def text(self, n_words: int) -> str:
+        """Sentences of 8 to 19 words, n_words in all"""
+        import numpy as np
+
+        words = self.rng.choice(self.words, size=n_words, p=self.probabilities).astype(object)
+        sentence_ends = np.cumsum(self.rng.integers(8, 20, size=n_words // 8 + 1)) - 1
+        words[sentence_ends[sentence_ends < n_words]] += "."
+        return " ".join(words)
+
+    def query(self, n_words: int = 4) -> str:
+        # Drawn from the same distribution as the corpus, so queries have matches
+        return " ".join(self.rng.choice(self.words, size=n_words, p=self.probabilities))
+
+
+def synthetic_corpus(text: SyntheticText, chunks: int, chunker, chunks_per_document: int = 50) -> list:
+    """Documents that chunk into about `chunks` chunks in all"""
+    words_per_chunk = chunker.max_tokens - chunker.overlap
+    documents = []
+    remaining = chunks
+    while remaining > 0:
+        document_chunks = min(chunks_per_document, remaining)
+        # Sentence-final periods are tokens too, and chunks end early at sentence boundaries
+        n_words = max(1, int(document_chunks * words_per_chunk * 0.86))
+        documents.append({"id": f"doc-{len(documents)}", "content": text.text(n_words)})
+        remaining -= document_chunks
+    return documents
+
+
+# --- RAG -----------------------------------------------------------------------------
+
+def bench_rag(args) -> list:
+    rag_service = load_service_module("rag-service.py", "rag_service")
+    text = SyntheticText(args.seed)
+    results = []
+
+    for size in args.sizes:
+        # Heavy steps are repeated less on large corpora
+        repeat = args.repeat if size <= 10_000 else 1
+        chunker = rag_service.get_chunker()
+        documents = synthetic_corpus(text, size, chunker)
+        extra_document = text.text(50 * (chunker.max_tokens - chunker.overlap))
+        queries = [text.query() for _ in range(args.queries)]
+
+        chunk_count = sum(len(chunker.chunk_text(doc["content"])) for doc in documents)
+        print(f"rag: {size} chunks requested, {chunk_count} generated", file=sys.stderr)
+        results.append(result(
+            "rag", "chunk_text", {"size": size},
+            measure(lambda: [chunker.chunk_text(doc["content"]) for doc in documents], repeat, warmup=0),
+            chunks=chunk_count,
+        ))
+
+        for mode, incremental in (("batch", False), ("incremental", True)):
+            params = {"size": size, "mode": mode}
+            holder = {}
+
+            def build():
+                service = rag_service.SimpleRAGService(incremental=incremental)
+                service.index_documents(documents)
+                holder["service"] = service
+
+            results.append(result("rag", "index_documents", params, measure(build, repeat, warmup=0), chunks=chunk_count))
+            service = holder["service"]
+
+            def retrieve_all():
+                for query in queries:
+                    service.retrieve_relevant_chunks(query, k=5)
+
+            def context_all():
+                for query in queries:
+                    service.generate_context(query)
+
+            # Per-query times: each run covers every query
+            for name, fn in (("retrieve_relevant_chunks", retrieve_all), ("generate_context", context_all)):
+                seconds = measure(fn, args.repeat)
+                seconds = {key: round(value / len(queries), 6) if key != "runs" else value for key, value in seconds.items()}
+                results.append(result("rag", name, params, seconds, queries=len(queries)))
+
+            # Re-adding the same id replaces the previous version each run
+            results.append(result(
+                "rag", "index_document", params,
+                measure(lambda: service.index_document("extra-doc", extra_document), min(repeat, 3)),
+            ))
+    return results
+
+
+# --- Agent ---------------------------------------------------------------------------
+
+class StubTokenizer:
+    """Word/punctuation tokenizer with the calls the agent and TokenChunker make on a Hugging Face tokenizer"""
+
+    def __init__(self, token_spans):
+        self.token_spans = token_spans
+
+    def num_special_tokens_to_add(self, pair: bool = False) -> int:
+        return 2 if pair else 1
+
+    def __call__(self, text, text_pair=None, add_special_tokens=True, return_offsets_mapping=False, **kwargs):
+        if isinstance(text, list):
+            return {"input_ids": [self(t, add_special_tokens=add_special_tokens)["input_ids"] for t in text]}
+        spans = self.token_spans(text) + (self.token_spans(text_pair) if text_pair else [])
+        ids = list(range(len(spans)))
+        if add_special_tokens:
+            ids += [0] * self.num_special_tokens_to_add(text_pair is not None)
+        encoded = {"input_ids": ids}
+        if return_offsets_mapping:
+            encoded["offset_mapping"] = spans
+        return encoded
+
+
+class StubPipeline:
+    """Instant stand-in for a Hugging Face pipeline; outputs are derived from the inputs"""
+
+    model = None
+
+    def __init__(self, task: str, tokenizer: StubTokenizer):
+        self.task = task
+        self.tokenizer = tokenizer
+
+    def __call__(self, inputs=None, question=None, context=None, max_new_tokens: int = 32, **kwargs):
+        if self.task == "question-answering":
+            return [self._answer(q, c) for q, c in zip(question, context)]
+        key = "summary_text" if self.task == "summarization" else "generated_text"
+        return [[{key: " ".join(text.split()[:max_new_tokens])}] for text in inputs]
+
+    @staticmethod
+    def _answer(question: str, context: str) -> dict:
+        asked = set(question.lower().split())
+        words = context.split()
+        index = next((i for i, word in enumerate(words) if word.lower() in asked), 0)
+        start = len(" ".join(words[:index])) + (1 if index else 0)
+        answer = words[index] if words else ""
+        score = sum(word.lower() in asked for word in words) / max(1, len(words))
+        return {"answer": answer, "score": score, "start": start, "end": start + len(answer)}
+
+
+class FakeWebHandler(BaseHTTPRequestHandler):
+    """``/search?q=...`` returns result links; ``/page/<n>`` returns an uncacheable article that differs per fetch"""
+
+    counter = 0
+    lock = threading.Lock()
+    text = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/search":
+            query = parse_qs(url.query).get("q", [""])[0]
+            host = f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+            body = json.dumps([{"href": f"{host}/page/{i}?q={query}", "title": f"Result {i}"} for i in range(2)])
+            content_type = "application/json"
+        else:
+            with FakeWebHandler.lock:
+                FakeWebHandler.counter += 1
+                serial = FakeWebHandler.counter
+            paragraphs = "".join(f"<p>Fetch {serial}. {self.text.text(60)}</p>" for _ in range(5))
+            body = f"<html><body><nav>menu</nav><article>{paragraphs}</article></body></html>"
+            content_type = "text/html"
+
+        payload = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_web(text: SyntheticText) -> ThreadingHTTPServer:
+    FakeWebHandler.text = text
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeWebHandler)
+    threading.Thread(target=server.serve_forever, name="fake-web", daemon=True).start()
+    return server
+
+
+def make_agent(agent_module, rag_service, search_url: str):
+    tokenizer = StubTokenizer(rag_service.regex_token_spans)
+    tasks = {"flan": "text2text-generation", "blender": "text2text-generation",
+             "summarizer": "summarization", "qa": "question-answering"}
+
+    class BenchmarkAgent(agent_module.HybridAIAgent):
+        def initialize_models(self):
+            super().initialize_models()
+            for name, task in tasks.items():
+                self.models.register(name, lambda task=task: StubPipeline(task, tokenizer))
+
+        def tokenizer(self, name):
+            return tokenizer
+
+        def search_results(self, query, max_results):
+            response = self.fetcher.session.get(search_url, params={"q": query}, timeout=5)
+            return response.json()[:max_results]
+
+    return BenchmarkAgent()
+
+
+def agent_scenarios(text: SyntheticText, store) -> list:
+    """(name, request factory) for every tool type; factories take the run number"""
+    document = text.text(4000)
+    session_documents = []
+    for i in range(3):
+        content = text.text(3000)
+        session_documents.append({"id": f"session-doc-{i}", "filename": f"doc{i}.txt", "contentHash": store.put(content)})
+    with_documents = {"sessionId": "benchmark", "sessionDocuments": session_documents}
+
+    return [
+        ("chat-casual", lambda i: {"toolType": "chat", "query": f"hey, tell me something fun {i}"}),
+        ("chat-factual", lambda i: {"toolType": "chat", "query": f"What is item {i} called?"}),
+        ("chat-rag", lambda i: {"toolType": "chat", "query": f"what does {text.query()} mean?", **with_documents}),
+        ("summary", lambda i: {"toolType": "summary", "documentContent": f"{i}. {document}"}),
+        ("summary-rag", lambda i: {"toolType": "summary", "documentContent": f"{i}. {document}", **with_documents}),
+        ("summary-hierarchical", lambda i: {
+            "toolType": "summary", "summaryMode": "hierarchical", "documentContent": f"{i}. {document}",
+        }),
+        ("qa", lambda i: {"toolType": "qa", "query": f"what is {text.query(2)}?", "documentContent": document}),
+        ("qa-rag", lambda i: {
+            "toolType": "qa", "query": f"what is {text.query(2)}?", "documentContent": document, **with_documents,
+        }),
+        ("qa-chunks", lambda i: {
+            "toolType": "qa", "qaMode": "chunks", "query": f"what is {text.query(2)}?", "documentContent": document,
+        }),
+        ("search", lambda i: {"toolType": "search", "query": f"search benchmark topic {i}"}),
+    ]
+
+
+def bench_agent(args) -> list:
+    # Every run generates: no response cache entries are kept
+    os.environ["RESPONSE_CACHE_SIZE"] = "0"
+    os.environ.pop("RESPONSE_CACHE_PATH", None)
+    os.environ.setdefault("AI_AGENT_PROFILE_SAMPLE_RATE", "0")
+    rag_service = load_service_module("rag-service.py", "rag_service")
+    agent_module = load_service_module("ai-agent.py", "ai_agent")
+
+    text = SyntheticText(args.seed + 1)
+    server = start_fake_web(text)
+    try:
+        host, port = server.server_address[:2]
+        agent = make_agent(agent_module, rag_service, f"http://{host}:{port}/search")
+        results = []
+        for name, make_request in agent_scenarios(text, rag_service.DocumentStore()):
+            runs = iter(range(args.agent_repeat + 1))
+            stages = []
+
+            def run():
+                response = agent.process_request(make_request(next(runs)))
+                if response["metadata"]["model"] == "Error" or response["response"].startswith("❌"):
+                    raise RuntimeError(f"{name} failed: {response['response']}")
+                stages.append(response["metadata"].get("stageTimings", {}))
+
+            seconds = measure(run, args.agent_repeat)
+            # Median per stage over the timed runs (the warm-up run builds RAG indexes)
+            timed = stages[1:]
+            stage_names = sorted({stage for timings in timed for stage in timings})
+            results.append(result("agent", "process_request", {"scenario": name}, seconds, stages={
+                stage: round(statistics.median(timings.get(stage, 0.0) for timings in timed), 6)
+                for stage in stage_names
+            }))
+            print(f"agent: {name} {seconds['median'] * 1000:.2f} ms", file=sys.stderr)
+        return results
+    finally:
+        server.shutdown()
+
+
+# --- Startup -------------------------------------------------------------------------
+
+COLD_START_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+from service_loader import load_service_module
+start = time.perf_counter()
+module = load_service_module(sys.argv[2], sys.argv[3])
+timings = {"import": time.perf_counter() - start}
+if sys.argv[3] == "ai_agent":
+    start = time.perf_counter()
+    module.HybridAIAgent()
+    timings["agentInit"] = time.perf_counter() - start
+print(json.dumps(timings))
+"""
+
+
+def cold_start(filename: str, module_name: str, repeat: int) -> dict:
+    """Seconds to import a service script (and construct the agent) in fresh interpreters"""
+    samples = []
+    for _ in range(max(1, repeat)):
+        output = subprocess.run(
+            [sys.executable, "-c", COLD_START_SCRIPT, SERVICES_DIR, filename, module_name],
+            capture_output=True, text=True, check=True, env=os.environ.copy(),
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        key: {
+            "median": round(statistics.median(s[key] for s in samples), 6),
+            "min": round(min(s[key] for s in samples), 6),
+            "max": round(max(s[key] for s in samples), 6),
+            "runs": len(samples),
+        }
+        for key in samples[0]
+    }
+
+
+def bench_startup(args) -> list:
+    results = []
+    for filename, module_name in (("rag-service.py", "rag_service"), ("ai-agent.py", "ai_agent")):
+        for step, seconds in cold_start(filename, module_name, args.startup_repeat).items():
+            results.append(result("startup", step, {"module": filename}, seconds))
+            print(f"startup: {filename} {step} {seconds['median']:.3f} s", file=sys.stderr)
+
+    compare_precision = load_service_module("compare-precision.py", "compare_precision")
+    model_optimization = load_service_module("model-optimization.py", "model_optimization")
+    with tempfile.TemporaryDirectory() as model_dir:
+        if args.pretrained:
+            from transformers import AutoModelForQuestionAnswering, AutoModelForSeq2SeqLM
+
+            ids = load_service_module("ai-agent.py", "ai_agent").HybridAIAgent.MODEL_IDS
+            sources = {
+                "flan-t5": (AutoModelForSeq2SeqLM, ids["flan"]),
+                "blenderbot": (AutoModelForSeq2SeqLM, ids["blender"]),
+                "distilbert-qa": (AutoModelForQuestionAnswering, ids["qa"]),
+            }
+        else:
+            sources = {}
+            for name, model in compare_precision.tiny_models().items():
+                path = os.path.join(model_dir, name)
+                model.save_pretrained(path)
+                sources[name] = (type(model), path)
+
+        for name, (model_class, source) in sources.items():
+            def load():
+                model = model_class.from_pretrained(source)
+                model_optimization.optimize_model(model, args.precision)
+
+            try:
+                seconds = measure(load, args.startup_repeat)
+            except Exception as e:
+                print(f"startup: skipping {name} model load: {e}", file=sys.stderr)
+                continue
+            results.append(result(
+                "startup", "model_load", {"model": name, "precision": args.precision, "pretrained": args.pretrained},
+                seconds,
+            ))
+    return results
+
+
+# --- Reporting and comparison --------------------------------------------------------
+
+def machine_info() -> dict:
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results: list, baseline: dict, thresholds: dict) -> list:
+    """Regressions of results against a baseline results file, as dicts"""
+    previous = {result_key(entry): entry for entry in baseline.get("results", [])}
+    regressions = []
+    for entry in results:
+        before = previous.get(result_key(entry))
+        if before is None:
+            continue
+        old, new = before["seconds"]["median"], entry["seconds"]["median"]
+        threshold = thresholds[entry["group"]]
+        entry["baselineMedian"] = old
+        entry["change"] = round(new / old - 1, 4) if old > 0 else None
+        if new > old * (1 + threshold) + NOISE_FLOOR_SECONDS:
+            regressions.append({"key": result_key(entry), "baseline": old, "current": new,
+                                "change": entry["change"], "threshold": threshold})
+    return regressions
+
+
+def print_table(results: list):
+    header = f"{'benchmark':<62}{'median ms':>12}{'min ms':>10}{'change':>9}"
+    print(header)
+    print("-" * len(header))
+    for entry in results:
+        params = ",".join(f"{key}={value}" for key, value in entry["params"].items())
+        label = f"{entry['group']}/{entry['name']}[{params}]"
+        change = f"{entry['change'] * 100:+.1f}%" if entry.get("change") is not None else "-"
+        print(f"{label:<62}{entry['seconds']['median'] * 1000:>12.3f}{entry['seconds']['min'] * 1000:>10.3f}{change:>9}")
+
+
+def parse_thresholds(overrides: list) -> dict:
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    for override in overrides or []:
+        group, _, ratio = override.partition("=")
+        if group not in thresholds or not ratio:
+            raise SystemExit(f"--threshold expects GROUP=RATIO with GROUP one of {', '.join(GROUPS)}")
+        thresholds[group] = float(ratio)
+    return thresholds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the RAG engine and agent request paths")
+    parser.add_argument("--groups", default=",".join(GROUPS), help="comma-separated subset of: " + ", ".join(GROUPS))
+    parser.add_argument("--sizes", default="10,100,1000,10000,100000", help="corpus sizes in chunks")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per RAG benchmark")
+    parser.add_argument("--queries", type=int, default=20, help="queries per retrieval run")
+    parser.add_argument("--agent-repeat", type=int, default=20, help="timed requests per agent scenario")
+    parser.add_argument("--startup-repeat", type=int, default=3, help="fresh interpreters / model loads per startup benchmark")
+    parser.add_argument("--pretrained", action="store_true", help="time loading the production checkpoints from the local cache")
+    parser.add_argument("--precision", default="fp32", help="precision applied when timing model loads")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare against")
+    parser.add_argument("--threshold", action="append", metavar="GROUP=RATIO",
+                        help="allowed relative slowdown of a group's medians (defaults: " +
+                             ", ".join(f"{g}={t}" for g, t in DEFAULT_THRESHOLDS.items()) + ")")
+    args = parser.parse_args()
+
+    args.sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    groups = [group.strip() for group in args.groups.split(",") if group.strip()]
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        raise SystemExit(f"Unknown benchmark groups: {', '.join(sorted(unknown))}")
+    thresholds = parse_thresholds(args.threshold)
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Keep every cache and index of the run out of the working tree, and stay offline
+        for variable, subdir in (("WEB_CACHE_DIR", "web-cache"), ("DOCUMENT_STORE_DIR", "doc-store"),
+                                 ("RAG_INDEX_DIR", "rag-index"), ("AI_AGENT_PROFILE_DIR", "profiles")):
+            os.environ[variable] = os.path.join(workdir, subdir)
+        os.environ["HF_HUB_OFFLINE"] = "1"
+        os.environ["TRANSFORMERS_OFFLINE"] = "1"
+
+        runners = {"rag": bench_rag, "agent": bench_agent, "startup": bench_startup}
+        results = []
+        for group in groups:
+            results.extend(runners[group](args))
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), thresholds)
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "version": RESULTS_VERSION,
+                "createdAt": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "machine": machine_info(),
+                "config": {"groups": groups, "sizes": args.sizes, "repeat": args.repeat, "queries": args.queries,
+                           "agentRepeat": args.agent_repeat, "startupRepeat": args.startup_repeat,
+                           "pretrained": args.pretrained, "precision": args.precision, "seed": args.seed},
+                "thresholds": thresholds,
+                "results": results,
+                "regressions": regressions,
+            }, f, indent=2)
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond threshold:", file=sys.stderr)
+        for regression in regressions:
+            change = f"{regression['change'] * 100:+.1f}%" if regression["change"] is not None else "new cost"
+            print(f"  {regression['key']}: {regression['baseline'] * 1000:.3f} ms -> {regression['current'] * 1000:.3f} ms "
+                  f"({change}, allowed +{regression['threshold'] * 100:.0f}%)", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
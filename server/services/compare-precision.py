@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""Compare fp32, dynamic int8 and bf16 inference for the agent's model architectures.
+
+For each architecture (FLAN-T5, BlenderBot, DistilBERT QA) the script reports
+per-precision forward/generate latency, weight size, the process RSS growth
+from building the converted copy, and output drift against fp32 (max/mean
+absolute logit difference, cosine similarity and top-1 agreement).
+
+By default it uses small randomly initialized configs of the same
+architectures, so it runs offline in seconds and checks that every precision
+path works; pass --pretrained to measure the production checkpoints.
+
+    python3 server/services/compare-precision.py [--pretrained] [--runs 20] [--json results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import copy
+import argparse
+import statistics
+
+import torch
+from transformers import (
+    AutoModelForQuestionAnswering,
+    AutoModelForSeq2SeqLM,
+    BlenderbotConfig,
+    BlenderbotForConditionalGeneration,
+    DistilBertConfig,
+    DistilBertForQuestionAnswering,
+    T5Config,
+    T5ForConditionalGeneration,
+)
+
+from service_loader import load_service_module
+
+
+model_optimization = load_service_module("model-optimization.py", "model_optimization")
+
+VOCAB_SIZE = 512
+
+
+def tiny_models():
+    """Small random models with the production architectures"""
+    torch.manual_seed(0)
+    return {
+        "flan-t5": T5ForConditionalGeneration(T5Config(
+            vocab_size=VOCAB_SIZE, d_model=128, d_kv=32, d_ff=512, num_layers=2, num_heads=4,
+            decoder_start_token_id=0, pad_token_id=0, eos_token_id=1,
+        )),
+        "blenderbot": BlenderbotForConditionalGeneration(BlenderbotConfig(
+            vocab_size=VOCAB_SIZE, d_model=128, encoder_layers=2, decoder_layers=2,
+            encoder_attention_heads=4, decoder_attention_heads=4, encoder_ffn_dim=512, decoder_ffn_dim=512,
+            max_position_embeddings=128, pad_token_id=0, bos_token_id=1, eos_token_id=2, decoder_start_token_id=1,
+        )),
+        "distilbert-qa": DistilBertForQuestionAnswering(DistilBertConfig(
+            vocab_size=VOCAB_SIZE, dim=128, n_layers=2, n_heads=4, hidden_dim=512, max_position_embeddings=128,
+        )),
+    }
+
+
+def pretrained_models():
+    return {
+        "flan-t5": AutoModelForSeq2SeqLM.from_pretrained("google/flan-t5-base"),
+        "blenderbot": AutoModelForSeq2SeqLM.from_pretrained("facebook/blenderbot-400M-distill"),
+        "distilbert-qa": AutoModelForQuestionAnswering.from_pretrained("distilbert-base-uncased-distilled-squad"),
+    }
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def model_inputs(model, batch_size: int, seq_len: int) -> dict:
+    generator = torch.Generator().manual_seed(1)
+    vocab = min(model.config.vocab_size, VOCAB_SIZE)
+    input_ids = torch.randint(3, vocab, (batch_size, seq_len), generator=generator)
+    inputs = {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+    if model.config.is_encoder_decoder:
+        inputs["decoder_input_ids"] = torch.full((batch_size, 1), model.config.decoder_start_token_id)
+    return inputs
+
+
+def output_logits(outputs) -> torch.Tensor:
+    if hasattr(outputs, "start_logits"):
+        return torch.cat([outputs.start_logits, outputs.end_logits], dim=-1)
+    return outputs.logits
+
+
+def timed(fn, runs: int) -> float:
+    """Median seconds per call after one warm-up call"""
+    fn()
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def drift(reference: torch.Tensor, candidate: torch.Tensor) -> dict:
+    reference, candidate = reference.float(), candidate.float()
+    difference = (reference - candidate).abs()
+    cosine = torch.nn.functional.cosine_similarity(reference.flatten(), candidate.flatten(), dim=0)
+    return {
+        "maxAbs": round(difference.max().item(), 6),
+        "meanAbs": round(difference.mean().item(), 6),
+        "cosine": round(cosine.item(), 6),
+        "top1Agreement": round((reference.argmax(-1) == candidate.argmax(-1)).float().mean().item(), 4),
+    }
+
+
+def compare(name: str, model, precisions, runs: int, batch_size: int, seq_len: int, new_tokens: int) -> list:
+    model.eval()
+    inputs = model_inputs(model, batch_size, seq_len)
+    with torch.inference_mode():
+        reference = output_logits(model(**inputs))
+
+    results = []
+    for precision in precisions:
+        rss_before = current_rss()
+        candidate, applied = model_optimization.optimize_model(copy.deepcopy(model), precision)
+        rss_growth = current_rss() - rss_before
+        if applied != precision:
+            continue
+
+        with torch.inference_mode():
+            forward = lambda: candidate(**inputs)
+            result = {
+                "model": name,
+                "precision": precision,
+                "weightBytes": model_optimization.model_size_bytes(candidate),
+                "rssGrowthBytes": rss_growth,
+                "forwardSeconds": round(timed(forward, runs), 6),
+                "drift": drift(reference, output_logits(forward())),
+            }
+            if model.config.is_encoder_decoder:
+                generate = lambda: candidate.generate(
+                    input_ids=inputs["input_ids"], attention_mask=inputs["attention_mask"],
+                    max_new_tokens=new_tokens, min_new_tokens=new_tokens, do_sample=False,
+                )
+                result["generateSeconds"] = round(timed(generate, max(1, runs // 4)), 6)
+
+        results.append(result)
+        del candidate
+    return results
+
+
+def print_table(results: list):
+    header = f"{'model':<14}{'precision':<10}{'weights MB':>11}{'RSS +MB':>9}{'forward ms':>12}{'generate ms':>13}{'max |d|':>10}{'cosine':>9}{'top-1':>7}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        generate_ms = f"{r['generateSeconds'] * 1000:.1f}" if "generateSeconds" in r else "-"
+        print(
+            f"{r['model']:<14}{r['precision']:<10}{r['weightBytes'] / 2**20:>11.1f}{r['rssGrowthBytes'] / 2**20:>9.1f}"
+            f"{r['forwardSeconds'] * 1000:>12.2f}{generate_ms:>13}{r['drift']['maxAbs']:>10.4f}"
+            f"{r['drift']['cosine']:>9.4f}{r['drift']['top1Agreement']:>7.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare fp32, int8 and bf16 CPU inference")
+    parser.add_argument("--pretrained", action="store_true", help="use the production checkpoints instead of tiny random configs")
+    parser.add_argument("--precisions", default=",".join(model_optimization.PRECISIONS))
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--seq-len", type=int, default=64)
+    parser.add_argument("--new-tokens", type=int, default=16)
+    parser.add_argument("--intra-op-threads", type=int)
+    parser.add_argument("--inter-op-threads", type=int)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    threads = model_optimization.configure_threads(args.intra_op_threads, args.inter_op_threads)
+    print(f"torch {torch.__version__}, threads {threads}, native bf16: {model_optimization.bf16_supported()}", file=sys.stderr)
+
+    models = pretrained_models() if args.pretrained else tiny_models()
+    precisions = [p.strip() for p in args.precisions.split(",") if p.strip()]
+    results = []
+    for name, model in models.items():
+        results.extend(compare(name, model, precisions, args.runs, args.batch_size, args.seq_len, args.new_tokens))
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"threads": threads, "pretrained": args.pretrained, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import fs from "fs";
+import path from "path";
+import { createHash, randomUUID } from "crypto";
+import type { Document } from "@shared/schema";
+
+/** What crosses the Node→Python boundary instead of a document's text. */
+export interface DocumentReference {
+  id: string;
+  filename: string;
+  contentHash: string;
+}
+
+export function contentHash(content: string): string {
+  return createHash("sha256").update(content, "utf8").digest("hex");
+}
+
+/**
+ * Content-addressed document text shared with the Python services, which read it
+ * back (memory-mapped) from the same directory as rag-service.py's DocumentStore:
+ * `<root>/<hash[:2]>/<hash>.txt`.
+ *
+ * Requests then carry a document id and hash — a few hundred bytes — however large
+ * the session is, and the Python side reuses any index it already has for the hash.
+ */
+export class DocumentStore {
+  readonly root: string;
+  // Hashes of documents already written, by document id
+  private hashes = new Map<string, string>();
+
+  constructor(root = process.env.DOCUMENT_STORE_DIR || ".doc-store") {
+    this.root = path.resolve(root);
+  }
+
+  private filePath(hash: string): string {
+    return path.join(this.root, hash.slice(0, 2), `${hash}.txt`);
+  }
+
+  /** Record a document the ingestion worker has already written to the store. */
+  remember(documentId: string, hash: string): void {
+    this.hashes.set(documentId, hash);
+  }
+
+  /** Reference to a document, writing its text to the store the first time it is seen. */
+  async reference(document: Document): Promise<DocumentReference> {
+    let hash = this.hashes.get(document.id);
+    if (!hash || !fs.existsSync(this.filePath(hash))) {
+      hash = contentHash(document.content);
+      await this.write(hash, document.content);
+      this.hashes.set(document.id, hash);
+    }
+    return { id: document.id, filename: document.filename, contentHash: hash };
+  }
+
+  async references(documents: Document[]): Promise<DocumentReference[]> {
+    return Promise.all(documents.map((document) => this.reference(document)));
+  }
+
+  private async write(hash: string, content: string): Promise<void> {
+    const target = this.filePath(hash);
+    if (fs.existsSync(target)) {
+      return;
+    }
+    await fs.promises.mkdir(path.dirname(target), { recursive: true });
+    // Written under a temporary name and renamed so readers never see a partial file
+    const temporary = `${target}.${randomUUID()}.tmp`;
+    await fs.promises.writeFile(temporary, content, "utf8");
+    await fs.promises.rename(temporary, target);
+  }
+}
+
+export const documentStore = new DocumentStore();
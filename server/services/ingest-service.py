@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""Upload ingestion worker: text extraction, chunking and indexing of documents.
+
+PDFs are split into page-range shards that a pool of processes extracts in
+parallel. Page text is consumed in order as shards finish and streamed straight
+into the session's RAG index, so chunking and indexing overlap extraction and
+no model is loaded. Speaks the same newline-delimited JSON protocol as
+``ai-agent.py --worker``; requests report progress through ``event`` lines.
+
+    python3 server/services/ingest-service.py --worker
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import PyMuPDF as fitz  # fitz
+
+from service_loader import load_service_module
+
+
+rag_service = load_service_module("rag-service.py", "rag_service")
+
+
+def clean_text(text: str) -> str:
+    """Normalize whitespace in the text"""
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def page_ranges(page_count: int, pages_per_shard: int) -> List[Tuple[int, int]]:
+    """Split [0, page_count) into consecutive (start, end) shards"""
+    return [(start, min(start + pages_per_shard, page_count)) for start in range(0, page_count, pages_per_shard)]
+
+
+def extract_pages(file_path: str, start: int, end: int) -> List[str]:
+    """Cleaned text of pages [start, end); runs in a pool process with its own file handle"""
+    doc = fitz.open(file_path)
+    try:
+        return [clean_text(doc[i].get_text()) for i in range(start, end)]
+    finally:
+        doc.close()
+
+
+class PDFExtractor:
+    """
+    Extracts PDF page text across a process pool.
+
+    At most max_pending_shards shards are in flight, so when the consumer
+    (indexing) falls behind, extraction waits for it instead of buffering the
+    whole document. Documents of a single shard are read in the calling thread.
+    """
+
+    def __init__(self, processes: int = None, pages_per_shard: int = 16, max_pending_shards: int = None):
+        self.processes = max(1, processes or os.cpu_count() or 1)
+        self.pages_per_shard = max(1, pages_per_shard)
+        self.max_pending_shards = max_pending_shards or 2 * self.processes
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # Spawned rather than forked: the worker forks from request threads
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._pool
+
+    @staticmethod
+    def page_count(file_path: str) -> int:
+        doc = fitz.open(file_path)
+        try:
+            return doc.page_count
+        finally:
+            doc.close()
+
+    def iter_pages(self, file_path: str, page_count: int = None) -> Iterator[str]:
+        """Yield cleaned page texts in page order while later shards are still being extracted"""
+        if page_count is None:
+            page_count = self.page_count(file_path)
+        shards = deque(page_ranges(page_count, self.pages_per_shard))
+
+        if len(shards) <= 1 or self.processes == 1:
+            for start, end in shards:
+                yield from extract_pages(file_path, start, end)
+            return
+
+        pool = self._executor()
+        in_flight = deque()
+        try:
+            while shards or in_flight:
+                while shards and len(in_flight) < self.max_pending_shards:
+                    in_flight.append(pool.submit(extract_pages, file_path, *shards.popleft()))
+                yield from in_flight.popleft().result()
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+                self._pool = None
+
+
+class IngestionService:
+    """Extracts an uploaded file and adds it to its session's RAG index"""
+
+    def __init__(self, extractor: PDFExtractor = None, progress_interval: float = 0.25):
+        self.extractor = extractor or PDFExtractor(
+            processes=int(os.environ.get("INGEST_PROCESSES", "0")) or None,
+            pages_per_shard=int(os.environ.get("INGEST_PAGES_PER_SHARD", "16")),
+        )
+        self.progress_interval = progress_interval
+        self.document_store = rag_service.DocumentStore()
+        self._session_locks = {}
+        self._locks_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.documents = 0
+        self.pages = 0
+        self.chunks = 0
+        self.seconds = 0.0
+
+    def _session_lock(self, session_id: str) -> threading.Lock:
+        # Ingests into one session index are serialized so neither overwrites the other
+        with self._locks_lock:
+            return self._session_locks.setdefault(session_id, threading.Lock())
+
+    def ingest(self, request: Dict, on_event: Callable[[Dict], None] = None) -> Dict:
+        file_path = request["file_path"]
+        mime_type = request.get("mime_type", "application/pdf")
+        document_id = request["document_id"]
+        session_id = request["session_id"]
+        backend = request.get("backend") or rag_service.default_backend()
+        started = time.time()
+
+        if mime_type == "application/pdf":
+            pages_total = self.extractor.page_count(file_path)
+            pages = self.extractor.iter_pages(file_path, pages_total)
+        elif mime_type == "text/plain":
+            with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+                pages_total, pages = 1, iter([clean_text(f.read())])
+        else:
+            raise ValueError(f"Unsupported file type: {mime_type}")
+
+        content_parts = []
+        progress = {"pagesDone": 0, "reportedAt": 0.0}
+
+        def page_texts():
+            for text in pages:
+                progress["pagesDone"] += 1
+                now = time.time()
+                if on_event and (now - progress["reportedAt"] >= self.progress_interval
+                                 or progress["pagesDone"] == pages_total):
+                    progress["reportedAt"] = now
+                    on_event({"type": "progress", "pagesDone": progress["pagesDone"], "pagesTotal": pages_total})
+                # Empty pages would add a separator of their own
+                if text:
+                    content_parts.append(text)
+                    yield text
+
+        with self._session_lock(session_id):
+            service = rag_service.load_session_index(session_id, backend=backend) \
+                or rag_service.create_rag_service(backend, incremental=True)
+            chunks = service.index_document_stream(document_id, page_texts(), separator=" ")
+            rag_service.save_session_index(session_id, service)
+
+        content = " ".join(content_parts)
+        # Later requests refer to the document by this hash instead of sending its text
+        digest = self.document_store.put(content)
+
+        elapsed = time.time() - started
+        with self._stats_lock:
+            self.documents += 1
+            self.pages += pages_total
+            self.chunks += len(chunks)
+            self.seconds += elapsed
+
+        return {
+            "status": "success",
+            "content": content,
+            "content_hash": digest,
+            "pages": pages_total,
+            "chunks_created": len(chunks),
+            "chunks": chunks,
+            "processingTime": round(elapsed, 3),
+        }
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {
+                "processes": self.extractor.processes,
+                "pagesPerShard": self.extractor.pages_per_shard,
+                "documents": self.documents,
+                "pages": self.pages,
+                "chunks": self.chunks,
+                "pagesPerSecond": round(self.pages / self.seconds, 2) if self.seconds else None,
+            }
+
+
+def run_worker():
+    """Serve ingestion requests as newline-delimited JSON on stdin (see ai-agent.py's run_worker)"""
+    # Keep stray prints from libraries off the protocol stream
+    protocol_out = sys.stdout
+    sys.stdout = sys.stderr
+    write_lock = threading.Lock()
+    in_flight = {"count": 0}
+    started_at = time.time()
+
+    def send(message):
+        line = json.dumps(message)
+        with write_lock:
+            protocol_out.write(line + "\n")
+            protocol_out.flush()
+
+    def handle(message_id, payload):
+        try:
+            def on_event(event):
+                send({"id": message_id, "type": "event", "event": event})
+            result = service.ingest(payload, on_event=on_event)
+            send({"id": message_id, "type": "result", "result": result})
+        except Exception as e:
+            send({"id": message_id, "type": "error", "error": f"Ingestion failed: {e}"})
+        finally:
+            with write_lock:
+                in_flight["count"] -= 1
+
+    service = IngestionService()
+    concurrency = int(os.environ.get("INGEST_CONCURRENCY", "2"))
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+    send({"type": "ready", "pid": os.getpid()})
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            message = json.loads(line)
+        except json.JSONDecodeError as e:
+            send({"id": None, "type": "error", "error": f"Invalid message: {e}"})
+            continue
+
+        message_id = message.get("id")
+        message_type = message.get("type", "request")
+
+        if message_type == "health":
+            send({
+                "id": message_id,
+                "type": "health",
+                "status": "ok",
+                "pid": os.getpid(),
+                "uptime": round(time.time() - started_at, 2),
+                "inFlight": in_flight["count"],
+                "ingestion": service.stats(),
+            })
+        elif message_type == "shutdown":
+            send({"id": message_id, "type": "shutdown"})
+            break
+        elif message_type == "request":
+            with write_lock:
+                in_flight["count"] += 1
+            executor.submit(handle, message_id, message.get("payload") or {})
+        else:
+            send({"id": message_id, "type": "error", "error": f"Unknown message type: {message_type}"})
+
+    # Graceful exit: let in-flight ingests finish before the process ends
+    executor.shutdown(wait=True)
+    service.extractor.shutdown()
+
+
+def main():
+    if "--worker" in sys.argv[1:]:
+        run_worker()
+        return
+
+    try:
+        request_data = json.loads(sys.stdin.read())
+        result = IngestionService().ingest(request_data)
+        print(json.dumps(result))
+    except Exception as e:
+        print(json.dumps({"status": "error", "message": f"Ingestion failed: {e}"}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import fs from "fs";
+import path from "path";
+import { randomUUID } from "crypto";
+import { insertDocumentSchema, type AIRequest, type Document } from "@shared/schema";
+import { storage } from "../storage";
+import { documentStore } from "./document-store";
+import { AgentWorker, type WorkerOptions } from "./python-runner";
+import { ragManager } from "./rag-manager";
+
+type RAGBackend = NonNullable<AIRequest["ragBackend"]>;
+
+export type IngestionStatus = "queued" | "running" | "completed" | "failed";
+
+export interface IngestionJob {
+  id: string;
+  sessionId: string;
+  filename: string;
+  mimeType: string;
+  status: IngestionStatus;
+  pagesDone: number;
+  pagesTotal: number | null;
+  chunksCreated: number;
+  /** Id the document is stored under once the job completes. */
+  documentId: string;
+  document: Document | null;
+  error: string | null;
+  createdAt: string;
+  startedAt: string | null;
+  finishedAt: string | null;
+}
+
+export interface IngestionInput {
+  sessionId: string;
+  filename: string;
+  mimeType: string;
+  size: number;
+  filePath: string;
+  backend?: RAGBackend;
+}
+
+/** Raised when the queue is full; the upload should be retried after retryAfterSeconds. */
+export class QueueFullError extends Error {
+  constructor(readonly retryAfterSeconds: number) {
+    super("Ingestion queue is full");
+  }
+}
+
+/**
+ * Bounded FIFO of upload ingestion jobs, run on a resident ingest-service.py worker
+ * that extracts, chunks and indexes files without loading any model.
+ *
+ * Uploads return as soon as their job is queued. At most `concurrency` jobs run at
+ * once and at most `maxQueued` wait; beyond that new uploads are turned away so a
+ * burst cannot pile up unbounded work. Finished jobs are kept for `retentionMs` so
+ * clients can poll their status.
+ */
+export class IngestionQueue {
+  private maxQueued: number;
+  private concurrency: number;
+  private retentionMs: number;
+  private timeoutMs: number;
+  private jobs = new Map<string, IngestionJob>();
+  private waiting: Array<{ job: IngestionJob; input: IngestionInput }> = [];
+  private running = 0;
+  private completed = 0;
+  private failed = 0;
+  private totalRunMs = 0;
+  private worker: AgentWorker | null = null;
+
+  constructor() {
+    this.maxQueued = Math.max(1, parseInt(process.env.INGEST_QUEUE_SIZE || "32", 10));
+    this.concurrency = Math.max(1, parseInt(process.env.INGEST_CONCURRENCY || "2", 10));
+    this.retentionMs = parseInt(process.env.INGEST_JOB_RETENTION_MS || "3600000", 10);
+    this.timeoutMs = parseInt(process.env.INGEST_TIMEOUT_MS || "600000", 10);
+  }
+
+  private getWorker(): AgentWorker {
+    // Started on first upload so importing this module stays cheap
+    if (!this.worker) {
+      const options: WorkerOptions = {
+        pythonPath: process.env.PYTHON_PATH || "python3",
+        scriptPath: path.join(import.meta.dirname, "ingest-service.py"),
+        requestTimeoutMs: this.timeoutMs,
+        healthIntervalMs: parseInt(process.env.AI_AGENT_HEALTH_INTERVAL_MS || "30000", 10),
+        healthTimeoutMs: parseInt(process.env.AI_AGENT_HEALTH_TIMEOUT_MS || "10000", 10),
+        shutdownGraceMs: parseInt(process.env.AI_AGENT_SHUTDOWN_GRACE_MS || "30000", 10),
+      };
+      this.worker = new AgentWorker("ingest", options);
+      this.worker.start();
+    }
+    return this.worker;
+  }
+
+  /** Queue a file for ingestion; throws QueueFullError when the queue is at capacity. */
+  enqueue(input: IngestionInput): IngestionJob {
+    this.prune();
+    if (this.waiting.length >= this.maxQueued) {
+      throw new QueueFullError(this.retryAfterSeconds());
+    }
+
+    const id = randomUUID();
+    const job: IngestionJob = {
+      id,
+      sessionId: input.sessionId,
+      filename: input.filename,
+      mimeType: input.mimeType,
+      status: "queued",
+      pagesDone: 0,
+      pagesTotal: null,
+      chunksCreated: 0,
+      documentId: id,
+      document: null,
+      error: null,
+      createdAt: new Date().toISOString(),
+      startedAt: null,
+      finishedAt: null,
+    };
+    this.jobs.set(id, job);
+    this.waiting.push({ job, input });
+    this.drain();
+    return job;
+  }
+
+  get(id: string): IngestionJob | undefined {
+    return this.jobs.get(id);
+  }
+
+  async stats(): Promise<Record<string, unknown>> {
+    const worker = this.worker
+      ? await this.worker.healthCheck().catch((error) => ({ status: "error", error: error.message }))
+      : null;
+    return {
+      queued: this.waiting.length,
+      running: this.running,
+      maxQueued: this.maxQueued,
+      concurrency: this.concurrency,
+      completed: this.completed,
+      failed: this.failed,
+      averageSeconds: this.completed ? Math.round(this.totalRunMs / this.completed) / 1000 : null,
+      worker,
+    };
+  }
+
+  async shutdown(): Promise<void> {
+    await this.worker?.stop();
+    this.worker = null;
+  }
+
+  private drain(): void {
+    while (this.running < this.concurrency && this.waiting.length > 0) {
+      const { job, input } = this.waiting.shift()!;
+      this.running++;
+      this.run(job, input).finally(() => {
+        this.running--;
+        this.drain();
+      });
+    }
+  }
+
+  private async run(job: IngestionJob, input: IngestionInput): Promise<void> {
+    job.status = "running";
+    job.startedAt = new Date().toISOString();
+    const started = Date.now();
+    let indexed = false;
+
+    try {
+      const result = await this.getWorker().request(
+        {
+          file_path: input.filePath,
+          mime_type: input.mimeType,
+          document_id: job.documentId,
+          session_id: input.sessionId,
+          backend: input.backend,
+        },
+        this.timeoutMs,
+        (event) => {
+          if (event.type === "progress") {
+            job.pagesDone = Number(event.pagesDone);
+            job.pagesTotal = Number(event.pagesTotal);
+          }
+        },
+      );
+      // The worker has saved the document into the session index by now
+      indexed = true;
+
+      const documentData = insertDocumentSchema.parse({
+        sessionId: input.sessionId,
+        filename: input.filename,
+        content: result.content,
+        size: `${(input.size / 1024).toFixed(1)} KB`,
+        mimeType: input.mimeType,
+      });
+      // Stored under the id the session index already knows the document by
+      const document = await storage.createDocument(documentData, job.documentId);
+      // The worker already wrote the text to the document store
+      documentStore.remember(document.id, result.content_hash);
+
+      ragManager.storeChunks(document, result.chunks).catch((error) => {
+        console.error(`Failed to store chunks of document ${document.id}:`, error);
+      });
+
+      job.document = document;
+      job.chunksCreated = result.chunks_created;
+      job.pagesDone = job.pagesTotal = result.pages;
+      job.status = "completed";
+      this.completed++;
+      this.totalRunMs += Date.now() - started;
+    } catch (error) {
+      job.status = "failed";
+      job.error = error instanceof Error ? error.message : "Unknown error";
+      this.failed++;
+      if (indexed) {
+        // No stored document refers to the indexed chunks, so take them out again
+        ragManager.clearDocumentIndex(job.documentId, input.sessionId).catch((clearError) => {
+          console.error(`Failed to remove document ${job.documentId} of failed job ${job.id}:`, clearError);
+        });
+      }
+    } finally {
+      job.finishedAt = new Date().toISOString();
+      fs.unlink(input.filePath, () => {});
+    }
+  }
+
+  private retryAfterSeconds(): number {
+    // Roughly how long until a queue slot frees up
+    const averageSeconds = this.completed ? this.totalRunMs / this.completed / 1000 : 5;
+    return Math.max(1, Math.ceil(averageSeconds / this.concurrency));
+  }
+
+  private prune(): void {
+    const cutoff = Date.now() - this.retentionMs;
+    this.jobs.forEach((job, id) => {
+      if (job.finishedAt && Date.parse(job.finishedAt) < cutoff) {
+        this.jobs.delete(id);
+      }
+    });
+  }
+}
+
+export const ingestionQueue = new IngestionQueue();
@@ -0,0 +1,73 @@
+/** A metric family as reported by a Python worker's `metrics` message (see request-metrics.py). */
+export interface MetricFamily {
+  name: string;
+  type: "counter" | "gauge" | "histogram";
+  help: string;
+  samples: MetricSample[];
+}
+
+export interface MetricSample {
+  labels: Record<string, string>;
+  /** Counters and gauges. */
+  value?: number;
+  /** Histograms: cumulative counts keyed by upper bound, including "+Inf". */
+  buckets?: Record<string, number>;
+  sum?: number;
+  count?: number;
+}
+
+/** Families reported by one source, whose samples all get `labels` added (e.g. the worker). */
+export interface MetricSource {
+  labels: Record<string, string>;
+  families: MetricFamily[];
+}
+
+function escapeLabelValue(value: string): string {
+  return value.replace(/\\/g, "\\\\").replace(/"/g, '\\"').replace(/\n/g, "\\n");
+}
+
+function formatLabels(labels: Record<string, string>): string {
+  const pairs = Object.entries(labels).map(([name, value]) => `${name}="${escapeLabelValue(String(value))}"`);
+  return pairs.length > 0 ? `{${pairs.join(",")}}` : "";
+}
+
+function upperBound(le: string): number {
+  return le === "+Inf" ? Infinity : parseFloat(le);
+}
+
+/**
+ * Render metric families in the Prometheus text exposition format. Families of
+ * the same name from several sources are merged under one HELP/TYPE header.
+ */
+export function renderPrometheus(sources: MetricSource[]): string {
+  const families = new Map<string, MetricFamily>();
+  for (const source of sources) {
+    for (const family of source.families) {
+      const merged = families.get(family.name) ?? { ...family, samples: [] };
+      for (const sample of family.samples) {
+        merged.samples.push({ ...sample, labels: { ...source.labels, ...sample.labels } });
+      }
+      families.set(family.name, merged);
+    }
+  }
+
+  const lines: string[] = [];
+  families.forEach((family) => {
+    lines.push(`# HELP ${family.name} ${family.help}`);
+    lines.push(`# TYPE ${family.name} ${family.type}`);
+    for (const sample of family.samples) {
+      if (family.type === "histogram") {
+        // Integer-like keys ("1", "10") come first in object order, so sort by bound
+        const buckets = Object.entries(sample.buckets ?? {}).sort(([a], [b]) => upperBound(a) - upperBound(b));
+        for (const [bound, count] of buckets) {
+          lines.push(`${family.name}_bucket${formatLabels({ ...sample.labels, le: bound })} ${count}`);
+        }
+        lines.push(`${family.name}_sum${formatLabels(sample.labels)} ${sample.sum ?? 0}`);
+        lines.push(`${family.name}_count${formatLabels(sample.labels)} ${sample.count ?? 0}`);
+      } else {
+        lines.push(`${family.name}${formatLabels(sample.labels)} ${sample.value ?? 0}`);
+      }
+    }
+  });
+  return lines.join("\n") + "\n";
+}
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+import sys
+import torch
+from typing import Dict, Tuple
+
+PRECISIONS = ('fp32', 'int8', 'bf16')
+
+
+def configure_threads(intra_op=None, inter_op=None) -> Dict:
+    """Set torch's intra-op and inter-op thread pools; call before the first inference"""
+    if intra_op:
+        torch.set_num_threads(int(intra_op))
+    if inter_op:
+        try:
+            torch.set_num_interop_threads(int(inter_op))
+        except RuntimeError as e:
+            # Only settable once, before any inter-op parallel work has started
+            print(f"Keeping {torch.get_num_interop_threads()} inter-op threads: {e}", file=sys.stderr)
+    return {"intraOp": torch.get_num_threads(), "interOp": torch.get_num_interop_threads()}
+
+
+def bf16_supported() -> bool:
+    """True if the CPU has native bf16 matrix instructions (AVX512-BF16 or AMX)"""
+    cpu = getattr(torch, "cpu", None)
+    for check in ("_is_avx512_bf16_supported", "_is_amx_tile_supported"):
+        supported = getattr(cpu, check, None)
+        if supported is not None and supported():
+            return True
+    return False
+
+
+def optimize_model(model, precision: str = "fp32", allow_bf16: bool = True) -> Tuple[torch.nn.Module, str]:
+    """Put a model in eval mode at the requested precision; returns the model and the precision applied.
+
+    int8 dynamically quantizes every Linear layer (weights stored as int8,
+    activations quantized on the fly). bf16 casts the weights and falls back to
+    fp32 on CPUs without native bf16 support, where it would be slower.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision}")
+    model.eval()
+
+    if precision == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif precision == "bf16":
+        if allow_bf16 and bf16_supported():
+            model = model.to(torch.bfloat16)
+        else:
+            reason = "not used for this model" if not allow_bf16 else "not supported natively on this CPU"
+            print(f"bf16 is {reason}; keeping fp32", file=sys.stderr)
+            precision = "fp32"
+    return model, precision
+
+
+def model_size_bytes(model) -> int:
+    """Bytes held by a model's weights and buffers, including packed int8 Linear weights"""
+    seen = set()
+    total = 0
+    for value in model.state_dict().values():
+        for tensor in (value if isinstance(value, (tuple, list)) else (value,)):
+            if not isinstance(tensor, torch.Tensor):
+                continue
+            # Tied weights appear under several names
+            key = (tensor.data_ptr(), tensor.numel())
+            if key in seen:
+                continue
+            seen.add(key)
+            total += tensor.numel() * tensor.element_size()
+    return total
@@ -1,88 +1,387 @@
-import { spawn } from "child_process";
+import { spawn, type ChildProcessWithoutNullStreams } from "child_process";
+import { randomUUID } from "crypto";
 import path from "path";
 import { AIRequest, AIResponse } from "@shared/schema";
 import { storage } from "../storage";
+import { documentStore, type DocumentReference } from "./document-store";
+import { ragManager } from "./rag-manager";
+import { renderPrometheus, type MetricFamily } from "./metrics";
+
+interface PendingRequest {
+  resolve: (value: any) => void;
+  reject: (error: Error) => void;
+  timer: NodeJS.Timeout;
+  onEvent?: (event: AgentEvent) => void;
+}
+
+/** An incremental event emitted by a streaming request before its result, e.g. a generated token. */
+export interface AgentEvent {
+  type: string;
+  text?: string;
+  [key: string]: unknown;
+}
+
+export interface WorkerOptions {
+  pythonPath: string;
+  scriptPath: string;
+  requestTimeoutMs: number;
+  healthIntervalMs: number;
+  healthTimeoutMs: number;
+  shutdownGraceMs: number;
+}
+
+/**
+ * A resident Python worker (ai-agent.py or ingest-service.py) speaking newline-delimited
+ * JSON on stdio. Models stay loaded between requests; replies are matched to callers by id.
+ */
+export class AgentWorker {
+  private process: ChildProcessWithoutNullStreams | null = null;
+  private buffer = "";
+  private pending = new Map<string, PendingRequest>();
+  private healthTimer: NodeJS.Timeout | null = null;
+  private restartDelayMs = 1000;
+  private stopping = false;
+  private ready = false;
+
+  constructor(private readonly name: string, private readonly options: WorkerOptions) {}
+
+  get load(): number {
+    return this.pending.size;
+  }
+
+  get isReady(): boolean {
+    return this.ready;
+  }
+
+  /** False once stop() was called, while the worker drains its in-flight requests. */
+  get isAccepting(): boolean {
+    return !this.stopping;
+  }
+
+  start(): void {
+    this.stopping = false;
+    this.ready = false;
+    this.buffer = "";
+
+    const child = spawn(this.options.pythonPath, [this.options.scriptPath, "--worker"], {
+      stdio: ["pipe", "pipe", "pipe"],
+    });
+    this.process = child;
+
+    child.stdout.on("data", (data) => {
+      this.buffer += data.toString();
+      let newline = this.buffer.indexOf("\n");
+      while (newline !== -1) {
+        const line = this.buffer.slice(0, newline).trim();
+        this.buffer = this.buffer.slice(newline + 1);
+        if (line) {
+          this.handleLine(line);
+        }
+        newline = this.buffer.indexOf("\n");
+      }
+    });
+
+    child.stderr.on("data", (data) => {
+      // Log model loading progress to console but don't treat as error
+      console.log(`[Python AI Agent ${this.name}]: ${data.toString().trim()}`);
+    });
+
+    child.on("exit", (code, signal) => {
+      if (this.process !== child) return;
+      this.process = null;
+      this.ready = false;
+      this.stopHealthChecks();
+      this.rejectAll(new Error(`Python worker ${this.name} exited (code ${code}, signal ${signal})`));
+
+      if (!this.stopping) {
+        console.log(`[Python AI Agent ${this.name}]: restarting in ${this.restartDelayMs}ms`);
+        setTimeout(() => {
+          if (!this.stopping) this.start();
+        }, this.restartDelayMs);
+        this.restartDelayMs = Math.min(this.restartDelayMs * 2, 30000);
+      }
+    });
+
+    child.on("error", (error) => {
+      console.error(`[Python AI Agent ${this.name}]: failed to start: ${error.message}`);
+    });
+
+    // Broken pipes surface as stdin errors; the exit handler takes care of them
+    child.stdin.on("error", () => {});
+  }
+
+  request(
+    payload: unknown,
+    timeoutMs = this.options.requestTimeoutMs,
+    onEvent?: (event: AgentEvent) => void,
+  ): Promise<any> {
+    return this.send("request", payload, timeoutMs, onEvent);
+  }
+
+  async healthCheck(): Promise<any> {
+    return this.send("health", undefined, this.options.healthTimeoutMs);
+  }
+
+  /** The worker's latency, token and batching metric families. */
+  async metrics(): Promise<MetricFamily[]> {
+    const reply = await this.send("metrics", undefined, this.options.healthTimeoutMs);
+    return reply.families;
+  }
+
+  /** Ask the worker to finish in-flight requests and exit, then start a fresh one. */
+  async restart(): Promise<void> {
+    await this.stop();
+    this.restartDelayMs = 1000;
+    this.start();
+  }
+
+  async stop(): Promise<void> {
+    this.stopping = true;
+    this.ready = false;
+    this.stopHealthChecks();
+    const child = this.process;
+    if (!child) return;
+
+    await new Promise<void>((resolve) => {
+      const killTimer = setTimeout(() => {
+        child.kill("SIGKILL");
+      }, this.options.shutdownGraceMs);
+      child.once("exit", () => {
+        clearTimeout(killTimer);
+        resolve();
+      });
+      this.write({ id: randomUUID(), type: "shutdown" });
+      child.stdin.end();
+    });
+  }
+
+  private send(
+    type: string,
+    payload: unknown,
+    timeoutMs: number,
+    onEvent?: (event: AgentEvent) => void,
+  ): Promise<any> {
+    return new Promise((resolve, reject) => {
+      if (!this.process) {
+        reject(new Error(`Python worker ${this.name} is not running`));
+        return;
+      }
+      if (this.stopping) {
+        // Its stdin is closed, so the message would never arrive
+        reject(new Error(`Python worker ${this.name} is shutting down`));
+        return;
+      }
+
+      const id = randomUUID();
+      const timer = setTimeout(() => {
+        this.pending.delete(id);
+        reject(new Error(`Python worker ${this.name} timed out after ${timeoutMs}ms`));
+      }, timeoutMs);
+
+      this.pending.set(id, { resolve, reject, timer, onEvent });
+      this.write({ id, type, payload });
+    });
+  }
+
+  private write(message: Record<string, unknown>): void {
+    this.process?.stdin.write(JSON.stringify(message) + "\n");
+  }
+
+  private handleLine(line: string): void {
+    let message: any;
+    try {
+      message = JSON.parse(line);
+    } catch (parseError) {
+      console.error(`[Python AI Agent ${this.name}]: unparseable output: ${line}`);
+      return;
+    }
+
+    if (message.type === "ready") {
+      this.ready = true;
+      this.restartDelayMs = 1000;
+      this.startHealthChecks();
+      return;
+    }
+
+    if (message.type === "fatal") {
+      console.error(`[Python AI Agent ${this.name}]: ${message.error}`);
+      return;
+    }
+
+    const pending = message.id ? this.pending.get(message.id) : undefined;
+    if (!pending) return;
+
+    if (message.type === "event") {
+      // Events precede the final result; the request stays pending
+      pending.onEvent?.(message.event);
+      return;
+    }
+
+    this.pending.delete(message.id);
+    clearTimeout(pending.timer);
+
+    if (message.type === "error") {
+      pending.reject(new Error(message.error));
+    } else if (message.type === "result") {
+      pending.resolve(message.result);
+    } else {
+      pending.resolve(message);
+    }
+  }
+
+  private startHealthChecks(): void {
+    this.stopHealthChecks();
+    this.healthTimer = setInterval(() => {
+      this.healthCheck().catch((error) => {
+        console.error(`[Python AI Agent ${this.name}]: health check failed: ${error.message}`);
+        // An unresponsive worker is killed; the exit handler restarts it
+        this.process?.kill("SIGKILL");
+      });
+    }, this.options.healthIntervalMs);
+    this.healthTimer.unref();
+  }
+
+  private stopHealthChecks(): void {
+    if (this.healthTimer) {
+      clearInterval(this.healthTimer);
+      this.healthTimer = null;
+    }
+  }
+
+  private rejectAll(error: Error): void {
+    this.pending.forEach((pending) => {
+      clearTimeout(pending.timer);
+      pending.reject(error);
+    });
+    this.pending.clear();
+  }
+}
 
 export class PythonRunner {
   private pythonPath: string;
   private scriptPath: string;
+  private poolSize: number;
+  private workers: AgentWorker[] = [];
 
   constructor() {
     this.pythonPath = process.env.PYTHON_PATH || "python3";
     this.scriptPath = path.join(import.meta.dirname, "ai-agent.py");
+    this.poolSize = Math.max(1, parseInt(process.env.AI_AGENT_WORKERS || "1", 10));
   }
 
-  async runAIAgent(request: AIRequest): Promise<AIResponse> {
-    return new Promise(async (resolve, reject) => {
-      try {
-        // Enhance request with session documents for RAG
-        const enhancedRequest = { ...request };
-        
-        // Get documents for the session if available
-        if (request.sessionId) {
-          const documents = await storage.getDocumentsBySession(request.sessionId);
-          if (documents.length > 0) {
-            enhancedRequest.sessionDocuments = documents;
-          }
-        }
-
-        const pythonProcess = spawn(this.pythonPath, [this.scriptPath], {
-          stdio: ["pipe", "pipe", "pipe"],
-        });
-
-        let output = "";
-        let errorOutput = "";
-
-        pythonProcess.stdout.on("data", (data) => {
-          output += data.toString();
-        });
-
-        pythonProcess.stderr.on("data", (data) => {
-          errorOutput += data.toString();
-          // Log model loading progress to console but don't treat as error
-          console.log(`[Python AI Agent]: ${data.toString().trim()}`);
-        });
-
-        pythonProcess.on("close", (code) => {
-          if (code === 0) {
-            try {
-              const result = JSON.parse(output.trim());
-              resolve(result);
-            } catch (parseError) {
-              reject(new Error(`Failed to parse AI response: ${parseError}`));
-            }
-          } else {
-            reject(new Error(`Python process exited with code ${code}: ${errorOutput}`));
-          }
-        });
-
-        pythonProcess.on("error", (error) => {
-          reject(new Error(`Failed to start Python process: ${error.message}`));
-        });
-
-        // Send input data to Python script
-        pythonProcess.stdin.write(JSON.stringify(enhancedRequest));
-        pythonProcess.stdin.end();
-      } catch (error) {
-        reject(new Error(`Failed to prepare AI request: ${error}`));
+  private getWorkers(): AgentWorker[] {
+    // Workers are started on first use so importing this module stays cheap
+    if (this.workers.length === 0) {
+      const options: WorkerOptions = {
+        pythonPath: this.pythonPath,
+        scriptPath: this.scriptPath,
+        requestTimeoutMs: parseInt(process.env.AI_AGENT_REQUEST_TIMEOUT_MS || "600000", 10),
+        healthIntervalMs: parseInt(process.env.AI_AGENT_HEALTH_INTERVAL_MS || "30000", 10),
+        healthTimeoutMs: parseInt(process.env.AI_AGENT_HEALTH_TIMEOUT_MS || "10000", 10),
+        shutdownGraceMs: parseInt(process.env.AI_AGENT_SHUTDOWN_GRACE_MS || "30000", 10),
+      };
+      for (let i = 0; i < this.poolSize; i++) {
+        const worker = new AgentWorker(`#${i + 1}`, options);
+        worker.start();
+        this.workers.push(worker);
       }
+    }
+    return this.workers;
+  }
+
+  private pickWorker(): AgentWorker {
+    // Least in-flight requests wins; ready workers are preferred over starting ones, and
+    // a worker draining for a restart only gets requests when no other one accepts them
+    const workers = this.getWorkers();
+    const accepting = workers.filter((worker) => worker.isAccepting);
+    return (accepting.length > 0 ? accepting : workers).reduce((best, worker) => {
+      if (worker.isReady !== best.isReady) return worker.isReady ? worker : best;
+      return worker.load < best.load ? worker : best;
     });
   }
 
-  async processFileContent(filePath: string, mimeType: string): Promise<string> {
-    const request: AIRequest = {
-      query: `process_file:${filePath}:${mimeType}`,
-      toolType: "chat",
-      sessionId: "file-processing",
-    };
+  private async prepareRequest(request: AIRequest): Promise<AIRequest & { sessionDocuments?: DocumentReference[] }> {
+    // Enhance request with references to the session documents for RAG; the worker
+    // reads their text from the shared document store
+    const enhancedRequest: AIRequest & { sessionDocuments?: DocumentReference[] } = { ...request };
 
     try {
-      const response = await this.runAIAgent(request);
-      return response.response;
+      // Get documents for the session if available
+      if (request.sessionId) {
+        const documents = await storage.getDocumentsBySession(request.sessionId);
+        if (documents.length > 0) {
+          enhancedRequest.sessionDocuments = await documentStore.references(documents);
+        }
+      }
     } catch (error) {
-      throw new Error(`Failed to process file: ${error}`);
+      throw new Error(`Failed to prepare AI request: ${error}`);
+    }
+
+    return enhancedRequest;
+  }
+
+  /** Store the query embedding of a dense-backend chat retrieval and keep it out of the response. */
+  private async finishResponse(request: AIRequest, response: AIResponse): Promise<AIResponse> {
+    const { queryEmbedding, ...rest } = response;
+    if (queryEmbedding) {
+      try {
+        await ragManager.storeQueryEmbedding(request.sessionId, request.query, queryEmbedding);
+      } catch (error) {
+        console.error(`[Python AI Agent]: failed to store query embedding: ${error}`);
+      }
+    }
+    return rest;
+  }
+
+  async runAIAgent(request: AIRequest): Promise<AIResponse> {
+    const enhancedRequest = await this.prepareRequest(request);
+    return this.finishResponse(request, await this.pickWorker().request(enhancedRequest));
+  }
+
+  /** Like runAIAgent, but generated text is passed to onEvent as it is produced. */
+  async streamAIAgent(request: AIRequest, onEvent: (event: AgentEvent) => void): Promise<AIResponse> {
+    const enhancedRequest = await this.prepareRequest(request);
+    const response = await this.pickWorker().request({ ...enhancedRequest, stream: true }, undefined, onEvent);
+    return this.finishResponse(request, response);
+  }
+
+  async healthCheck(): Promise<any[]> {
+    return Promise.all(
+      this.workers.map((worker) =>
+        worker.healthCheck().catch((error) => ({ status: "error", error: error.message })),
+      ),
+    );
+  }
+
+  /** Metrics of every worker in the Prometheus text format, labelled by worker. */
+  async metrics(): Promise<string> {
+    const sources = await Promise.all(
+      this.workers.map(async (worker, index) => {
+        const labels = { worker: String(index + 1) };
+        const families = await worker.metrics().catch(() => null);
+        const up: MetricFamily = {
+          name: "ai_agent_worker_up",
+          type: "gauge",
+          help: "Whether the worker answered the metrics request",
+          samples: [{ labels: {}, value: families ? 1 : 0 }],
+        };
+        return { labels, families: [up, ...(families ?? [])] };
+      }),
+    );
+    return renderPrometheus(sources);
+  }
+
+  async restartWorkers(): Promise<void> {
+    // Restart one at a time so the pool keeps serving while it cycles
+    for (const worker of this.workers) {
+      await worker.restart();
     }
   }
+
+  async shutdown(): Promise<void> {
+    await Promise.all(this.workers.map((worker) => worker.stop()));
+    this.workers = [];
+  }
 }
 
 export const pythonRunner = new PythonRunner();
@@ -3,7 +3,10 @@ import path from "path";
 import { db } from "../db";
 import { documentChunks, queryEmbeddings } from "@shared/schema";
 import { eq } from "drizzle-orm";
-import type { Document } from "@shared/schema";
+import type { Document, AIRequest } from "@shared/schema";
+import { documentStore } from "./document-store";
+
+type RAGBackend = NonNullable<AIRequest["ragBackend"]>;
 
 export class RAGManager {
   private pythonPath: string;
@@ -56,26 +59,21 @@ export class RAGManager {
     });
   }
 
-  async indexDocument(document: Document): Promise<void> {
+  async indexDocument(document: Document, backend?: RAGBackend): Promise<void> {
     try {
       console.log(`[RAG Manager] Indexing document: ${document.filename}`);
       
       // Call RAG service to chunk and index the document
+      const { contentHash } = await documentStore.reference(document);
       const result = await this.callRAGService("index_document", {
         document_id: document.id,
-        content: document.content,
+        session_id: document.sessionId,
+        backend,
+        content_hash: contentHash,
       });
 
       if (result.status === "success" && result.chunks) {
-        // Store chunks in database
-        for (const chunk of result.chunks) {
-          await db.insert(documentChunks).values({
-            documentId: document.id,
-            chunkIndex: chunk.chunk_index,
-            content: chunk.content,
-            embedding: null, // For now, embeddings are handled in-memory by RAG service
-          });
-        }
+        await this.storeChunks(document, result.chunks);
         
         console.log(`[RAG Manager] Successfully indexed ${result.chunks_created} chunks for document ${document.filename}`);
       } else {
@@ -87,7 +85,29 @@ export class RAGManager {
     }
   }
 
-  async retrieveContext(query: string, documents: Document[]): Promise<{
+  /** Store chunks returned by the RAG or ingestion service in the database. */
+  async storeChunks(document: Document, chunks: any[]): Promise<void> {
+    for (const chunk of chunks) {
+      await db.insert(documentChunks).values({
+        documentId: document.id,
+        chunkIndex: chunk.chunk_index,
+        content: chunk.content,
+        // Only the dense backend returns chunk embeddings
+        embedding: chunk.embedding ? JSON.stringify(chunk.embedding) : null,
+      });
+    }
+  }
+
+  /** Store the embedding of a query retrieved with the dense backend. */
+  async storeQueryEmbedding(sessionId: string, query: string, embedding: number[]): Promise<void> {
+    await db.insert(queryEmbeddings).values({
+      sessionId,
+      query,
+      embedding: JSON.stringify(embedding),
+    });
+  }
+
+  async retrieveContext(query: string, documents: Document[], backend?: RAGBackend): Promise<{
     context: string;
     relevantChunks: any[];
     chunksFound: number;
@@ -95,19 +115,26 @@ export class RAGManager {
     try {
       console.log(`[RAG Manager] Retrieving context for query: "${query}"`);
       
-      // Prepare documents for RAG service
-      const docData = documents.map(doc => ({
-        id: doc.id,
-        content: doc.content,
+      // Documents are sent by reference; the RAG service reads their text from the document store
+      const docData = (await documentStore.references(documents)).map(ref => ({
+        id: ref.id,
+        content_hash: ref.contentHash,
       }));
 
       const result = await this.callRAGService("retrieve_context", {
         query,
+        session_id: documents[0]?.sessionId,
+        backend,
         documents: docData,
       });
 
       if (result.status === "success") {
         console.log(`[RAG Manager] Found ${result.chunks_found} relevant chunks`);
+
+        if (result.query_embedding && documents[0]) {
+          await this.storeQueryEmbedding(documents[0].sessionId, query, result.query_embedding);
+        }
+
         return {
           context: result.context || "",
           relevantChunks: result.relevant_chunks || [],
@@ -138,11 +165,19 @@ export class RAGManager {
     }
   }
 
-  async clearDocumentIndex(documentId: string): Promise<void> {
+  async clearDocumentIndex(documentId: string, sessionId?: string): Promise<void> {
     try {
       await db
         .delete(documentChunks)
         .where(eq(documentChunks.documentId, documentId));
+
+      // Drop the document's chunks from the session's persistent index as well
+      if (sessionId) {
+        await this.callRAGService("remove_document", {
+          document_id: documentId,
+          session_id: sessionId,
+        });
+      }
       
       console.log(`[RAG Manager] Cleared index for document ${documentId}`);
     } catch (error) {
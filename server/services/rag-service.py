@@ -1,114 +1,598 @@
 #!/usr/bin/env python3
 
 import sys
+import os
 import json
+import time
+import shutil
+import mmap
+import struct
+import hashlib
+import threading
+from collections import OrderedDict, Counter
+from collections.abc import Mapping
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer, ENGLISH_STOP_WORDS
+from sklearn.preprocessing import normalize
 import re
-from typing import List, Dict, Tuple
+from typing import List, Dict, Iterable, Iterator, NamedTuple, Tuple
 
-class SimpleRAGService:
+from service_loader import load_service_module
+
+INDEX_FORMAT_VERSION = 5
+
+
+request_metrics = load_service_module("request-metrics.py", "request_metrics")
+
+
+def content_hash(content: str) -> str:
+    """Stable hash of a document's text, used to tell whether an index is current"""
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def session_index_dir(session_id: str, backend: str = 'tfidf') -> str:
+    """Directory holding a backend's persistent index for a session"""
+    root = os.environ.get('RAG_INDEX_DIR', os.path.join(os.getcwd(), '.rag-index'))
+    safe_id = re.sub(r'[^A-Za-z0-9_-]', '_', session_id)
+    return os.path.join(root, safe_id, backend)
+
+
+class DocumentStore:
     """
-    A lightweight RAG service using TF-IDF vectors for document similarity
+    Content-addressed document texts shared by the Node server and Python workers.
+
+    Each text is written once to <root>/<hash[:2]>/<hash>.txt, where the hash is
+    content_hash of the text, so requests can name documents by hash instead of
+    carrying their contents. Files are written atomically and never change.
     """
-    
-    def __init__(self):
-        self.vectorizer = TfidfVectorizer(
-            max_features=5000,
-            stop_words='english',
-            ngram_range=(1, 2),
-            max_df=0.8,
-            min_df=2
-        )
-        self.document_chunks = []
-        self.chunk_vectors = None
-        self.is_fitted = False
-    
-    def chunk_text(self, text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
-        """Split text into overlapping chunks"""
-        sentences = re.split(r'[.!?]+', text)
-        chunks = []
-        current_chunk = ""
-        
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
+
+    def __init__(self, root: str = None):
+        self.root = root or os.environ.get('DOCUMENT_STORE_DIR', os.path.join(os.getcwd(), '.doc-store'))
+
+    def path(self, digest: str) -> str:
+        if not re.fullmatch(r'[0-9a-f]{64}', digest or ''):
+            raise ValueError(f"Invalid content hash: {digest!r}")
+        return os.path.join(self.root, digest[:2], f"{digest}.txt")
+
+    def has(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    def put(self, content: str) -> str:
+        """Store a text unless it is already there; returns its hash"""
+        digest = content_hash(content)
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        return digest
+
+    def get(self, digest: str) -> str:
+        with open(self.path(digest), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return ''
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[:].decode('utf-8')
+
+
+def document_hash(document: Dict) -> str:
+    """Content hash of a document given either by reference ({id, content_hash}) or with its content"""
+    return document.get('content_hash') or content_hash(document.get('content', ''))
+
+
+def resolve_documents(documents: List[Dict], store: DocumentStore = None) -> List[Dict]:
+    """Documents with their content, reading referenced ones from the document store"""
+    store = store or DocumentStore()
+    resolved = []
+    with request_metrics.stage('document_read'):
+        for doc in documents:
+            if 'content' not in doc:
+                try:
+                    doc = dict(doc, content=store.get(doc['content_hash']))
+                except FileNotFoundError:
+                    raise FileNotFoundError(f"Document {doc.get('id')} is not in the document store")
+            resolved.append(doc)
+    return resolved
+
+
+def hashing_vectorizer(n_features: int = 2 ** 18) -> HashingVectorizer:
+    """Stateless term-count vectorizer shared by incremental indexes and query matching"""
+    return HashingVectorizer(
+        n_features=n_features,
+        stop_words='english',
+        ngram_range=(1, 2),
+        alternate_sign=False,
+        norm=None
+    )
+
+
+SENTENCE_ENDINGS = frozenset('.!?')
+_token_pattern = re.compile(r"\w+|[^\w\s]")
+
+
+def regex_token_spans(text: str) -> List[Tuple[int, int]]:
+    """Word and punctuation tokens as (start, end) offsets; a cheap stand-in for a model tokenizer"""
+    return [match.span() for match in _token_pattern.finditer(text)]
+
+
+class ChunkSpan(NamedTuple):
+    start: int  # character offsets into the concatenated source text
+    end: int
+    tokens: int
+
+
+class TokenChunker:
+    """
+    Splits text into chunks of at most max_tokens tokens, each starting with the
+    last `overlap` tokens of the one before. A full chunk ends after the last
+    sentence in its second half, or at the token limit if there is none.
+
+    Text arrives as an iterator of pieces (e.g. PDF pages) and chunks are
+    yielded as character offsets into the pieces' concatenation. Only the text
+    of the chunk being built and the current piece is held, so memory stays
+    flat however long the document is. With a Hugging Face fast tokenizer the
+    token counts are the model's own, so a chunk never exceeds its window.
+    """
+
+    def __init__(self, max_tokens: int = 128, overlap: int = 16, tokenizer=None):
+        if max_tokens < 2 or not 0 <= overlap < max_tokens // 2:
+            raise ValueError("Chunks need at least 2 tokens and an overlap under half of them")
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+        self.tokenizer = tokenizer
+
+    def token_spans(self, text: str) -> List[Tuple[int, int]]:
+        if self.tokenizer is None:
+            return regex_token_spans(text)
+        encoded = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+        return [tuple(offsets) for offsets in encoded['offset_mapping']]
+
+    def chunk_text(self, text: str) -> List[str]:
+        return [chunk for _, chunk in self.iter_chunks([text])]
+
+    def iter_chunks(self, pieces: Iterable[str]) -> Iterator[Tuple[ChunkSpan, str]]:
+        """Yield (span, chunk text) for each chunk of the concatenated pieces"""
+        buffer, base = "", 0  # buffer holds the source text from offset base onwards
+        scanned = 0  # offset up to which the text has been tokenized
+        tokens = []  # (start, end, ends a sentence); the current chunk starts at tokens[head]
+        head = 0
+        carried = 0  # tokens at head already emitted as the previous chunk's overlap
+
+        def emit(first, last):
+            start, end = tokens[first][0], tokens[last - 1][1]
+            return ChunkSpan(start, end, last - first), buffer[start - base:end - base]
+
+        def add(spans, offset):
+            nonlocal head, carried
+            text = buffer[offset - base:]
+            tokens.extend([(start + offset, end + offset, end > start and text[end - 1] in SENTENCE_ENDINGS)
+                           for start, end in spans])
+            while len(tokens) - head > self.max_tokens:
+                cut = head + self.max_tokens
+                for i in range(cut - 1, head + self.max_tokens // 2, -1):
+                    if tokens[i][2]:
+                        cut = i + 1
+                        break
+                yield emit(head, cut)
+                head = cut - self.overlap
+                carried = self.overlap
+
+        for piece in pieces:
+            if not piece:
                 continue
-                
-            # If adding this sentence would exceed chunk size, start new chunk
-            if len(current_chunk) + len(sentence) > chunk_size and current_chunk:
-                chunks.append(current_chunk.strip())
-                # Keep overlap from the end of current chunk
-                words = current_chunk.split()
-                overlap_text = " ".join(words[-overlap:]) if len(words) > overlap else ""
-                current_chunk = overlap_text + " " + sentence
+            # Drop text and tokens that neither the current chunk nor the tokenizer still needs
+            del tokens[:head]
+            head = 0
+            keep = min(tokens[0][0], scanned) if tokens else scanned
+            buffer = buffer[keep - base:] + piece
+            base = keep
+
+            spans = self.token_spans(buffer[scanned - base:])
+            offset = scanned
+            # A token touching the end of the piece may continue in the next one
+            if spans and spans[-1][1] == len(buffer) - (scanned - base):
+                scanned += spans.pop()[0]
             else:
-                current_chunk += " " + sentence
-        
-        # Add the last chunk
-        if current_chunk.strip():
-            chunks.append(current_chunk.strip())
-        
-        return chunks
-    
+                scanned = base + len(buffer)
+            yield from add(spans, offset)
+
+        yield from add(self.token_spans(buffer[scanned - base:]), scanned)
+        if len(tokens) - head > carried:
+            yield emit(head, len(tokens))
+
+
+_chunkers = {}
+_chunker_lock = threading.Lock()
+
+
+def get_chunker(max_tokens: int = None, overlap: int = None, tokenizer_name: str = None) -> TokenChunker:
+    """Shared chunker; defaults come from RAG_CHUNK_TOKENS, RAG_CHUNK_OVERLAP and RAG_CHUNK_TOKENIZER"""
+    max_tokens = max_tokens or int(os.environ.get('RAG_CHUNK_TOKENS', '128'))
+    overlap = overlap if overlap is not None else int(os.environ.get('RAG_CHUNK_OVERLAP', '16'))
+    tokenizer_name = tokenizer_name or os.environ.get('RAG_CHUNK_TOKENIZER') or None
+    key = (max_tokens, overlap, tokenizer_name)
+    with _chunker_lock:
+        if key not in _chunkers:
+            tokenizer = None
+            if tokenizer_name:
+                from transformers import AutoTokenizer
+                tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+            _chunkers[key] = TokenChunker(max_tokens, overlap, tokenizer)
+        return _chunkers[key]
+
+
+def _save_csr(directory: str, prefix: str, matrix):
+    matrix = sparse.csr_matrix(matrix)
+    np.save(os.path.join(directory, f'{prefix}data.npy'), matrix.data.astype(np.float32))
+    np.save(os.path.join(directory, f'{prefix}indices.npy'), matrix.indices.astype(np.int32))
+    np.save(os.path.join(directory, f'{prefix}indptr.npy'), matrix.indptr.astype(np.int64))
+
+
+def _load_csr(directory: str, prefix: str, shape: Tuple[int, int], mmap_mode=None):
+    def array(name):
+        return np.load(os.path.join(directory, f'{prefix}{name}.npy'), mmap_mode=mmap_mode)
+    return sparse.csr_matrix((array('data'), array('indices'), array('indptr')), shape=shape, copy=False)
+
+
+class ChunkView(Mapping):
+    """
+    Read-only chunk record whose fields are read from a ChunkStore row on access.
+    Views are meant to be short-lived; they do not follow rows when the store is filtered.
+    """
+
+    __slots__ = ('_store', '_row', '_score')
+    _fields = ('document_id', 'chunk_index', 'content', 'chunk_id', 'start', 'end')
+
+    def __init__(self, store: 'ChunkStore', row: int, score: float = None):
+        self._store = store
+        self._row = row
+        self._score = score
+
+    def __getitem__(self, key):
+        store, row = self._store, self._row
+        if key == 'content':
+            return store.text(row)
+        if key == 'document_id':
+            return store.document_ids[store.docs[row]]
+        if key == 'chunk_index':
+            return str(int(store.ordinals[row]))
+        if key == 'chunk_id':
+            return f"{store.document_ids[store.docs[row]]}_{int(store.ordinals[row])}"
+        if key == 'start':
+            return int(store.spans[row, 0])
+        if key == 'end':
+            return int(store.spans[row, 1])
+        if key == 'similarity_score' and self._score is not None:
+            return self._score
+        raise KeyError(key)
+
+    def __iter__(self):
+        yield from self._fields
+        if self._score is not None:
+            yield 'similarity_score'
+
+    def __len__(self):
+        return len(self._fields) + (self._score is not None)
+
+    def __repr__(self):
+        return f"ChunkView({dict(self)!r})"
+
+
+class ChunkStore:
+    """
+    Columnar chunk storage shared by the RAG backends.
+
+    Chunk texts live in one contiguous UTF-8 buffer addressed by an offsets
+    array, document ids are interned in a table that rows point into, and
+    chunk ordinals and source spans are integer arrays, so a chunk costs a few
+    machine words instead of a dict of Python objects. Rows are read through
+    ChunkView objects. A store is written to a single file whose arrays are
+    memory-mapped back without copying.
+
+    Appended records are encoded into the columns on first read. Retrieval
+    reads rows outside its service's lock, so compaction and reads of the
+    columns hold the store's own lock.
+    """
+
+    MAGIC = b'RAGCHNK1'
+    ALIGNMENT = 64
+
+    def __init__(self):
+        self.document_ids = []
+        self._doc_positions = {}
+        self._text = np.zeros(0, dtype=np.uint8)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._docs = np.zeros(0, dtype=np.int32)
+        self._ordinals = np.zeros(0, dtype=np.int32)
+        self._spans = np.zeros((0, 2), dtype=np.int64)
+        self._pending = []  # chunk records appended since the columns were last built
+        self._lock = threading.RLock()
+
+    def extend(self, chunks: Iterable[Dict]):
+        with self._lock:
+            self._pending.extend(chunks)
+
+    def _compact(self):
+        """Encode pending chunk records into the columns"""
+        with self._lock:
+            if not self._pending:
+                return
+            chunks = self._pending
+            encoded = [chunk['content'].encode('utf-8') for chunk in chunks]
+            lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+            self._text = np.concatenate([self._text, np.frombuffer(b''.join(encoded), dtype=np.uint8)])
+            self._offsets = np.concatenate([self._offsets, self._offsets[-1] + np.cumsum(lengths)])
+            self._ordinals = np.concatenate([self._ordinals, np.fromiter(
+                (int(chunk['chunk_index']) for chunk in chunks), dtype=np.int32, count=len(chunks)
+            )])
+            spans = np.array([(chunk['start'], chunk['end']) for chunk in chunks], dtype=np.int64).reshape(-1, 2)
+            self._spans = np.concatenate([self._spans, spans])
+            self._docs = np.concatenate([self._docs, np.fromiter(
+                (self._intern(chunk['document_id']) for chunk in chunks), dtype=np.int32, count=len(chunks)
+            )])
+            self._pending = []
+
+    def _intern(self, document_id: str) -> int:
+        position = self._doc_positions.get(document_id)
+        if position is None:
+            position = self._doc_positions[document_id] = len(self.document_ids)
+            self.document_ids.append(document_id)
+        return position
+
+    @property
+    def docs(self) -> np.ndarray:
+        self._compact()
+        return self._docs
+
+    @property
+    def ordinals(self) -> np.ndarray:
+        self._compact()
+        return self._ordinals
+
+    @property
+    def spans(self) -> np.ndarray:
+        self._compact()
+        return self._spans
+
+    def text(self, row: int) -> str:
+        with self._lock:
+            self._compact()
+            start, end = self._offsets[row], self._offsets[row + 1]
+            text = self._text
+        return bytes(text[start:end]).decode('utf-8')
+
+    def texts(self) -> Iterator[str]:
+        for row in range(len(self)):
+            yield self.text(row)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._docs) + len(self._pending)
+
+    def __getitem__(self, row) -> ChunkView:
+        return self.view(row)
+
+    def __iter__(self) -> Iterator[ChunkView]:
+        for row in range(len(self)):
+            yield ChunkView(self, row)
+
+    def view(self, row: int, score: float = None) -> ChunkView:
+        row = int(row)
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return ChunkView(self, row, score)
+
+    def rows_of(self, document_id: str) -> np.ndarray:
+        """Boolean mask of the rows holding a document's chunks"""
+        # Pending rows intern their document ids when they are compacted
+        docs = self.docs
+        position = self._doc_positions.get(document_id)
+        if position is None:
+            return np.zeros(len(docs), dtype=bool)
+        return docs == position
+
+    def select(self, keep: np.ndarray):
+        """Keep only the rows where keep is True"""
+        with self._lock:
+            self._compact()
+            lengths = np.diff(self._offsets)
+            self._text = self._text[np.repeat(keep, lengths)]
+            self._offsets = np.concatenate([[0], np.cumsum(lengths[keep])]).astype(np.int64)
+            self._ordinals = self._ordinals[keep]
+            self._spans = self._spans[keep]
+
+            # Drop ids no row points at any more
+            used = np.unique(self._docs[keep])
+            remap = np.zeros(len(self.document_ids), dtype=np.int32)
+            remap[used] = np.arange(len(used), dtype=np.int32)
+            self._docs = remap[self._docs[keep]]
+            self.document_ids = [self.document_ids[i] for i in used]
+            self._doc_positions = {document_id: i for i, document_id in enumerate(self.document_ids)}
+
+    def _columns(self) -> List[Tuple[str, np.ndarray]]:
+        self._compact()
+        return [('text', self._text), ('offsets', self._offsets), ('docs', self._docs),
+                ('ordinals', self._ordinals), ('spans', self._spans)]
+
+    def save(self, path: str):
+        """Write the store as a JSON header followed by 64-byte aligned raw arrays"""
+        layout, position = {}, 0
+        columns = self._columns()
+        for name, array in columns:
+            position = -(-position // self.ALIGNMENT) * self.ALIGNMENT
+            layout[name] = {'offset': position, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+            position += array.nbytes
+        header = json.dumps({'document_ids': self.document_ids, 'arrays': layout}).encode('utf-8')
+        data_start = -(-(len(self.MAGIC) + 8 + len(header)) // self.ALIGNMENT) * self.ALIGNMENT
+
+        with open(path, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            for name, array in columns:
+                f.write(b'\0' * (data_start + layout[name]['offset'] - f.tell()))
+                f.write(memoryview(np.ascontiguousarray(array)).cast('B'))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'ChunkStore':
+        """Open a saved store; with mmap the arrays are views of the mapped file"""
+        with open(path, 'rb') as f:
+            if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                raise ValueError(f"Not a chunk store: {path}")
+            header_length, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(header_length))
+        data_start = -(-(len(cls.MAGIC) + 8 + header_length) // cls.ALIGNMENT) * cls.ALIGNMENT
+        raw = np.memmap(path, dtype=np.uint8, mode='r') if mmap else np.fromfile(path, dtype=np.uint8)
+
+        store = cls()
+        store.document_ids = header['document_ids']
+        store._doc_positions = {document_id: i for i, document_id in enumerate(store.document_ids)}
+        for name, spec in header['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            start = data_start + spec['offset']
+            count = int(np.prod(spec['shape'], dtype=np.int64))
+            array = raw[start:start + count * dtype.itemsize].view(dtype).reshape(spec['shape'])
+            setattr(store, f'_{name}', array)
+        return store
+
+
+class BaseRAGService:
+    """
+    Shared chunking, retrieval interface and persistence helpers for RAG backends
+    """
+
+    backend = None
+    # Minimum score for a chunk to count as relevant
+    min_score = 0.0
+
+    def __init__(self):
+        self.document_chunks = ChunkStore()
+        self.documents = {}  # document_id -> content hash
+        self.is_fitted = False
+        self.chunker = get_chunker()
+        self._lock = threading.RLock()
+
+    def chunk_text(self, text: str) -> List[str]:
+        """Split text into overlapping chunks that fit the chunker's token budget"""
+        return self.chunker.chunk_text(text)
+
     def index_document(self, document_id: str, content: str) -> List[Dict]:
-        """Index a document by chunking and vectorizing"""
-        chunks = self.chunk_text(content)
-        indexed_chunks = []
-        
-        for i, chunk in enumerate(chunks):
-            chunk_data = {
-                'document_id': document_id,
-                'chunk_index': str(i),
-                'content': chunk,
-                'chunk_id': f"{document_id}_{i}"
-            }
-            self.document_chunks.append(chunk_data)
-            indexed_chunks.append(chunk_data)
-        
-        # Refit vectorizer with all chunks
-        self._fit_vectorizer()
-        
+        raise NotImplementedError
+
+    def index_documents(self, documents: List[Dict]) -> List[Dict]:
+        """Index several documents"""
+        return [c for doc in documents for c in self.index_document(doc.get('id', ''), doc.get('content', ''))]
+
+    def index_document_stream(self, document_id: str, pieces: Iterable[str], separator: str = ' ',
+                              batch_size: int = 64) -> List[Dict]:
+        """Index a document whose text arrives in pieces, e.g. PDF pages as they are extracted.
+
+        Chunks are added in batches while later pieces are still being produced.
+        The recorded hash is that of the pieces joined by separator, so the index
+        covers the document once it is stored with that text.
+        """
+        digest = hashlib.sha256()
+
+        def text():
+            for i, piece in enumerate(pieces):
+                if i:
+                    digest.update(separator.encode('utf-8'))
+                    yield separator
+                digest.update(piece.encode('utf-8'))
+                yield piece
+
+        with self._lock:
+            if document_id in self.documents:
+                self.remove_document(document_id, refit=False)
+            self.documents[document_id] = None
+
+            indexed_chunks, batch = [], []
+            try:
+                for span, chunk in self.chunker.iter_chunks(text()):
+                    batch.append(self._chunk_record(document_id, len(indexed_chunks) + len(batch), chunk, span))
+                    if len(batch) >= batch_size:
+                        indexed_chunks.extend(self._add_chunks(batch))
+                        batch = []
+                if batch:
+                    indexed_chunks.extend(self._add_chunks(batch))
+            except BaseException:
+                self.remove_document(document_id, refit=False)
+                raise
+
+            self.documents[document_id] = digest.hexdigest()
+            self._finish_indexing()
         return indexed_chunks
-    
-    def _fit_vectorizer(self):
-        """Fit the TF-IDF vectorizer on all document chunks"""
-        if not self.document_chunks:
-            return
-            
-        chunk_texts = [chunk['content'] for chunk in self.document_chunks]
-        self.chunk_vectors = self.vectorizer.fit_transform(chunk_texts)
-        self.is_fitted = True
-    
+
+    def _add_chunks(self, chunks: List[Dict]) -> List[Dict]:
+        """Add chunk records of an already registered document; returns them as indexed"""
+        raise NotImplementedError
+
+    def _finish_indexing(self):
+        """Bring the index up to date after chunks were added through _add_chunks"""
+
+    def remove_document(self, document_id: str, refit: bool = True) -> bool:
+        raise NotImplementedError
+
+    @staticmethod
+    def _chunk_record(document_id: str, index: int, content: str, span: ChunkSpan) -> Dict:
+        return {
+            'document_id': document_id,
+            'chunk_index': str(index),
+            'content': content,
+            'chunk_id': f"{document_id}_{index}",
+            'start': span.start,
+            'end': span.end
+        }
+
+    def _chunk_document(self, document_id: str, content: str) -> List[Dict]:
+        """Chunk a document and record its hash, dropping any previous version first"""
+        if document_id in self.documents:
+            self.remove_document(document_id, refit=False)
+        self.documents[document_id] = content_hash(content)
+
+        with request_metrics.stage('rag_chunk'):
+            return [
+                self._chunk_record(document_id, i, chunk, span)
+                for i, (span, chunk) in enumerate(self.chunker.iter_chunks([content]))
+            ]
+
     def retrieve_relevant_chunks(self, query: str, k: int = 3) -> List[Dict]:
         """Retrieve top-k most relevant chunks for a query"""
-        if not self.is_fitted or not self.document_chunks:
-            return []
-        
-        # Vectorize the query
-        query_vector = self.vectorizer.transform([query])
-        
-        # Calculate similarities
-        similarities = cosine_similarity(query_vector, self.chunk_vectors).flatten()
-        
-        # Get top-k indices
-        top_indices = np.argsort(similarities)[::-1][:k]
-        
-        # Return relevant chunks with scores
-        relevant_chunks = []
-        for idx in top_indices:
-            if similarities[idx] > 0.1:  # Minimum similarity threshold
-                chunk = self.document_chunks[idx].copy()
-                chunk['similarity_score'] = float(similarities[idx])
-                relevant_chunks.append(chunk)
-        
-        return relevant_chunks
+        return self.retrieve_batch([query], k)[0]
+
+    def retrieve_batch(self, queries: List[str], k: int = 3, min_score: float = None) -> List[List[Dict]]:
+        raise NotImplementedError
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        """Indices of the k highest scores, best first, without sorting the whole array"""
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        if k < len(scores):
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(len(scores))
+        return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+    def retrieve_with_context(self, query: str, k: int = 5, max_context_length: int = 2000) -> Tuple[List[Dict], str]:
+        """Retrieve chunks and pack them into a context string from one scoring pass"""
+        relevant_chunks = self.retrieve_relevant_chunks(query, k=k)
+        return relevant_chunks, self.build_context(relevant_chunks, max_context_length)
     
-    def generate_context(self, query: str, max_context_length: int = 2000) -> str:
-        """Generate context for RAG-enhanced generation"""
-        relevant_chunks = self.retrieve_relevant_chunks(query, k=5)
-        
+    def generate_context(self, query: str, max_context_length: int = 2000, relevant_chunks: List[Dict] = None) -> str:
+        """Generate context for RAG-enhanced generation, optionally from already retrieved chunks"""
+        if relevant_chunks is None:
+            relevant_chunks = self.retrieve_relevant_chunks(query, k=5)
+        return self.build_context(relevant_chunks, max_context_length)
+
+    @staticmethod
+    def build_context(relevant_chunks: List[Dict], max_context_length: int = 2000) -> str:
+        """Pack retrieved chunks, best first, into a context of bounded length"""
         if not relevant_chunks:
             return ""
         
@@ -130,11 +614,1228 @@ class SimpleRAGService:
         
         return "\n\n".join(context_parts)
     
+    def covers(self, documents: List[Dict]) -> bool:
+        """True if this index holds exactly the given documents with the same content"""
+        wanted = {doc.get('id', ''): document_hash(doc) for doc in documents}
+        return wanted == self.documents
+
+    def save(self, index_dir: str):
+        raise NotImplementedError
+
+    @staticmethod
+    def _new_version_dir(index_dir: str) -> Tuple[str, str]:
+        os.makedirs(index_dir, exist_ok=True)
+        version = f"v{time.time_ns()}-{os.getpid()}"
+        target = os.path.join(index_dir, version)
+        os.makedirs(target)
+        return version, target
+
+    @staticmethod
+    def _publish_version(index_dir: str, version: str):
+        """Atomically point CURRENT at a fully written version directory"""
+        current_tmp = os.path.join(index_dir, f"CURRENT.{version}.tmp")
+        with open(current_tmp, 'w') as f:
+            f.write(version)
+        os.replace(current_tmp, os.path.join(index_dir, 'CURRENT'))
+
+        # Keep the previous version around for readers that are still opening it
+        versions = sorted(d for d in os.listdir(index_dir) if d.startswith('v') and d != version)
+        for stale in versions[:-1]:
+            shutil.rmtree(os.path.join(index_dir, stale), ignore_errors=True)
+
+    @staticmethod
+    def has_index(index_dir: str) -> bool:
+        return os.path.exists(os.path.join(index_dir, 'CURRENT'))
+
+    @staticmethod
+    def _open_version(index_dir: str) -> Tuple[str, Dict]:
+        with open(os.path.join(index_dir, 'CURRENT')) as f:
+            path = os.path.join(index_dir, f.read().strip())
+
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('format_version') != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format: {meta.get('format_version')}")
+        return path, meta
+
+    def _write_chunks(self, target: str) -> List[Dict]:
+        """Write the chunk store to one file that loading maps without copying"""
+        self.document_chunks.save(os.path.join(target, 'chunks.store'))
+        return [{'id': doc_id, 'content_hash': content_hash} for doc_id, content_hash in self.documents.items()]
+
+    def _read_chunks(self, path: str, meta: Dict, mmap: bool = True):
+        self.documents = {doc['id']: doc['content_hash'] for doc in meta['documents']}
+        self.document_chunks = ChunkStore.load(os.path.join(path, 'chunks.store'), mmap)
+
+
+class SimpleRAGService(BaseRAGService):
+    """
+    A lightweight RAG service using TF-IDF vectors for document similarity
+    """
+
+    backend = 'tfidf'
+    min_score = 0.1
+    
+    def __init__(self, incremental: bool = False, n_features: int = 2 ** 18, reweight_ratio: float = 0.2):
+        """
+        With incremental=True, chunks are vectorized into a fixed hashing feature
+        space with running document frequencies, so adding or removing a document
+        only touches that document's chunks. IDF weights of existing chunks are
+        refreshed once the chunk count drifts by more than reweight_ratio.
+        """
+        self.incremental = incremental
+        self.n_features = n_features
+        self.reweight_ratio = reweight_ratio
+        self.max_features = 5000
+        self.min_df = 2
+        self.max_df = 0.8
+        super().__init__()
+        self.vectorizer = self._build_vectorizer()
+        self.chunk_vectors = None
+
+        # Incremental mode state
+        self.document_frequencies = np.zeros(n_features, dtype=np.int64) if incremental else None
+        self.term_frequencies = np.zeros(n_features, dtype=np.int64) if incremental else None
+        self._pruned_features = None  # features dropped at the last re-weighting
+        self._chunk_counts = None  # raw term counts of consolidated chunks
+        self._pending = []  # (chunks, counts, weighted) appended since the last consolidation
+        self._chunk_count = 0
+        self._weighted_chunk_count = 0  # chunk count the current IDF weights were computed for
+
+    def _build_vectorizer(self):
+        if self.incremental:
+            return hashing_vectorizer(self.n_features)
+        return TfidfVectorizer(
+            max_features=self.max_features,
+            stop_words='english',
+            ngram_range=(1, 2),
+            max_df=self.max_df,
+            min_df=self.min_df
+        )
+    
+    def index_document(self, document_id: str, content: str) -> List[Dict]:
+        """Index a document by chunking and vectorizing"""
+        indexed_chunks = self._add_document(document_id, content)
+
+        if self.incremental:
+            self._append_chunks(indexed_chunks)
+        else:
+            # Refit vectorizer with all chunks
+            self._fit_vectorizer()
+        
+        return indexed_chunks
+
+    def index_documents(self, documents: List[Dict]) -> List[Dict]:
+        """Index several documents, fitting the vectorizer once at the end"""
+        if self.incremental:
+            return super().index_documents(documents)
+
+        indexed_chunks = []
+        for doc in documents:
+            indexed_chunks.extend(self._add_document(doc.get('id', ''), doc.get('content', '')))
+        self._fit_vectorizer()
+        return indexed_chunks
+
+    def _add_document(self, document_id: str, content: str) -> List[Dict]:
+        """Chunk a document and record its chunks, replacing any previous version"""
+        indexed_chunks = self._chunk_document(document_id, content)
+
+        if not self.incremental:
+            self.document_chunks.extend(indexed_chunks)
+        
+        return indexed_chunks
+
+    def _add_chunks(self, chunks: List[Dict]) -> List[Dict]:
+        if self.incremental:
+            self._append_chunks(chunks)
+        else:
+            self.document_chunks.extend(chunks)
+        return chunks
+
+    def _finish_indexing(self):
+        if not self.incremental:
+            self._fit_vectorizer()
+
+    def remove_document(self, document_id: str, refit: bool = True) -> bool:
+        """Drop a document's chunks from the index; in TF-IDF mode refit unless told otherwise"""
+        with self._lock:
+            if document_id not in self.documents:
+                return False
+            del self.documents[document_id]
+
+            if not self.incremental:
+                self.document_chunks.select(~self.document_chunks.rows_of(document_id))
+                if refit:
+                    self._fit_vectorizer()
+                return True
+
+            self._consolidate()
+            if self._chunk_counts is None:
+                return True
+
+            keep = ~self.document_chunks.rows_of(document_id)
+            removed = self._chunk_counts[~keep]
+            np.subtract.at(self.document_frequencies, removed.indices, 1)
+            np.subtract.at(self.term_frequencies, removed.indices, removed.data.astype(np.int64))
+            self._chunk_count -= removed.shape[0]
+            self._chunk_counts = self._chunk_counts[keep]
+            self.chunk_vectors = self.chunk_vectors[keep]
+            self.document_chunks.select(keep)
+            self.is_fitted = self._chunk_count > 0
+            return True
+    
+    def _fit_vectorizer(self):
+        """Fit the TF-IDF vectorizer on all document chunks"""
+        if not self.document_chunks:
+            self.chunk_vectors = None
+            self.is_fitted = False
+            return
+
+        # A loaded index carries a fixed vocabulary; refitting starts from a fresh one
+        self.vectorizer = self._build_vectorizer()
+        self.chunk_vectors = self.vectorizer.fit_transform(self.document_chunks.texts())
+        self.is_fitted = True
+
+    def _append_chunks(self, chunks: List[Dict]):
+        """Vectorize only the new chunks and update running document frequencies"""
+        if not chunks:
+            return
+        counts = self.vectorizer.transform([c['content'] for c in chunks]).tocsr()
+        counts.sum_duplicates()
+        with self._lock:
+            np.add.at(self.document_frequencies, counts.indices, 1)
+            np.add.at(self.term_frequencies, counts.indices, counts.data.astype(np.int64))
+            self._chunk_count += counts.shape[0]
+            self._pending.append((chunks, counts, self._weight(counts)))
+            self.is_fitted = True
+
+    def _idf(self, columns: np.ndarray) -> np.ndarray:
+        """Smoothed IDF from running document frequencies, as TfidfVectorizer computes it"""
+        df = self.document_frequencies[columns]
+        return np.log((1 + self._chunk_count) / (1 + df)) + 1
+
+    def _weight(self, counts):
+        """Apply current IDF weights to raw counts and L2-normalize the rows"""
+        weighted = counts.astype(np.float64)
+        weighted.data *= self._idf(weighted.indices)
+
+        # Same pruning as the TF-IDF vectorizer: ignore terms seen in one chunk or in most of
+        # them, and drop features that lost out to more frequent ones at the last re-weighting.
+        # Terms first seen since then are kept until the next one ranks them.
+        df = self.document_frequencies[weighted.indices]
+        dropped = (df < self.min_df) | (df > self.max_df * self._chunk_count)
+        if self._pruned_features is not None:
+            dropped |= self._pruned_features[weighted.indices]
+        weighted.data[dropped] = 0
+        weighted.eliminate_zeros()
+        return normalize(weighted, norm='l2', copy=False)
+
+    def _refresh_pruned_features(self):
+        """Keep up to max_features eligible terms by total count, like TfidfVectorizer does, and prune the rest"""
+        eligible = np.flatnonzero(
+            (self.document_frequencies >= self.min_df)
+            & (self.document_frequencies <= self.max_df * self._chunk_count)
+        )
+        if len(eligible) > self.max_features:
+            top = np.argpartition(self.term_frequencies[eligible], -self.max_features)[-self.max_features:]
+            eligible = eligible[top]
+        pruned = self.document_frequencies > 0
+        pruned[eligible] = False
+        self._pruned_features = pruned
+
+    def _consolidate(self):
+        """Merge pending chunks into the main matrix and refresh stale IDF weights"""
+        if not self.incremental:
+            return
+        with self._lock:
+            if self._pending:
+                existing = [] if self._chunk_counts is None else [self._chunk_counts]
+                existing_vectors = [] if self.chunk_vectors is None else [self.chunk_vectors]
+                self._chunk_counts = sparse.vstack(existing + [p[1] for p in self._pending], format='csr')
+                self.chunk_vectors = sparse.vstack(existing_vectors + [p[2] for p in self._pending], format='csr')
+                for chunks, _, _ in self._pending:
+                    self.document_chunks.extend(chunks)
+                self._pending = []
+
+            drift = abs(self._chunk_count - self._weighted_chunk_count)
+            if self._chunk_counts is not None and drift > self.reweight_ratio * max(self._weighted_chunk_count, 1):
+                self._refresh_pruned_features()
+                self.chunk_vectors = self._weight(self._chunk_counts)
+                self._weighted_chunk_count = self._chunk_count
+
+    def _vectorize_queries(self, queries: List[str]):
+        if self.incremental:
+            return self._weight(self.vectorizer.transform(queries))
+        return self.vectorizer.transform(queries)
+    
+    def retrieve_batch(self, queries: List[str], k: int = 3, min_score: float = None) -> List[List[Dict]]:
+        """
+        Retrieve top-k chunks for several queries with a single sparse matrix product.
+
+        Chunk and query rows are L2-normalized, so the dot product is the cosine
+        similarity; only the k best scores per query are selected and sorted.
+        """
+        if not queries:
+            return []
+        if not self.is_fitted:
+            return [[] for _ in queries]
+        self._consolidate()
+        if not self.document_chunks:
+            return [[] for _ in queries]
+
+        if min_score is None:
+            min_score = self.min_score
+        query_vectors = self._vectorize_queries(queries)
+        scores = (query_vectors @ self.chunk_vectors.T).toarray()
+
+        results = []
+        for row in scores:
+            top_indices = self._top_k(row, k)
+            relevant_chunks = []
+            for idx in top_indices:
+                if row[idx] > min_score:  # Minimum similarity threshold
+                    relevant_chunks.append(self.document_chunks.view(idx, float(row[idx])))
+            results.append(relevant_chunks)
+        return results
+
+    def save(self, index_dir: str):
+        """
+        Persist the vectorizer state, the CSR chunk matrix and chunk metadata.
+
+        TF-IDF indexes store their vocabulary and IDF weights; incremental
+        indexes store raw counts and document frequencies so appends can
+        continue after loading. Each save writes a new version directory and
+        then atomically repoints the CURRENT file, so readers never see a
+        half-written index.
+        """
+        with self._lock:
+            self._consolidate()
+            if not self.is_fitted:
+                raise ValueError("Cannot save an index that has not been fitted")
+
+            version, target = self._new_version_dir(index_dir)
+            _save_csr(target, '', self.chunk_vectors)
+            meta = {
+                'format_version': INDEX_FORMAT_VERSION,
+                'mode': 'hashing' if self.incremental else 'tfidf',
+                'shape': list(self.chunk_vectors.shape),
+            }
+
+            if self.incremental:
+                _save_csr(target, 'counts_', self._chunk_counts)
+                np.save(os.path.join(target, 'document_frequencies.npy'), self.document_frequencies.astype(np.int32))
+                np.save(os.path.join(target, 'term_frequencies.npy'), self.term_frequencies)
+                np.save(os.path.join(target, 'pruned_features.npy'), self._pruned_features)
+                meta.update({
+                    'n_features': self.n_features,
+                    'reweight_ratio': self.reweight_ratio,
+                    'chunk_count': self._chunk_count,
+                    'weighted_chunk_count': self._weighted_chunk_count,
+                })
+            else:
+                np.save(os.path.join(target, 'idf.npy'), np.asarray(self.vectorizer.idf_, dtype=np.float64))
+                vocabulary = self.vectorizer.vocabulary_
+                terms = [None] * len(vocabulary)
+                for term, column in vocabulary.items():
+                    terms[column] = term
+                with open(os.path.join(target, 'vocabulary.json'), 'w', encoding='utf-8') as f:
+                    json.dump(terms, f)
+                meta['vectorizer'] = {
+                    'stop_words': self.vectorizer.stop_words,
+                    'ngram_range': list(self.vectorizer.ngram_range),
+                }
+
+            meta['documents'] = self._write_chunks(target)
+            with open(os.path.join(target, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+
+        self._publish_version(index_dir, version)
+
+    @classmethod
+    def load(cls, index_dir: str, mmap: bool = True) -> 'SimpleRAGService':
+        """Open a saved index; with mmap the matrix and chunk texts stay on disk until touched"""
+        path, meta = cls._open_version(index_dir)
+        mmap_mode = 'r' if mmap else None
+
+        def array(name):
+            return np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+
+        shape = tuple(meta['shape'])
+        if meta['mode'] == 'hashing':
+            service = cls(incremental=True, n_features=meta['n_features'], reweight_ratio=meta['reweight_ratio'])
+            service._chunk_counts = _load_csr(path, 'counts_', shape, mmap_mode)
+            service.document_frequencies = array('document_frequencies.npy').astype(np.int64)
+            service.term_frequencies = np.array(array('term_frequencies.npy'))
+            service._pruned_features = np.array(array('pruned_features.npy'))
+            service._chunk_count = meta['chunk_count']
+            service._weighted_chunk_count = meta['weighted_chunk_count']
+        else:
+            with open(os.path.join(path, 'vocabulary.json'), encoding='utf-8') as f:
+                terms = json.load(f)
+            service = cls()
+            settings = meta['vectorizer']
+            service.vectorizer = TfidfVectorizer(
+                stop_words=settings['stop_words'],
+                ngram_range=tuple(settings['ngram_range']),
+                vocabulary={term: column for column, term in enumerate(terms)}
+            )
+            service.vectorizer.idf_ = np.asarray(array('idf.npy'))
+        service.chunk_vectors = _load_csr(path, '', shape, mmap_mode)
+
+        service._read_chunks(path, meta, mmap)
+        service.is_fitted = True
+        return service
+
     def clear_index(self):
         """Clear all indexed documents"""
-        self.document_chunks = []
+        self.document_chunks = ChunkStore()
+        self.documents = {}
         self.chunk_vectors = None
         self.is_fitted = False
+        if self.incremental:
+            self.document_frequencies = np.zeros(self.n_features, dtype=np.int64)
+            self.term_frequencies = np.zeros(self.n_features, dtype=np.int64)
+            self._pruned_features = None
+            self._chunk_counts = None
+            self._pending = []
+            self._chunk_count = 0
+            self._weighted_chunk_count = 0
+
+
+class BM25RAGService(BaseRAGService):
+    """
+    Inverted-index retriever with BM25 scoring and MaxScore-style dynamic pruning.
+
+    Postings are kept as a CSC matrix (chunk ids and term frequencies per term,
+    sorted by chunk id). Query terms are processed from the highest score upper
+    bound down; once no unseen chunk can beat the current k-th best score, the
+    remaining terms only update existing candidates through binary search
+    instead of scanning their posting lists, so query cost follows posting-list
+    lengths rather than corpus size.
+    """
+
+    backend = 'bm25'
+    token_pattern = re.compile(r"(?u)\b\w\w+\b")
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        super().__init__()
+        self.k1 = k1
+        self.b = b
+        self.term_ids = {}
+        self.postings = None  # CSC chunk x term matrix
+        self.idf = np.zeros(0)
+        self.upper_bounds = np.zeros(0)
+        self.chunk_lengths = np.zeros(0, dtype=np.int32)
+        self._avg_length = 1.0
+        self._chunk_terms = None  # CSR term counts of consolidated chunks
+        self._pending = []  # (chunks, counts, lengths) appended since the last consolidation
+        self.postings_scored = 0
+        self.postings_skipped = 0
+
+    def _tokenize(self, text: str) -> List[str]:
+        return [t for t in self.token_pattern.findall(text.lower()) if t not in ENGLISH_STOP_WORDS]
+
+    def _count_terms(self, texts: List[str]):
+        """Term-count rows for the texts, growing the vocabulary as new terms appear"""
+        rows, cols, counts, lengths = [], [], [], []
+        for row, text in enumerate(texts):
+            term_counts = Counter(self._tokenize(text))
+            lengths.append(sum(term_counts.values()))
+            for term, count in term_counts.items():
+                term_id = self.term_ids.get(term)
+                if term_id is None:
+                    term_id = self.term_ids[term] = len(self.term_ids)
+                rows.append(row)
+                cols.append(term_id)
+                counts.append(count)
+        matrix = sparse.csr_matrix(
+            (np.array(counts, dtype=np.int32), (np.array(rows, dtype=np.int32), np.array(cols, dtype=np.int32))),
+            shape=(len(texts), len(self.term_ids))
+        )
+        return matrix, np.array(lengths, dtype=np.int32)
+
+    def index_document(self, document_id: str, content: str) -> List[Dict]:
+        """Index a document; only its own chunks are tokenized"""
+        with self._lock:
+            return self._add_chunks(self._chunk_document(document_id, content))
+
+    def _add_chunks(self, chunks: List[Dict]) -> List[Dict]:
+        with self._lock:
+            if chunks:
+                counts, lengths = self._count_terms([c['content'] for c in chunks])
+                self._pending.append((chunks, counts, lengths))
+                self.is_fitted = True
+        return chunks
+
+    def remove_document(self, document_id: str, refit: bool = True) -> bool:
+        """Drop a document's chunks and rebuild the postings without them"""
+        with self._lock:
+            if document_id not in self.documents:
+                return False
+            del self.documents[document_id]
+            self._consolidate()
+            if self._chunk_terms is None:
+                return True
+
+            keep = ~self.document_chunks.rows_of(document_id)
+            self._chunk_terms = self._chunk_terms[keep]
+            self.chunk_lengths = self.chunk_lengths[keep]
+            self.document_chunks.select(keep)
+            self._rebuild_postings()
+            return True
+
+    @staticmethod
+    def _with_columns(matrix, n_columns: int):
+        return sparse.csr_matrix((matrix.data, matrix.indices, matrix.indptr), shape=(matrix.shape[0], n_columns))
+
+    def _consolidate(self):
+        """Merge pending chunks into the term matrix and rebuild postings and bounds"""
+        with self._lock:
+            if not self._pending:
+                return
+            n_terms = len(self.term_ids)
+            blocks = [] if self._chunk_terms is None else [self._with_columns(self._chunk_terms, n_terms)]
+            blocks += [self._with_columns(counts, n_terms) for _, counts, _ in self._pending]
+            self._chunk_terms = sparse.vstack(blocks, format='csr')
+            self.chunk_lengths = np.concatenate([self.chunk_lengths] + [lengths for _, _, lengths in self._pending])
+            for chunks, _, _ in self._pending:
+                self.document_chunks.extend(chunks)
+            self._pending = []
+            self._rebuild_postings()
+
+    def _rebuild_postings(self):
+        n_chunks = self._chunk_terms.shape[0]
+        self.is_fitted = n_chunks > 0
+        self.postings = self._chunk_terms.tocsc()
+        self.postings.sort_indices()
+        self._avg_length = max(float(self.chunk_lengths.mean()), 1.0) if n_chunks else 1.0
+
+        df = np.diff(self.postings.indptr)
+        self.idf = np.log(1 + (n_chunks - df + 0.5) / (df + 0.5))
+
+        # Per-term score upper bounds: the best score any single posting can contribute
+        self.upper_bounds = np.zeros(len(df))
+        if self.postings.nnz:
+            term_of_entry = np.repeat(np.arange(len(df)), df)
+            scores = self._bm25(term_of_entry, self.postings.data, self.postings.indices)
+            nonempty = df > 0
+            self.upper_bounds[nonempty] = np.maximum.reduceat(scores, self.postings.indptr[:-1][nonempty])
+
+    def _bm25(self, term_ids, term_frequencies, chunk_ids) -> np.ndarray:
+        tf = np.asarray(term_frequencies, dtype=np.float64)
+        norm = self.k1 * (1 - self.b + self.b * self.chunk_lengths[chunk_ids] / self._avg_length)
+        return self.idf[term_ids] * tf * (self.k1 + 1) / (tf + norm)
+
+    def retrieve_batch(self, queries: List[str], k: int = 3, min_score: float = None) -> List[List[Dict]]:
+        """Retrieve top-k chunks for each query from the inverted index"""
+        if min_score is None:
+            min_score = self.min_score
+        if not self.is_fitted:
+            return [[] for _ in queries]
+        self._consolidate()
+
+        results = []
+        for query in queries:
+            chunk_ids, scores = self._search(query, k)
+            relevant_chunks = []
+            for idx, score in zip(chunk_ids, scores):
+                if score > min_score:
+                    relevant_chunks.append(self.document_chunks.view(idx, float(score)))
+            results.append(relevant_chunks)
+        return results
+
+    def _search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        term_ids = {self.term_ids[t] for t in self._tokenize(query) if t in self.term_ids}
+        order = sorted((t for t in term_ids if self.upper_bounds[t] > 0), key=lambda t: -self.upper_bounds[t])
+        if not order or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        # remaining[i]: the most any chunk can still gain from terms i onwards
+        remaining = np.append(np.cumsum(self.upper_bounds[order][::-1])[::-1], 0.0)
+        candidates = np.empty(0, dtype=np.int64)
+        scores = np.empty(0)
+        threshold = 0.0
+
+        for i, term_id in enumerate(order):
+            start, end = self.postings.indptr[term_id], self.postings.indptr[term_id + 1]
+            posting_ids = self.postings.indices[start:end]
+            posting_tfs = self.postings.data[start:end]
+
+            if len(candidates) >= k and remaining[i] <= threshold:
+                # Non-essential term: unseen chunks cannot reach the top k, so only
+                # look up the current candidates in this posting list
+                positions = np.minimum(np.searchsorted(posting_ids, candidates), len(posting_ids) - 1)
+                hit = posting_ids[positions] == candidates
+                scores[hit] += self._bm25(term_id, posting_tfs[positions[hit]], candidates[hit])
+                self.postings_skipped += len(posting_ids) - int(hit.sum())
+                self.postings_scored += int(hit.sum())
+            else:
+                term_scores = self._bm25(term_id, posting_tfs, posting_ids)
+                candidates, inverse = np.unique(np.concatenate([candidates, posting_ids]), return_inverse=True)
+                scores = np.bincount(inverse, weights=np.concatenate([scores, term_scores]))
+                self.postings_scored += len(posting_ids)
+
+            if len(candidates) >= k:
+                threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+                # Drop candidates that cannot reach the top k even with every remaining term
+                keep = scores + remaining[i + 1] >= threshold
+                candidates, scores = candidates[keep], scores[keep]
+
+        top = self._top_k(scores, k)
+        return candidates[top], scores[top]
+
+    def save(self, index_dir: str):
+        """Persist the term matrix, postings, score statistics and chunk metadata"""
+        with self._lock:
+            self._consolidate()
+            if not self.is_fitted:
+                raise ValueError("Cannot save an index that has not been fitted")
+
+            version, target = self._new_version_dir(index_dir)
+            _save_csr(target, 'terms_', self._chunk_terms)
+            postings = self.postings
+            np.save(os.path.join(target, 'postings_ids.npy'), postings.indices.astype(np.int32))
+            np.save(os.path.join(target, 'postings_tfs.npy'), postings.data.astype(np.int32))
+            np.save(os.path.join(target, 'postings_offsets.npy'), postings.indptr.astype(np.int64))
+            np.save(os.path.join(target, 'idf.npy'), self.idf)
+            np.save(os.path.join(target, 'upper_bounds.npy'), self.upper_bounds)
+            np.save(os.path.join(target, 'chunk_lengths.npy'), self.chunk_lengths)
+
+            terms = [None] * len(self.term_ids)
+            for term, term_id in self.term_ids.items():
+                terms[term_id] = term
+            with open(os.path.join(target, 'vocabulary.json'), 'w', encoding='utf-8') as f:
+                json.dump(terms, f)
+
+            meta = {
+                'format_version': INDEX_FORMAT_VERSION,
+                'mode': 'bm25',
+                'shape': list(self._chunk_terms.shape),
+                'k1': self.k1,
+                'b': self.b,
+                'avg_length': self._avg_length,
+                'documents': self._write_chunks(target),
+            }
+            with open(os.path.join(target, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+
+        self._publish_version(index_dir, version)
+
+    @classmethod
+    def load(cls, index_dir: str, mmap: bool = True) -> 'BM25RAGService':
+        """Open a saved index with postings and chunk texts memory-mapped"""
+        path, meta = cls._open_version(index_dir)
+        if meta.get('mode') != 'bm25':
+            raise ValueError(f"Not a BM25 index: {meta.get('mode')}")
+        mmap_mode = 'r' if mmap else None
+
+        def array(name):
+            return np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+
+        with open(os.path.join(path, 'vocabulary.json'), encoding='utf-8') as f:
+            terms = json.load(f)
+
+        shape = tuple(meta['shape'])
+        service = cls(k1=meta['k1'], b=meta['b'])
+        service.term_ids = {term: term_id for term_id, term in enumerate(terms)}
+        service._chunk_terms = _load_csr(path, 'terms_', shape, mmap_mode)
+        service.postings = sparse.csc_matrix(
+            (array('postings_tfs.npy'), array('postings_ids.npy'), array('postings_offsets.npy')),
+            shape=shape, copy=False
+        )
+        service.idf = array('idf.npy')
+        service.upper_bounds = array('upper_bounds.npy')
+        service.chunk_lengths = array('chunk_lengths.npy')
+        service._avg_length = meta['avg_length']
+        service._read_chunks(path, meta, mmap)
+        service.is_fitted = shape[0] > 0
+        return service
+
+
+class HashingEmbedder:
+    """
+    Deterministic stand-in encoder: hashed word counts folded into a small dense unit vector.
+    Needs no model download, so offline setups and tests get stable embeddings.
+    """
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+        self.name = f"hashing-{dimension}"
+        self._vectorizer = HashingVectorizer(
+            n_features=dimension,
+            stop_words='english',
+            ngram_range=(1, 1),
+            alternate_sign=True,
+            norm='l2'
+        )
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return self._vectorizer.transform(texts).toarray().astype(np.float32)
+
+
+class TransformerEmbedder:
+    """
+    Mean-pooled Hugging Face encoder, loaded on first use
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 32, max_length: int = 256):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self.name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self._torch = torch
+        self._tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self._model = AutoModel.from_pretrained(model_name).eval()
+        self.dimension = self._model.config.hidden_size
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        batches = []
+        with self._torch.inference_mode():
+            for start in range(0, len(texts), self.batch_size):
+                encoded = self._tokenizer(
+                    texts[start:start + self.batch_size],
+                    padding=True,
+                    truncation=True,
+                    max_length=self.max_length,
+                    return_tensors='pt'
+                )
+                hidden = self._model(**encoded).last_hidden_state
+                mask = encoded['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+                batches.append(pooled.float().numpy())
+        if not batches:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return normalize(np.vstack(batches)).astype(np.float32)
+
+
+EMBEDDERS = {
+    'hashing': HashingEmbedder,
+    'minilm': lambda: TransformerEmbedder('sentence-transformers/all-MiniLM-L6-v2'),
+}
+_embedder_instances = {}
+_embedder_lock = threading.Lock()
+
+
+def register_embedder(name: str, factory):
+    """Make an encoder available to the dense backend under a name usable in RAG_EMBEDDER"""
+    EMBEDDERS[name] = factory
+
+
+def get_embedder(name: str = None):
+    """Shared encoder instance; unknown names are treated as Hugging Face model ids"""
+    name = name or os.environ.get('RAG_EMBEDDER', 'hashing')
+    with _embedder_lock:
+        if name not in _embedder_instances:
+            factory = EMBEDDERS.get(name) or (lambda: TransformerEmbedder(name))
+            _embedder_instances[name] = factory()
+        return _embedder_instances[name]
+
+
+class DenseRAGService(BaseRAGService):
+    """
+    Embedding retriever with quantized vectors and an inverted-file (IVF) ANN index.
+
+    Vectors are stored as int8 codes with a per-row scale, or as float16. Small
+    indexes are searched exactly; past exact_threshold chunks a spherical k-means
+    coarse quantizer splits them into ~sqrt(n) lists and queries only scan the
+    n_probe lists closest to the query, trading recall for latency.
+    """
+
+    backend = 'dense'
+    min_score = 0.1
+
+    def __init__(self, embedder=None, quantization: str = None, n_probe: int = None, exact_threshold: int = None):
+        super().__init__()
+        self.embedder = embedder or get_embedder()
+        self.quantization = quantization or os.environ.get('RAG_DENSE_QUANTIZATION', 'int8')
+        if self.quantization not in ('int8', 'float16'):
+            raise ValueError(f"Unsupported quantization: {self.quantization}")
+        self.n_probe = n_probe or int(os.environ.get('RAG_DENSE_NPROBE', '8'))
+        self.exact_threshold = exact_threshold or int(os.environ.get('RAG_DENSE_EXACT_THRESHOLD', '2048'))
+
+        dimension = self.embedder.dimension
+        self._codes = np.zeros((0, dimension), dtype=np.int8 if self.quantization == 'int8' else np.float16)
+        self._scales = np.zeros(0, dtype=np.float32)
+        self._pending = []  # (chunks, float32 vectors) appended since the last consolidation
+        self.centroids = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._list_order = np.zeros(0, dtype=np.int64)
+        self._list_offsets = np.zeros(1, dtype=np.int64)
+        self._trained_size = 0
+
+    def index_document(self, document_id: str, content: str) -> List[Dict]:
+        return self.index_documents([{'id': document_id, 'content': content}])
+
+    def index_documents(self, documents: List[Dict]) -> List[Dict]:
+        """Chunk the documents and embed all their chunks in batched encoder calls"""
+        with self._lock:
+            chunks = []
+            for doc in documents:
+                chunks.extend(self._chunk_document(doc.get('id', ''), doc.get('content', '')))
+            return self._add_chunks(chunks)
+
+    def _add_chunks(self, chunks: List[Dict]) -> List[Dict]:
+        if not chunks:
+            return []
+        vectors = self.embedder.embed([c['content'] for c in chunks])
+        with self._lock:
+            self._pending.append((chunks, vectors))
+            self.is_fitted = True
+
+        return [dict(chunk, embedding=vector.round(6).tolist()) for chunk, vector in zip(chunks, vectors)]
+
+    def remove_document(self, document_id: str, refit: bool = True) -> bool:
+        with self._lock:
+            if document_id not in self.documents:
+                return False
+            del self.documents[document_id]
+            self._consolidate()
+
+            keep = ~self.document_chunks.rows_of(document_id)
+            self._codes = self._codes[keep]
+            self._scales = self._scales[keep]
+            self.document_chunks.select(keep)
+            self.is_fitted = len(self.document_chunks) > 0
+            if self.centroids is not None:
+                self._assignments = self._assignments[keep]
+                self._rebuild_lists()
+            return True
+
+    def _quantize(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if self.quantization == 'float16':
+            return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    def _vectors(self, rows) -> np.ndarray:
+        """Dequantized float32 vectors for the given rows"""
+        return self._codes[rows].astype(np.float32) * self._scales[rows, None]
+
+    def _consolidate(self):
+        """Quantize pending vectors and keep the IVF lists in step with the corpus"""
+        with self._lock:
+            if not self._pending:
+                return
+            start = len(self._codes)
+            vectors = np.vstack([v for _, v in self._pending])
+            codes, scales = self._quantize(vectors)
+            self._codes = np.concatenate([self._codes, codes])
+            self._scales = np.concatenate([self._scales, scales])
+            for chunks, _ in self._pending:
+                self.document_chunks.extend(chunks)
+            self._pending = []
+
+            n_chunks = len(self._codes)
+            if n_chunks < self.exact_threshold:
+                self.centroids = None
+            elif self.centroids is None or n_chunks > 2 * self._trained_size:
+                # Retrain once the corpus has doubled so lists stay balanced
+                self._train()
+            else:
+                self._assignments = np.concatenate([self._assignments, self._assign(np.arange(start, n_chunks))])
+                self._rebuild_lists()
+
+    def _assign(self, rows: np.ndarray, block: int = 8192) -> np.ndarray:
+        assignments = [
+            np.argmax(self._vectors(rows[i:i + block]) @ self.centroids.T, axis=1)
+            for i in range(0, len(rows), block)
+        ]
+        return np.concatenate(assignments).astype(np.int32) if assignments else np.zeros(0, dtype=np.int32)
+
+    def _train(self, iterations: int = 10, sample_per_list: int = 64):
+        """Spherical k-means over a sample of the corpus"""
+        n_chunks = len(self._codes)
+        n_lists = max(1, min(1024, int(round(np.sqrt(n_chunks)))))
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(n_chunks, size=min(n_chunks, n_lists * sample_per_list), replace=False))
+        sample = normalize(self._vectors(sample_rows))
+
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)]
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            filled = np.bincount(labels, minlength=n_lists) > 0
+            centroids[filled] = normalize(sums[filled])
+
+        self.centroids = centroids.astype(np.float32)
+        self._trained_size = n_chunks
+        self._assignments = self._assign(np.arange(n_chunks))
+        self._rebuild_lists()
+
+    def _rebuild_lists(self):
+        self._list_order = np.argsort(self._assignments, kind='stable')
+        counts = np.bincount(self._assignments, minlength=len(self.centroids))
+        self._list_offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        return self.embedder.embed(queries)
+
+    def retrieve_batch(self, queries: List[str], k: int = 3, min_score: float = None,
+                       n_probe: int = None) -> List[List[Dict]]:
+        """Retrieve top-k chunks per query by cosine similarity of embeddings"""
+        if not self.is_fitted:
+            return [[] for _ in queries]
+        return self.retrieve_vectors(self.embed_queries(queries), k, min_score, n_probe)
+
+    def retrieve_vectors(self, query_vectors: np.ndarray, k: int = 3, min_score: float = None,
+                         n_probe: int = None) -> List[List[Dict]]:
+        """Retrieve top-k chunks for already embedded queries"""
+        if min_score is None:
+            min_score = self.min_score
+        if not self.is_fitted:
+            return [[] for _ in query_vectors]
+        self._consolidate()
+
+        if self.centroids is None:
+            # Exact search: one matrix product over every chunk for the whole batch
+            all_scores = (self._codes.astype(np.float32) @ query_vectors.T) * self._scales[:, None]
+            hits = [(np.arange(len(self._codes)), all_scores[:, i]) for i in range(len(query_vectors))]
+        else:
+            n_probe = min(n_probe or self.n_probe, len(self.centroids))
+            probes = np.argsort(-(query_vectors @ self.centroids.T), axis=1)[:, :n_probe]
+            hits = []
+            for query_vector, lists in zip(query_vectors, probes):
+                rows = np.concatenate([
+                    self._list_order[self._list_offsets[l]:self._list_offsets[l + 1]] for l in lists
+                ])
+                hits.append((rows, self._vectors(rows) @ query_vector))
+
+        results = []
+        for rows, scores in hits:
+            relevant_chunks = []
+            for idx in self._top_k(scores, k):
+                if scores[idx] > min_score:
+                    relevant_chunks.append(self.document_chunks.view(rows[idx], float(scores[idx])))
+            results.append(relevant_chunks)
+        return results
+
+    def save(self, index_dir: str):
+        """Persist quantized vectors, the IVF lists and chunk metadata"""
+        with self._lock:
+            self._consolidate()
+            if not self.is_fitted:
+                raise ValueError("Cannot save an index that has not been fitted")
+
+            version, target = self._new_version_dir(index_dir)
+            np.save(os.path.join(target, 'codes.npy'), self._codes)
+            np.save(os.path.join(target, 'scales.npy'), self._scales)
+            if self.centroids is not None:
+                np.save(os.path.join(target, 'centroids.npy'), self.centroids)
+                np.save(os.path.join(target, 'assignments.npy'), self._assignments)
+                np.save(os.path.join(target, 'list_order.npy'), self._list_order)
+                np.save(os.path.join(target, 'list_offsets.npy'), self._list_offsets)
+
+            meta = {
+                'format_version': INDEX_FORMAT_VERSION,
+                'mode': 'dense',
+                'embedder': self.embedder.name,
+                'dimension': self.embedder.dimension,
+                'quantization': self.quantization,
+                'ivf': self.centroids is not None,
+                'trained_size': self._trained_size,
+                'documents': self._write_chunks(target),
+            }
+            with open(os.path.join(target, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+
+        self._publish_version(index_dir, version)
+
+    @classmethod
+    def load(cls, index_dir: str, mmap: bool = True, embedder=None) -> 'DenseRAGService':
+        """Open a saved index with vectors and chunk texts memory-mapped"""
+        path, meta = cls._open_version(index_dir)
+        if meta.get('mode') != 'dense':
+            raise ValueError(f"Not a dense index: {meta.get('mode')}")
+        embedder = embedder or get_embedder()
+        if embedder.name != meta['embedder']:
+            raise ValueError(f"Index was embedded with {meta['embedder']}, not {embedder.name}")
+        mmap_mode = 'r' if mmap else None
+
+        def array(name):
+            return np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+
+        service = cls(embedder=embedder, quantization=meta['quantization'])
+        service._codes = array('codes.npy')
+        service._scales = array('scales.npy')
+        if meta['ivf']:
+            service.centroids = np.load(os.path.join(path, 'centroids.npy'))
+            service._assignments = array('assignments.npy')
+            service._list_order = array('list_order.npy')
+            service._list_offsets = array('list_offsets.npy')
+            service._trained_size = meta['trained_size']
+        service._read_chunks(path, meta, mmap)
+        service.is_fitted = len(service._codes) > 0
+        return service
+
+
+RAG_BACKENDS = {
+    'tfidf': SimpleRAGService,
+    'bm25': BM25RAGService,
+    'dense': DenseRAGService,
+}
+
+
+def default_backend() -> str:
+    """Backend used when a request does not name one"""
+    return os.environ.get('RAG_BACKEND', 'tfidf')
+
+
+def create_rag_service(backend: str = 'tfidf', incremental: bool = False) -> BaseRAGService:
+    """Build an empty index for the named backend; BM25 and dense indexes are always incremental"""
+    if backend not in RAG_BACKENDS:
+        raise ValueError(f"Unknown RAG backend: {backend}")
+    if backend == 'tfidf':
+        return SimpleRAGService(incremental=incremental)
+    return RAG_BACKENDS[backend]()
+
+
+class RAGIndexCache:
+    """
+    Bounded LRU cache of fitted RAG indexes keyed by backend and a hash of the document set
+    """
+
+    def __init__(self, max_entries: int = 16, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (service, created_at)
+        self._lock = threading.Lock()
+        self._building = {}  # key -> Event set once the in-flight build finishes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def document_set_key(documents: List[Dict]) -> str:
+        """Hash document ids and content hashes in order, so identical sets share an index"""
+        digest = hashlib.sha256()
+        for doc in documents:
+            digest.update(str(doc.get('id', '')).encode('utf-8'))
+            digest.update(b'\0')
+            digest.update(document_hash(doc).encode('ascii'))
+        return digest.hexdigest()
+
+    def get_or_build(self, documents: List[Dict], session_id: str = None, backend: str = 'tfidf') -> BaseRAGService:
+        """
+        Return a fitted index for the documents, building it only on a cache miss.
+
+        With a session_id, a miss first tries the session's persistent index and
+        a fresh build is written back so the next process can map it instead.
+        """
+        key = f"{backend}:{self.document_set_key(documents)}"
+
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    service, created_at = entry
+                    if time.time() - created_at <= self.ttl_seconds:
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                        return service
+                    del self._entries[key]
+                    self.expirations += 1
+
+                # Concurrent requests for the same set wait for a single build
+                building = self._building.get(key)
+                if building is None:
+                    self._building[key] = threading.Event()
+                    self.misses += 1
+                    break
+            building.wait()
+
+        try:
+            # Referenced documents are only read from the store when the index has to be built
+            service = load_session_index(session_id, documents, backend) if session_id else None
+            if service is None:
+                service = create_rag_service(backend, incremental=bool(session_id))
+                build_index(service, resolve_documents(documents))
+                if session_id:
+                    save_session_index(session_id, service)
+
+            with self._lock:
+                self._entries[key] = (service, time.time())
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        finally:
+            with self._lock:
+                self._building.pop(key).set()
+
+        return service
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+def load_session_index(session_id: str, documents: List[Dict] = None, backend: str = 'tfidf'):
+    """Load a session's persistent index, or None if missing, unreadable or out of date"""
+    index_dir = session_index_dir(session_id, backend)
+    if not BaseRAGService.has_index(index_dir):
+        return None
+    try:
+        with request_metrics.stage('rag_load'):
+            service = RAG_BACKENDS[backend].load(index_dir)
+    except Exception as e:
+        print(f"Ignoring unreadable {backend} index for session {session_id}: {e}", file=sys.stderr)
+        return None
+    if documents is not None and not service.covers(documents):
+        return None
+    return service
+
+
+def save_session_index(session_id: str, service: BaseRAGService):
+    """Persist a session index; failures only cost a rebuild later, so they are logged"""
+    if not service.is_fitted:
+        return
+    try:
+        service.save(session_index_dir(session_id, service.backend))
+    except Exception as e:
+        print(f"Failed to persist {service.backend} index for session {session_id}: {e}", file=sys.stderr)
+
+
+def build_index(service: BaseRAGService, documents: List[Dict]) -> List[Dict]:
+    """Index resolved documents; the time not spent chunking is reported as the rag_fit stage"""
+    with request_metrics.stage('rag_fit'):
+        return service.index_documents(documents)
+
+
+def resolve_index(request_data: Dict, index_cache: RAGIndexCache = None) -> BaseRAGService:
+    """Index the request's documents, reusing a cached or persisted index for a set seen before"""
+    documents = request_data.get('documents', [])
+    session_id = request_data.get('session_id')
+    backend = request_data.get('backend') or default_backend()
+
+    if index_cache is not None:
+        return index_cache.get_or_build(documents, session_id, backend)
+
+    rag_service = load_session_index(session_id, documents, backend) if session_id else None
+    if rag_service is None:
+        rag_service = create_rag_service(backend, incremental=bool(session_id))
+        build_index(rag_service, resolve_documents(documents))
+        if session_id:
+            save_session_index(session_id, rag_service)
+    return rag_service
+
+
+def handle_request(request_data: Dict, index_cache: RAGIndexCache = None) -> Dict:
+    """Handle a single RAG action; shared by the CLI entry point and in-process callers"""
+    action = request_data.get('action')
+
+    if action == 'index_document':
+        document_id = request_data.get('document_id')
+        content = request_data.get('content')
+        if content is None and request_data.get('content_hash'):
+            content = DocumentStore().get(request_data['content_hash'])
+        session_id = request_data.get('session_id')
+
+        backend = request_data.get('backend') or default_backend()
+
+        # Add the document to the session's persistent index when one is given;
+        # session indexes are incremental so an upload only vectorizes its own chunks
+        rag_service = (load_session_index(session_id, backend=backend) if session_id else None) \
+            or create_rag_service(backend, incremental=bool(session_id))
+        with request_metrics.stage('rag_fit'):
+            chunks = rag_service.index_document(document_id, content)
+        if session_id:
+            save_session_index(session_id, rag_service)
+
+        return {
+            'status': 'success',
+            'chunks_created': len(chunks),
+            'chunks': chunks
+        }
+
+    elif action == 'retrieve_context':
+        query = request_data.get('query', '')
+        rag_service = resolve_index(request_data, index_cache)
+
+        # Score once: the context packs the top 5 chunks, the response lists the top 3
+        query_embedding = None
+        with request_metrics.stage('rag_retrieve'):
+            if isinstance(rag_service, DenseRAGService):
+                query_vectors = rag_service.embed_queries([query])
+                chunks = rag_service.retrieve_vectors(query_vectors, k=5)[0]
+                context = rag_service.build_context(chunks)
+                query_embedding = query_vectors[0].round(6).tolist()
+            else:
+                chunks, context = rag_service.retrieve_with_context(query, k=5)
+            # Hits are views into the chunk store; the response needs plain records
+            relevant_chunks = [dict(chunk) for chunk in chunks[:3]]
+
+        response = {
+            'status': 'success',
+            'context': context,
+            'relevant_chunks': relevant_chunks,
+            'chunks_found': len(relevant_chunks)
+        }
+        if query_embedding is not None:
+            response['query_embedding'] = query_embedding
+        return response
+
+    elif action == 'retrieve_batch':
+        queries = request_data.get('queries', [])
+        k = int(request_data.get('k', 5))
+        rag_service = resolve_index(request_data, index_cache)
+
+        results = []
+        with request_metrics.stage('rag_retrieve'):
+            for chunks in rag_service.retrieve_batch(queries, k=k):
+                results.append({
+                    'context': BaseRAGService.build_context(chunks),
+                    'relevant_chunks': [dict(chunk) for chunk in chunks],
+                    'chunks_found': len(chunks)
+                })
+
+        return {
+            'status': 'success',
+            'results': results
+        }
+
+    elif action == 'remove_document':
+        session_id = request_data.get('session_id')
+        document_id = request_data.get('document_id')
+
+        # Drop the document from every backend's index kept for the session
+        removed = False
+        for backend in (RAG_BACKENDS if session_id else ()):
+            rag_service = load_session_index(session_id, backend=backend)
+            if rag_service is None or not rag_service.remove_document(document_id):
+                continue
+            removed = True
+            if rag_service.is_fitted:
+                save_session_index(session_id, rag_service)
+            else:
+                shutil.rmtree(session_index_dir(session_id, backend), ignore_errors=True)
+
+        return {
+            'status': 'success',
+            'removed': removed
+        }
+
+    return {
+        'status': 'error',
+        'message': f'Unknown action: {action}'
+    }
+
 
 def main():
     try:
@@ -142,47 +1843,7 @@ def main():
         input_data = sys.stdin.read()
         request_data = json.loads(input_data)
         
-        action = request_data.get('action')
-        rag_service = SimpleRAGService()
-        
-        if action == 'index_document':
-            document_id = request_data.get('document_id')
-            content = request_data.get('content')
-            
-            chunks = rag_service.index_document(document_id, content)
-            
-            result = {
-                'status': 'success',
-                'chunks_created': len(chunks),
-                'chunks': chunks
-            }
-            
-        elif action == 'retrieve_context':
-            # For this demo, we'll simulate having indexed documents
-            # In a real implementation, you'd load from database
-            documents = request_data.get('documents', [])
-            query = request_data.get('query', '')
-            
-            # Index documents
-            for doc in documents:
-                rag_service.index_document(doc.get('id', ''), doc.get('content', ''))
-            
-            # Generate context
-            context = rag_service.generate_context(query)
-            relevant_chunks = rag_service.retrieve_relevant_chunks(query)
-            
-            result = {
-                'status': 'success',
-                'context': context,
-                'relevant_chunks': relevant_chunks,
-                'chunks_found': len(relevant_chunks)
-            }
-            
-        else:
-            result = {
-                'status': 'error',
-                'message': f'Unknown action: {action}'
-            }
+        result = handle_request(request_data)
         
         print(json.dumps(result))
         
@@ -194,4 +1855,4 @@ def main():
         print(json.dumps(error_result))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
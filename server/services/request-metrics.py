@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""Per-request stage timings, process-wide latency/token histograms and sampled profiling.
+
+Work is timed by wrapping it in ``stage(name)``. The time is added to the
+traces of the requests being served (see ``trace``) and to the
+``ai_agent_stage_seconds`` histogram. Stage times are exclusive: a nested stage's
+time is not counted again in the stage around it, so a request's stage times
+add up to at most its total time. Threads that do work on behalf of requests
+(batch dispatchers, summary pools) ``attach`` to what the requesting thread
+``capture``d.
+
+``registry.collect()`` returns every metric family as JSON; the Node server
+renders them in the Prometheus text format on ``/metrics``.
+"""
+
+import os
+import sys
+import time
+import random
+import cProfile
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+TOKEN_BUCKETS = [8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192]
+
+
+class Histogram:
+    """Cumulative fixed-bucket histogram, reported in Prometheus ``le`` form"""
+
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            cumulative, buckets = 0, {}
+            for bound, count in zip(self.buckets, self._counts):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            buckets["+Inf"] = self._count
+            return {"buckets": buckets, "sum": round(self._sum, 6), "count": self._count}
+
+
+class CounterValue:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"value": self._value}
+
+
+class MetricFamily:
+    """A named metric with one child (Histogram or CounterValue) per label combination"""
+
+    def __init__(self, name: str, kind: str, help_text: str, factory):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self._factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels):
+        key = tuple(sorted((name, str(value)) for name, value in labels.items()))
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._factory()
+            return child
+
+    def collect(self) -> dict:
+        with self._lock:
+            children = list(self._children.items())
+        return {
+            "name": self.name,
+            "type": self.kind,
+            "help": self.help,
+            "samples": [dict(child.snapshot(), labels=dict(key)) for key, child in children],
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def _family(self, name: str, kind: str, help_text: str, factory) -> MetricFamily:
+        with self._lock:
+            if name not in self._families:
+                self._families[name] = MetricFamily(name, kind, help_text, factory)
+            return self._families[name]
+
+    def histogram(self, name: str, help_text: str, buckets) -> MetricFamily:
+        return self._family(name, "histogram", help_text, lambda: Histogram(buckets))
+
+    def counter(self, name: str, help_text: str) -> MetricFamily:
+        return self._family(name, "counter", help_text, CounterValue)
+
+    def collect(self) -> List[Dict]:
+        with self._lock:
+            families = list(self._families.values())
+        return [family.collect() for family in families]
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "ai_agent_stage_seconds", "Time spent in each request stage, excluding nested stages", LATENCY_BUCKETS
+)
+REQUEST_SECONDS = registry.histogram("ai_agent_request_seconds", "End-to-end request time by tool", LATENCY_BUCKETS)
+REQUEST_TOKENS = registry.histogram("ai_agent_request_tokens", "Model input and output tokens per request", TOKEN_BUCKETS)
+REQUESTS = registry.counter("ai_agent_requests_total", "Requests handled by tool, outcome and cache use")
+
+
+class RequestTrace:
+    """Stage times of one request"""
+
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self._stages[name] = self._stages.get(name, 0.0) + seconds
+
+    def timings(self) -> Dict[str, float]:
+        with self._lock:
+            return {name: round(seconds, 4) for name, seconds in self._stages.items()}
+
+
+class _Frame:
+    """An open stage; collects the time of stages nested in it"""
+    __slots__ = ("nested",)
+
+    def __init__(self):
+        self.nested = 0.0
+
+
+_traces = contextvars.ContextVar("request_traces", default=())
+_parents = contextvars.ContextVar("stage_parents", default=())
+
+
+@contextmanager
+def trace():
+    """Collect the stages timed in this context into a new RequestTrace"""
+    request_trace = RequestTrace()
+    traces_token = _traces.set(_traces.get() + (request_trace,))
+    parents_token = _parents.set(())
+    try:
+        yield request_trace
+    finally:
+        _parents.reset(parents_token)
+        _traces.reset(traces_token)
+
+
+@contextmanager
+def stage(name: str):
+    """Time the enclosed work as stage ``name`` of the current requests"""
+    parents = _parents.get()
+    frame = _Frame()
+    token = _parents.set((frame,))
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _parents.reset(token)
+        for parent in parents:
+            parent.nested += elapsed
+        own = max(0.0, elapsed - frame.nested)
+        STAGE_SECONDS.labels(stage=name).observe(own)
+        for request_trace in _traces.get():
+            request_trace.add(name, own)
+
+
+def capture():
+    """The current requests and open stage, for another thread to attach to"""
+    return _traces.get(), _parents.get()
+
+
+@contextmanager
+def attach(captured: Iterable):
+    """Time stages in this thread for the requests of one or more captures (e.g. a batch)"""
+    traces, parents = [], []
+    for capture_traces, capture_parents in captured:
+        traces.extend(t for t in capture_traces if t not in traces)
+        parents.extend(p for p in capture_parents if p not in parents)
+    traces_token = _traces.set(tuple(traces))
+    parents_token = _parents.set(tuple(parents))
+    try:
+        yield
+    finally:
+        _parents.reset(parents_token)
+        _traces.reset(traces_token)
+
+
+def observe_request(tool: str, seconds: float, status: str, cached: bool,
+                    input_tokens: Optional[int] = None, output_tokens: Optional[int] = None):
+    REQUEST_SECONDS.labels(tool=tool).observe(seconds)
+    REQUESTS.labels(tool=tool, status=status, cache="hit" if cached else "miss").inc()
+    if input_tokens is not None:
+        REQUEST_TOKENS.labels(tool=tool, direction="input").observe(input_tokens)
+    if output_tokens is not None:
+        REQUEST_TOKENS.labels(tool=tool, direction="output").observe(output_tokens)
+
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval into collapsed ("folded") stacks"""
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def write(self, path: str):
+        # One "root;...;leaf count" line per stack, as written by py-spy --format raw
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class RequestProfiler:
+    """
+    Profiles a random sample of requests and writes one trace file per sampled request.
+
+    ``cprofile`` writes pstats files (``python -m pstats``, snakeviz); ``folded``
+    samples the request thread's stack and writes collapsed stacks that
+    flamegraph.pl and speedscope read like py-spy's raw output. Only one request
+    is profiled at a time; requests sampled meanwhile run unprofiled.
+    """
+
+    FORMATS = ("cprofile", "folded")
+
+    def __init__(self, sample_rate: float = 0.0, directory: str = None, fmt: str = "cprofile", interval: float = 0.005):
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Unknown profile format: {fmt}")
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+        self.directory = directory or os.path.join(os.getcwd(), ".profiles")
+        self.format = fmt
+        self.interval = interval
+        self._busy = threading.Lock()
+        self.profiled = 0
+
+    @contextmanager
+    def profile(self, label: str):
+        """Profile the enclosed work if this request is sampled; yields a dict that gets the trace's 'path'"""
+        result = {}
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate or not self._busy.acquire(blocking=False):
+            yield result
+            return
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            suffix = "prof" if self.format == "cprofile" else "folded"
+            path = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{label}-{self.profiled}.{suffix}")
+            if self.format == "cprofile":
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    yield result
+                finally:
+                    profiler.disable()
+                    profiler.dump_stats(path)
+            else:
+                sampler = StackSampler(threading.get_ident(), self.interval)
+                sampler.start()
+                try:
+                    yield result
+                finally:
+                    sampler.stop()
+                    sampler.write(path)
+            self.profiled += 1
+            result["path"] = path
+        finally:
+            self._busy.release()
+
+    def stats(self) -> Dict:
+        return {"sampleRate": self.sample_rate, "format": self.format, "profiled": self.profiled}
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from sklearn.preprocessing import normalize
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query"""
+    return re.sub(r'\s+', ' ', query).strip().lower()
+
+
+def context_hash(context: str) -> str:
+    return hashlib.sha256(context.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of generated responses keyed by tool type, normalized query
+    and a hash of the context the model was given.
+
+    With a vectorizer and a similarity threshold, a query that misses exactly is
+    also matched against cached queries for the same tool and context by cosine
+    similarity. With a persist_path, entries are written through to SQLite and
+    reloaded on start so they survive worker restarts.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600, persist_path: str = None,
+                 vectorizer=None, similarity_threshold: float = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.vectorizer = vectorizer if similarity_threshold else None
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()  # key -> entry dict
+        self._groups = {}  # (tool, context hash) -> {key: query vector}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+        self._conn = None
+        if persist_path:
+            os.makedirs(os.path.dirname(persist_path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(persist_path, check_same_thread=False, timeout=30)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    tool TEXT NOT NULL,
+                    context_hash TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    generation_seconds REAL NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            self._conn.commit()
+            self._warm()
+
+    @staticmethod
+    def make_key(tool: str, query: str, context: str) -> Tuple[str, str, str]:
+        """(key, normalized query, context hash) for a request"""
+        normalized = normalize_query(query)
+        digest = context_hash(context)
+        key = hashlib.sha256(json.dumps([tool, normalized, digest]).encode('utf-8')).hexdigest()
+        return key, normalized, digest
+
+    def get(self, tool: str, query: str, context: str) -> Optional[Dict]:
+        """Cached entry for the request, exact or near-duplicate, or None"""
+        key, normalized, digest = self.make_key(tool, query, context)
+        now = time.time()
+        with self._lock:
+            entry = self._live(key, now)
+            match = 'exact'
+            if entry is None and self.vectorizer is not None:
+                entry = self._similar(tool, digest, normalized, now)
+                match = 'similar'
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(entry['key'])
+            if match == 'exact':
+                self.hits += 1
+            else:
+                self.similar_hits += 1
+            self.saved_seconds += entry['generation_seconds']
+            return dict(entry, match=match)
+
+    def put(self, tool: str, query: str, context: str, response: str, generation_seconds: float):
+        key, normalized, digest = self.make_key(tool, query, context)
+        entry = {
+            'key': key,
+            'tool': tool,
+            'context_hash': digest,
+            'query': normalized,
+            'response': response,
+            'generation_seconds': generation_seconds,
+            'created_at': time.time(),
+        }
+        with self._lock:
+            self._insert(entry)
+            if self._conn is not None:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (key, tool, digest, normalized, response, generation_seconds, entry['created_at'])
+                )
+                self._conn.execute('DELETE FROM responses WHERE created_at < ?', (time.time() - self.ttl_seconds,))
+                self._conn.commit()
+
+    def get_or_generate(self, tool: str, query: str, context: str, generate: Callable[[], str]) -> Tuple[str, Optional[Dict]]:
+        """Return (response, cache entry or None on a miss), generating and storing on a miss.
+
+        Responses that report an error are not cached.
+        """
+        entry = self.get(tool, query, context)
+        if entry is not None:
+            return entry['response'], entry
+
+        start = time.time()
+        response = generate()
+        if not response.startswith(("❌", "⚠️")):
+            self.put(tool, query, context, response, time.time() - start)
+        return response, None
+
+    def _live(self, key: str, now: float) -> Optional[Dict]:
+        """Unexpired entry for key, dropping it if it has expired. Caller holds the lock."""
+        entry = self._entries.get(key)
+        if entry is not None and now - entry['created_at'] > self.ttl_seconds:
+            self._remove(key)
+            return None
+        return entry
+
+    def _similar(self, tool: str, digest: str, normalized: str, now: float) -> Optional[Dict]:
+        group = self._groups.get((tool, digest))
+        if not group:
+            return None
+        query_vector = self._vectorize(normalized)
+        best_key, best_score = None, self.similarity_threshold
+        for key, vector in list(group.items()):
+            score = query_vector.multiply(vector).sum()
+            if score >= best_score and self._live(key, now) is not None:
+                best_key, best_score = key, score
+        return self._entries.get(best_key) if best_key else None
+
+    def _vectorize(self, text: str):
+        return normalize(self.vectorizer.transform([text]))
+
+    def _insert(self, entry: Dict):
+        """Add an entry and evict least-recently-used ones over capacity. Caller holds the lock."""
+        key = entry['key']
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        if self.vectorizer is not None:
+            self._groups.setdefault((entry['tool'], entry['context_hash']), {})[key] = self._vectorize(entry['query'])
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        group = self._groups.get((entry['tool'], entry['context_hash']))
+        if group is not None:
+            group.pop(key, None)
+            if not group:
+                del self._groups[(entry['tool'], entry['context_hash'])]
+
+    def _warm(self):
+        """Load the newest unexpired persisted entries into memory"""
+        try:
+            rows = self._conn.execute(
+                'SELECT key, tool, context_hash, query, response, generation_seconds, created_at '
+                'FROM responses WHERE created_at >= ? ORDER BY created_at DESC LIMIT ?',
+                (time.time() - self.ttl_seconds, self.max_entries)
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Could not load persisted responses: {e}", file=sys.stderr)
+            return
+        columns = ('key', 'tool', 'context_hash', 'query', 'response', 'generation_seconds', 'created_at')
+        with self._lock:
+            for row in reversed(rows):
+                self._insert(dict(zip(columns, row)))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.similar_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'maxEntries': self.max_entries,
+                'hits': self.hits,
+                'similarHits': self.similar_hits,
+                'misses': self.misses,
+                'hitRatio': round((self.hits + self.similar_hits) / lookups, 4) if lookups else None,
+                'savedSeconds': round(self.saved_seconds, 2),
+                'persistent': self._conn is not None,
+            }
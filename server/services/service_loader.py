@@ -0,0 +1,32 @@
+"""Import the sibling service scripts, whose dashed file names are not valid module names.
+
+Every service loads its siblings through ``load_service_module``, so a script
+used by several of them (e.g. rag-service.py by the agent and the ingestion
+worker) is executed once per process and its module state, such as caches and
+metrics, is shared.
+"""
+
+import os
+import sys
+import threading
+import importlib.util
+
+SERVICES_DIR = os.path.dirname(os.path.abspath(__file__))
+_lock = threading.RLock()
+
+
+def load_service_module(filename: str, module_name: str):
+    """The module of a service script in this directory, executing it on first use only"""
+    with _lock:
+        if module_name in sys.modules:
+            return sys.modules[module_name]
+        spec = importlib.util.spec_from_file_location(module_name, os.path.join(SERVICES_DIR, filename))
+        module = importlib.util.module_from_spec(spec)
+        # Registered before it runs, so scripts that load each other get this same instance
+        sys.modules[module_name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules[module_name]
+            raise
+        return module
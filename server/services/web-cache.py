@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+TIERS = ('search', 'page', 'summary')
+
+FRESH = 'fresh'
+STALE = 'stale'
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a search query"""
+    return re.sub(r'\s+', ' ', query).strip().lower()
+
+
+def content_key(text: str, *params) -> str:
+    """Key for values derived from a piece of text, e.g. its summary"""
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    return ':'.join([digest] + [str(p) for p in params])
+
+
+def max_age(headers: Dict[str, str], default: float) -> Optional[float]:
+    """Freshness lifetime from Cache-Control, or the default; None means do not store"""
+    cache_control = (headers.get('Cache-Control') or headers.get('cache-control') or '').lower()
+    if 'no-store' in cache_control:
+        return None
+    match = re.search(r'max-age=(\d+)', cache_control)
+    return float(match.group(1)) if match else default
+
+
+class WebCache:
+    """
+    Persistent three-tier cache for web search: result lists keyed by normalized
+    query, extracted page text keyed by URL (with ETag/Last-Modified validators)
+    and summaries keyed by content hash.
+
+    Entries live in one SQLite file shared by all worker processes, and the
+    least recently used ones are evicted once the file's payload exceeds
+    max_bytes. A hit only records its access time when the recorded one is
+    more than access_resolution seconds old, so most reads do not write to
+    the shared file. Expired entries are still served for stale_seconds while a
+    background refresh brings them up to date.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024, stale_seconds: float = 86400,
+                 access_resolution: float = 10):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.stale_seconds = stale_seconds
+        self.access_resolution = access_resolution
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS entries (
+                tier TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL,
+                etag TEXT,
+                last_modified TEXT,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (tier, key)
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_access)')
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+        self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cache-refresh')
+        self._refreshing = set()
+        self.counters = {tier: {'hits': 0, 'staleHits': 0, 'misses': 0} for tier in TIERS}
+
+    def get(self, tier: str, key: str) -> Tuple[Any, Optional[str], Dict]:
+        """Return (value, FRESH/STALE/None, validators) and count the lookup"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, expires_at, etag, last_modified, last_access FROM entries WHERE tier = ? AND key = ?',
+                (tier, key)
+            ).fetchone()
+
+            state = None
+            if row is not None:
+                expires_at = row[1]
+                if expires_at is None or now < expires_at:
+                    state = FRESH
+                elif now < expires_at + self.stale_seconds:
+                    state = STALE
+
+            if state is None:
+                self.counters[tier]['misses'] += 1
+                return None, None, {}
+
+            self.counters[tier]['hits' if state == FRESH else 'staleHits'] += 1
+            if now - row[4] >= self.access_resolution:
+                self._conn.execute('UPDATE entries SET last_access = ? WHERE tier = ? AND key = ?', (now, tier, key))
+                self._conn.commit()
+
+        return json.loads(row[0]), state, {'etag': row[2], 'last_modified': row[3]}
+
+    def put(self, tier: str, key: str, value: Any, ttl: Optional[float] = None,
+            etag: str = None, last_modified: str = None):
+        """Store a value; ttl None keeps it until evicted"""
+        payload = json.dumps(value)
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (tier, key, payload, len(payload), expires_at, etag, last_modified, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def touch(self, tier: str, key: str, ttl: float):
+        """Extend an entry's freshness after the origin confirmed it unchanged"""
+        with self._lock:
+            self._conn.execute(
+                'UPDATE entries SET expires_at = ?, last_access = ? WHERE tier = ? AND key = ?',
+                (time.time() + ttl, time.time(), tier, key)
+            )
+            self._conn.commit()
+
+    def _evict(self):
+        """Drop least-recently-used entries until under max_bytes. Caller holds the lock."""
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        victims, freed = [], 0
+        for tier, key, size in self._conn.execute('SELECT tier, key, size FROM entries ORDER BY last_access'):
+            victims.append((tier, key))
+            freed += size
+            if freed >= excess:
+                break
+        self._conn.executemany('DELETE FROM entries WHERE tier = ? AND key = ?', victims)
+
+    def refresh(self, tier: str, key: str, refresher: Callable[[], None]):
+        """Run refresher in the background unless this entry is already being refreshed"""
+        with self._lock:
+            if (tier, key) in self._refreshing:
+                return
+            self._refreshing.add((tier, key))
+
+        def run():
+            try:
+                refresher()
+            except Exception as e:
+                print(f"Background refresh of {tier} entry failed: {e}", file=sys.stderr)
+            finally:
+                with self._lock:
+                    self._refreshing.discard((tier, key))
+
+        self._refresher.submit(run)
+
+    def get_or_load(self, tier: str, key: str, loader: Callable[[], Any], ttl: Optional[float] = None,
+                    cacheable: Callable[[Any], bool] = None):
+        """Serve from cache, revalidating stale entries in the background, or load and store.
+
+        Loaded values that cacheable rejects are returned but not stored, and do
+        not replace a stale entry.
+        """
+        def load_and_store():
+            value = loader()
+            if cacheable is None or cacheable(value):
+                self.put(tier, key, value, ttl)
+            return value
+
+        value, state, _ = self.get(tier, key)
+        if state == STALE:
+            self.refresh(tier, key, load_and_store)
+        if state is not None:
+            return value
+        return load_and_store()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT tier, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY tier'
+            ).fetchall()
+            sizes = {tier: (count, size) for tier, count, size in rows}
+            tiers = {}
+            for tier in TIERS:
+                counters = dict(self.counters[tier])
+                lookups = counters['hits'] + counters['staleHits'] + counters['misses']
+                count, size = sizes.get(tier, (0, 0))
+                counters.update({
+                    'entries': count,
+                    'bytes': size,
+                    'hitRatio': round((counters['hits'] + counters['staleHits']) / lookups, 4) if lookups else None,
+                })
+                tiers[tier] = counters
+        return {'maxBytes': self.max_bytes, 'tiers': tiers}
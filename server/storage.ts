@@ -15,7 +15,7 @@ export interface IStorage {
   deleteMessagesBySession(sessionId: string): Promise<boolean>;
 
   // Documents
-  createDocument(document: InsertDocument): Promise<Document>;
+  createDocument(document: InsertDocument, id?: string): Promise<Document>;
   getDocumentsBySession(sessionId: string): Promise<Document[]>;
   deleteDocumentsBySession(sessionId: string): Promise<boolean>;
 }
@@ -106,8 +106,7 @@ export class MemStorage implements IStorage {
   }
 
   // Documents
-  async createDocument(insertDocument: InsertDocument): Promise<Document> {
-    const id = randomUUID();
+  async createDocument(insertDocument: InsertDocument, id: string = randomUUID()): Promise<Document> {
     const document: Document = {
       ...insertDocument,
       id,
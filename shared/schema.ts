@@ -91,6 +91,9 @@ export const aiRequestSchema = z.object({
   toolType: z.enum(['chat', 'summary', 'search', 'qa']),
   sessionId: z.string(),
   documentContent: z.string().optional(),
+  ragBackend: z.enum(['tfidf', 'bm25', 'dense']).optional(),
+  summaryMode: z.enum(['rag', 'hierarchical']).optional(),
+  qaMode: z.enum(['context', 'chunks']).optional(),
 });
 
 export const aiResponseSchema = z.object({
@@ -99,7 +102,14 @@ export const aiResponseSchema = z.object({
     model: z.string(),
     processingTime: z.number(),
     tokenCount: z.number().optional(),
+    inputTokens: z.number().nullable().optional(),
+    outputTokens: z.number().nullable().optional(),
+    // Seconds per stage (model_load, rag_fit, generation, ...), excluding nested stages
+    stageTimings: z.record(z.number()).optional(),
+    cacheHit: z.boolean().optional(),
   }),
+  // Embedding of the query when chat retrieval used the dense backend; stored, not sent to clients
+  queryEmbedding: z.array(z.number()).optional(),
 });
 
 export type AIRequest = z.infer<typeof aiRequestSchema>;
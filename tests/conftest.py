@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+SERVICES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server", "services")
+sys.path.insert(0, SERVICES_DIR)
+
+from service_loader import load_service_module  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def service_dirs(tmp_path, monkeypatch):
+    """Keep indexes, documents and caches the services write inside the test's directory"""
+    for name in ("RAG_INDEX_DIR", "DOCUMENT_STORE_DIR", "WEB_CACHE_DIR", "AI_AGENT_PROFILE_DIR"):
+        monkeypatch.setenv(name, str(tmp_path / name.lower()))
+    return tmp_path
+
+
+@pytest.fixture(scope="session")
+def rag_service():
+    return load_service_module("rag-service.py", "rag_service")
@@ -0,0 +1,240 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from service_loader import load_service_module
+
+for _dependency in ("torch", "transformers", "duckduckgo_search", "bs4", "PyMuPDF"):
+    pytest.importorskip(_dependency)
+
+ai_agent = load_service_module("ai-agent.py", "ai_agent")
+rag_service = load_service_module("rag-service.py", "rag_service")
+# Stub tokenizer and pipelines that stand in for the models offline
+benchmark = load_service_module("benchmark.py", "benchmark")
+
+
+@pytest.fixture
+def agent():
+    return benchmark.make_agent(ai_agent, rag_service, search_url="http://127.0.0.1:9/search")
+
+
+class RecordingBatch:
+    """run_batch stand-in that records each batch it was given"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.batches = []
+
+    def __call__(self, inputs, **kwargs):
+        self.batches.append(list(inputs))
+        time.sleep(self.delay)
+        return [value * 2 for value in inputs]
+
+
+def test_micro_batcher_runs_an_uncontended_call_at_once():
+    run_batch = RecordingBatch()
+    batcher = ai_agent.MicroBatcher("test", run_batch, max_batch_size=8, max_wait_ms=500)
+    assert batcher.submit(1) == 2  # starts the dispatcher
+
+    started = time.perf_counter()
+    assert batcher.submit(21) == 42
+    assert time.perf_counter() - started < 0.25
+    assert run_batch.batches == [[1], [21]]
+
+
+def test_micro_batcher_batches_calls_that_queue_while_busy():
+    run_batch = RecordingBatch(delay=0.1)
+    batcher = ai_agent.MicroBatcher("test", run_batch, max_batch_size=4, max_wait_ms=50)
+    results = {}
+
+    def call(value):
+        results[value] = batcher.submit(value)
+
+    first = threading.Thread(target=call, args=(0,))
+    first.start()
+    time.sleep(0.03)  # the first call is running
+    others = [threading.Thread(target=call, args=(value,)) for value in range(1, 5)]
+    for thread in others:
+        thread.start()
+    for thread in [first] + others:
+        thread.join()
+
+    assert results == {value: value * 2 for value in range(5)}
+    assert run_batch.batches[0] == [0]
+    assert sorted(run_batch.batches[1]) == [1, 2, 3, 4]
+
+
+def test_micro_batcher_keeps_calls_with_different_kwargs_apart():
+    seen = []
+
+    def run_batch(inputs, scale=1):
+        seen.append((scale, len(inputs)))
+        return [value * scale for value in inputs]
+
+    batcher = ai_agent.MicroBatcher("test", run_batch, max_batch_size=8, max_wait_ms=5)
+    assert batcher.submit_many([1, 2], scale=3) == [3, 6]
+    assert batcher.submit(5, scale=10) == 50
+    assert all(count <= 2 for _, count in seen)
+
+
+def test_micro_batcher_reports_errors_to_every_caller():
+    def run_batch(inputs):
+        raise ValueError("model failed")
+
+    batcher = ai_agent.MicroBatcher("test", run_batch)
+    with pytest.raises(ValueError, match="model failed"):
+        batcher.submit_many([1, 2])
+
+
+def newline_token_count(text):
+    """Words plus one token per separator"""
+    return len(text.split()) + text.count("\n")
+
+
+def test_pack_summaries_fits_separators_in_the_window():
+    summaries = [" ".join(f"s{i}w{j}" for j in range(4)) for i in range(7)]
+    chunker = rag_service.TokenChunker(max_tokens=9, overlap=1)
+    groups = ai_agent.HybridAIAgent._pack_summaries(summaries, 9, newline_token_count, chunker)
+
+    # Two summaries and their separator make 9 tokens; a third would not fit
+    assert groups == ["\n".join(summaries[i:i + 2]) for i in range(0, 7, 2)]
+    assert all(newline_token_count(group) <= 9 for group in groups)
+
+
+def test_pack_summaries_splits_a_summary_longer_than_the_window():
+    long_summary = " ".join(f"w{j}" for j in range(25))
+    summaries = ["a b", long_summary, "c d"]
+    chunker = rag_service.TokenChunker(max_tokens=10, overlap=2)
+    groups = ai_agent.HybridAIAgent._pack_summaries(summaries, 10, newline_token_count, chunker)
+
+    assert groups[0] == "a b"
+    assert groups[-1] == "c d"
+    assert groups[1:-1] == chunker.chunk_text(long_summary)
+    assert all(newline_token_count(group) <= 10 for group in groups)
+
+
+class RecordingSummarizer(benchmark.StubPipeline):
+    def __init__(self, tokenizer):
+        super().__init__("summarization", tokenizer)
+        self.inputs = []
+
+    def __call__(self, inputs=None, **kwargs):
+        self.inputs.extend(inputs)
+        return super().__call__(inputs, **kwargs)
+
+
+def test_hierarchical_summary_inputs_never_exceed_the_window(agent):
+    summarizer = RecordingSummarizer(agent.tokenizer("summarizer"))
+    agent.models.register("summarizer", lambda: summarizer)
+    agent.summary_window_tokens, agent.summary_map_tokens = 100, 12
+    text = " ".join(f"word{i}" for i in range(1000))
+    levels = []
+
+    summary = agent.summarize_document(text, max_new_tokens=20, on_level=levels.append)
+
+    assert not summary.startswith("⚠️")
+    assert [level["step"] for level in levels] == ["map", "reduce", "final"]
+    assert all(later["inputs"] < earlier["inputs"] for earlier, later in zip(levels, levels[1:]))
+    tokenizer = summarizer.tokenizer
+    assert all(len(tokenizer(text)["input_ids"]) <= 100 for text in summarizer.inputs)
+
+
+def test_hierarchical_summary_fails_when_summaries_cannot_be_paired(agent):
+    agent.summary_window_tokens, agent.summary_map_tokens = 100, 60
+    text = " ".join(f"word{i}" for i in range(1000))
+    assert agent.summarize_document(text).startswith("⚠️ Error summarizing content")
+
+
+class SlowPageHandler(BaseHTTPRequestHandler):
+    """``/page/<n>?delay=<seconds>`` answers after the delay; other paths are 404s"""
+
+    lock = threading.Lock()
+    active = 0
+    max_active = 0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if not url.path.startswith("/page/"):
+            self.send_error(404)
+            return
+        cls = SlowPageHandler
+        with cls.lock:
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        try:
+            time.sleep(float(parse_qs(url.query).get("delay", ["0"])[0]))
+            payload = f"page {url.path.rsplit('/', 1)[1]}".encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def page_server():
+    SlowPageHandler.active = SlowPageHandler.max_active = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowPageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_page_fetcher_returns_pages_in_order(page_server):
+    fetcher = ai_agent.PageFetcher(max_workers=4)
+    urls = [f"{page_server}/page/{i}?delay={0.05 * (3 - i)}" for i in range(4)] + [f"{page_server}/missing"]
+    pages = fetcher.fetch_all(urls, deadline=5)
+
+    assert [page.url for page in pages] == urls
+    assert [page.text for page in pages[:4]] == ["page 0", "page 1", "page 2", "page 3"]
+    assert all(page.status == 200 and page.error is None for page in pages[:4])
+    assert pages[4].status == 404
+
+
+def test_page_fetcher_limits_requests_per_host(page_server):
+    fetcher = ai_agent.PageFetcher(max_workers=8, per_host_limit=2)
+    pages = fetcher.fetch_all([f"{page_server}/page/{i}?delay=0.1" for i in range(6)], deadline=5)
+    assert all(page.status == 200 for page in pages)
+    assert SlowPageHandler.max_active == 2
+
+
+def test_page_fetcher_gives_up_at_the_deadline(page_server):
+    fetcher = ai_agent.PageFetcher(max_workers=4)
+    started = time.perf_counter()
+    pages = fetcher.fetch_all([f"{page_server}/page/0", f"{page_server}/page/1?delay=2"], deadline=0.3)
+
+    assert time.perf_counter() - started < 1.5
+    assert pages[0].text == "page 0"
+    assert pages[1].text is None
+    assert "deadline" in pages[1].error
+
+
+def test_page_fetcher_reports_connection_errors():
+    with ThreadingHTTPServer(("127.0.0.1", 0), SlowPageHandler) as closed:
+        url = f"http://127.0.0.1:{closed.server_address[1]}/page/0"
+    page = ai_agent.PageFetcher().fetch(url)
+    assert page.text is None and page.status is None
+    assert page.error
+
+
+def test_empty_search_results_are_not_cached(agent, monkeypatch):
+    searches = []
+
+    def search_results(query, max_results):
+        searches.append(query)
+        return []
+
+    monkeypatch.setattr(agent, "search_results", search_results)
+    for _ in range(2):
+        assert agent.web_search("rate limited query") == "❌ No relevant search results found."
+    assert len(searches) == 2
@@ -0,0 +1,132 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from service_loader import load_service_module
+
+pytest.importorskip("PyMuPDF")
+
+ingest_service = load_service_module("ingest-service.py", "ingest_service")
+rag_service = load_service_module("rag-service.py", "rag_service")
+
+
+class ShardRecorder:
+    """extract_pages stand-in that names each page and records which shards were started"""
+
+    def __init__(self):
+        self.started = []
+        self.lock = threading.Lock()
+
+    def __call__(self, file_path, start, end):
+        with self.lock:
+            self.started.append(start)
+        return [f"page {i}" for i in range(start, end)]
+
+
+@pytest.fixture
+def shards(monkeypatch):
+    recorder = ShardRecorder()
+    monkeypatch.setattr(ingest_service, "extract_pages", recorder)
+    return recorder
+
+
+def threaded_extractor(**kwargs):
+    # Pool processes import the script by its own name, so threads stand in for them here
+    extractor = ingest_service.PDFExtractor(**kwargs)
+    extractor._pool = ThreadPoolExecutor(max_workers=extractor.processes)
+    return extractor
+
+
+def test_pages_come_out_in_order_across_shards(shards):
+    extractor = threaded_extractor(processes=4, pages_per_shard=3)
+    try:
+        assert list(extractor.iter_pages("doc.pdf", page_count=20)) == [f"page {i}" for i in range(20)]
+    finally:
+        extractor.shutdown()
+    assert sorted(shards.started) == list(range(0, 20, 3))
+
+
+def test_extraction_stays_within_the_pending_shard_limit(shards):
+    extractor = threaded_extractor(processes=4, pages_per_shard=2, max_pending_shards=3)
+    try:
+        for consumed, _ in enumerate(extractor.iter_pages("doc.pdf", page_count=30)):
+            current_shard = consumed // 2
+            assert len(shards.started) <= current_shard + 3
+    finally:
+        extractor.shutdown()
+    assert len(shards.started) == 15
+
+
+def test_single_shard_documents_are_read_in_the_calling_thread(shards):
+    extractor = ingest_service.PDFExtractor(processes=4, pages_per_shard=16)
+    assert list(extractor.iter_pages("doc.pdf", page_count=5)) == [f"page {i}" for i in range(5)]
+    assert extractor._pool is None
+
+
+class FakeExtractor:
+    """PDFExtractor stand-in serving fixed page texts"""
+
+    processes = 1
+    pages_per_shard = 16
+
+    def __init__(self, pages):
+        self.pages = pages
+
+    def page_count(self, file_path):
+        return len(self.pages)
+
+    def iter_pages(self, file_path, page_count=None):
+        return iter(self.pages)
+
+
+PAGES = [
+    "The zebra and the giraffe roam the savanna grasslands.",
+    "",
+    "Lions rest in the shade while the herds graze.",
+]
+
+
+def test_ingest_updates_the_session_index_and_document_store(tmp_path):
+    service = ingest_service.IngestionService(extractor=FakeExtractor(PAGES), progress_interval=0)
+    events = []
+    result = service.ingest(
+        {"file_path": "doc.pdf", "document_id": "doc-1", "session_id": "session-1", "backend": "bm25"},
+        on_event=events.append,
+    )
+
+    content = " ".join(page for page in PAGES if page)
+    assert result["content"] == content
+    assert result["content_hash"] == rag_service.content_hash(content)
+    assert service.document_store.get(result["content_hash"]) == content
+    assert result["pages"] == 3
+    assert result["chunks_created"] == len(result["chunks"]) > 0
+    assert [event["pagesDone"] for event in events] == [1, 2, 3]
+
+    index = rag_service.load_session_index("session-1", [{"id": "doc-1", "content": content}], backend="bm25")
+    assert index is not None
+    assert {chunk["document_id"] for chunk in index.retrieve_relevant_chunks("zebra giraffe")} == {"doc-1"}
+
+
+def test_ingest_adds_to_an_existing_session_index(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("Rockets reach orbit   around the planet.\n", encoding="utf-8")
+    service = ingest_service.IngestionService(extractor=FakeExtractor(PAGES))
+    first = service.ingest({"file_path": "doc.pdf", "document_id": "doc-1", "session_id": "session-1",
+                            "backend": "bm25"})
+    second = service.ingest({"file_path": str(path), "mime_type": "text/plain", "document_id": "doc-2",
+                             "session_id": "session-1", "backend": "bm25"})
+
+    assert second["content"] == "Rockets reach orbit around the planet."
+    documents = [{"id": "doc-1", "content": first["content"]}, {"id": "doc-2", "content": second["content"]}]
+    index = rag_service.load_session_index("session-1", documents, backend="bm25")
+    assert index is not None
+    assert {chunk["document_id"] for chunk in index.retrieve_relevant_chunks("rockets orbit")} == {"doc-2"}
+    assert service.stats()["documents"] == 2
+
+
+def test_ingest_rejects_unsupported_files():
+    service = ingest_service.IngestionService(extractor=FakeExtractor(PAGES))
+    with pytest.raises(ValueError):
+        service.ingest({"file_path": "image.png", "mime_type": "image/png", "document_id": "doc-1",
+                        "session_id": "session-1"})
@@ -0,0 +1,53 @@
+import pytest
+
+from service_loader import load_service_module
+
+torch = pytest.importorskip("torch")
+model_optimization = load_service_module("model-optimization.py", "model_optimization")
+
+
+def tiny_model():
+    torch.manual_seed(0)
+    return torch.nn.Sequential(torch.nn.Linear(64, 128), torch.nn.ReLU(), torch.nn.Linear(128, 8))
+
+
+def test_int8_shrinks_linear_weights_and_keeps_outputs_close():
+    model = tiny_model()
+    inputs = torch.randn(4, 64)
+    with torch.no_grad():
+        expected = model(inputs)
+    size = model_optimization.model_size_bytes(model)
+
+    quantized, precision = model_optimization.optimize_model(model, "int8")
+    assert precision == "int8"
+    assert model_optimization.model_size_bytes(quantized) < size / 2
+    with torch.no_grad():
+        assert torch.allclose(quantized(inputs), expected, atol=0.05)
+
+
+def test_bf16_falls_back_to_fp32_when_not_allowed():
+    model, precision = model_optimization.optimize_model(tiny_model(), "bf16", allow_bf16=False)
+    assert precision == "fp32"
+    assert next(model.parameters()).dtype == torch.float32
+    assert not model.training
+
+
+def test_unknown_precision_is_rejected():
+    with pytest.raises(ValueError):
+        model_optimization.optimize_model(tiny_model(), "fp8")
+
+
+def test_tied_weights_are_counted_once():
+    model = torch.nn.Sequential(torch.nn.Embedding(100, 16), torch.nn.Linear(16, 100, bias=False))
+    model[1].weight = model[0].weight
+    assert model_optimization.model_size_bytes(model) == 100 * 16 * 4
+
+
+def test_configure_threads_sets_the_intra_op_pool():
+    previous = torch.get_num_threads()
+    try:
+        threads = model_optimization.configure_threads(intra_op=1)
+        assert threads["intraOp"] == torch.get_num_threads() == 1
+        assert threads["interOp"] >= 1
+    finally:
+        torch.set_num_threads(previous)
@@ -0,0 +1,292 @@
+import random
+import threading
+
+import numpy as np
+import pytest
+
+TOPICS = [
+    "finance market stock bond dividend",
+    "cooking recipe pasta sauce garlic",
+    "football match goal team referee",
+    "weather rain cloud storm forecast",
+    "music guitar song band concert",
+    "space rocket orbit planet telescope",
+]
+FILLER = ["alpha", "beta", "gamma", "delta"]
+
+
+def make_corpus(n_documents, sentences=40, seed=0):
+    """Documents that each stick to one topic, so every topic query has a clear answer"""
+    rng = random.Random(seed)
+    documents = []
+    for i in range(n_documents):
+        words = TOPICS[i % len(TOPICS)].split() + FILLER
+        text = ". ".join(" ".join(rng.choice(words) for _ in range(12)) for _ in range(sentences))
+        documents.append({"id": f"doc-{i}", "content": text + "."})
+    return documents
+
+
+NEW_DOCUMENT = {
+    "id": "savanna",
+    "content": ". ".join("The zebra and the giraffe roam the savanna grasslands together" for _ in range(30)) + ".",
+}
+
+
+def document_ids(chunks):
+    return {chunk["document_id"] for chunk in chunks}
+
+
+def test_incremental_tfidf_matches_batch(rag_service):
+    documents = make_corpus(30)
+    batch = rag_service.SimpleRAGService()
+    incremental = rag_service.SimpleRAGService(incremental=True)
+    batch.index_documents(documents)
+    incremental.index_documents(documents)
+
+    for topic in TOPICS:
+        query = " ".join(topic.split()[:2])
+        expected = document_ids(batch.retrieve_relevant_chunks(query, k=5))
+        assert expected
+        assert document_ids(incremental.retrieve_relevant_chunks(query, k=5)) == expected
+
+
+def test_incremental_tfidf_finds_new_terms_before_reweighting(rag_service):
+    batch = rag_service.SimpleRAGService()
+    incremental = rag_service.SimpleRAGService(incremental=True)
+    for service in (batch, incremental):
+        service.index_documents(make_corpus(30))
+        # Retrieval consolidates the index and fixes which features are kept
+        service.retrieve_relevant_chunks("stock market")
+        service.index_document(NEW_DOCUMENT["id"], NEW_DOCUMENT["content"])
+
+    expected = batch.retrieve_relevant_chunks("zebra giraffe savanna")
+    found = incremental.retrieve_relevant_chunks("zebra giraffe savanna")
+    assert document_ids(expected) == {"savanna"}
+    assert document_ids(found) == {"savanna"}
+    assert found[0]["similarity_score"] == pytest.approx(expected[0]["similarity_score"], abs=0.1)
+
+
+def test_incremental_tfidf_removes_document_without_chunks(rag_service):
+    service = rag_service.SimpleRAGService(incremental=True)
+    service.index_document("empty", "")
+    assert service.remove_document("empty")
+    assert not service.remove_document("empty")
+    assert service.retrieve_relevant_chunks("anything") == []
+
+
+@pytest.fixture(params=["tfidf", "tfidf-incremental", "bm25", "dense"])
+def backend_service(request, rag_service):
+    if request.param == "tfidf-incremental":
+        return rag_service.SimpleRAGService(incremental=True)
+    return rag_service.create_rag_service(request.param)
+
+
+def test_remove_document_drops_its_chunks(backend_service):
+    documents = make_corpus(6)
+    backend_service.index_documents(documents)
+    # Indexed but not yet consolidated into the chunk store
+    backend_service.index_document(NEW_DOCUMENT["id"], NEW_DOCUMENT["content"])
+
+    assert backend_service.remove_document(NEW_DOCUMENT["id"])
+    assert "savanna" not in document_ids(backend_service.retrieve_relevant_chunks("zebra giraffe savanna", k=10))
+    assert {chunk["document_id"] for chunk in backend_service.document_chunks} == {doc["id"] for doc in documents}
+    assert document_ids(backend_service.retrieve_relevant_chunks("football referee", k=10)) == {"doc-2"}
+
+
+def test_reindexing_a_document_replaces_its_chunks(backend_service):
+    backend_service.index_documents(make_corpus(6))
+    first = backend_service.index_document(NEW_DOCUMENT["id"], NEW_DOCUMENT["content"])
+    for _ in range(3):
+        again = backend_service.index_document(NEW_DOCUMENT["id"], NEW_DOCUMENT["content"])
+        assert len(again) == len(first)
+
+    hits = backend_service.retrieve_relevant_chunks("zebra giraffe savanna", k=100)
+    assert len(hits) == len(first)
+    assert sum(chunk["document_id"] == "savanna" for chunk in backend_service.document_chunks) == len(first)
+
+
+def test_reindexing_a_streamed_document_replaces_its_chunks(backend_service, rag_service):
+    backend_service.index_documents(make_corpus(6))
+    pieces = NEW_DOCUMENT["content"].split(". ")
+    first = backend_service.index_document_stream(NEW_DOCUMENT["id"], iter(pieces), separator=". ")
+    again = backend_service.index_document_stream(NEW_DOCUMENT["id"], iter(pieces), separator=". ")
+    assert len(again) == len(first)
+    assert len(backend_service.retrieve_relevant_chunks("zebra giraffe savanna", k=100)) == len(first)
+    assert sum(chunk["document_id"] == "savanna" for chunk in backend_service.document_chunks) == len(first)
+    assert backend_service.documents["savanna"] == rag_service.content_hash(NEW_DOCUMENT["content"])
+
+
+LONG_TEXT = make_corpus(1, sentences=60, seed=3)[0]["content"]
+
+
+@pytest.mark.parametrize("max_tokens,overlap", [(16, 0), (32, 8), (128, 16)])
+def test_chunk_spans_point_at_their_text(rag_service, max_tokens, overlap):
+    chunker = rag_service.TokenChunker(max_tokens, overlap)
+    chunks = list(chunker.iter_chunks([LONG_TEXT]))
+    assert len(chunks) > 1
+    for span, text in chunks:
+        assert LONG_TEXT[span.start:span.end] == text
+        assert span.tokens == len(rag_service.regex_token_spans(text)) <= max_tokens
+    assert chunks[0][0].start == 0
+    assert chunks[-1][0].end == len(LONG_TEXT)
+
+
+def test_chunks_overlap_by_the_configured_tokens(rag_service):
+    chunker = rag_service.TokenChunker(32, 8)
+    chunks = list(chunker.iter_chunks([LONG_TEXT]))
+    for (previous, _), (span, _) in zip(chunks, chunks[1:]):
+        tokens = rag_service.regex_token_spans(LONG_TEXT[previous.start:previous.end])
+        assert span.start == previous.start + tokens[-8][0]
+        assert span.start < previous.end
+
+
+def test_chunking_pieces_matches_chunking_the_whole_text(rag_service):
+    chunker = rag_service.TokenChunker(32, 8)
+    rng = random.Random(1)
+    # Cut anywhere, including inside words, and include empty pieces
+    cuts = sorted(rng.sample(range(1, len(LONG_TEXT)), 50))
+    pieces = [LONG_TEXT[i:j] for i, j in zip([0] + cuts, cuts + [len(LONG_TEXT)])]
+    pieces.insert(3, "")
+    assert list(chunker.iter_chunks(pieces)) == list(chunker.iter_chunks([LONG_TEXT]))
+
+
+def test_chunker_prefers_sentence_ends(rag_service):
+    text = " ".join(f"Sentence number {i} has a few words." for i in range(40))
+    for chunk in rag_service.TokenChunker(40, 4).chunk_text(text)[:-1]:
+        assert chunk.endswith(".")
+
+
+@pytest.mark.parametrize("max_tokens,overlap", [(1, 0), (10, 5), (10, -1)])
+def test_chunker_rejects_invalid_sizes(rag_service, max_tokens, overlap):
+    with pytest.raises(ValueError):
+        rag_service.TokenChunker(max_tokens, overlap)
+
+
+def brute_force_bm25(service, query):
+    """BM25 of every chunk for the query, straight from the term counts"""
+    counts = service._chunk_terms.toarray().astype(float)
+    n_chunks = counts.shape[0]
+    lengths = counts.sum(axis=1)
+    df = (counts > 0).sum(axis=0)
+    idf = np.log(1 + (n_chunks - df + 0.5) / (df + 0.5))
+    norm = service.k1 * (1 - service.b + service.b * lengths / max(lengths.mean(), 1.0))
+    scores = np.zeros(n_chunks)
+    for term in set(service._tokenize(query)):
+        if term in service.term_ids:
+            tf = counts[:, service.term_ids[term]]
+            scores += idf[service.term_ids[term]] * tf * (service.k1 + 1) / (tf + norm)
+    return scores
+
+
+@pytest.mark.parametrize("k", [1, 3, 10])
+def test_bm25_top_k_matches_brute_force(rag_service, k):
+    service = rag_service.BM25RAGService()
+    service.index_documents(make_corpus(24, seed=5))
+    service.retrieve_relevant_chunks("warm up")
+
+    for query in ["stock market", "garlic pasta sauce", "rain storm alpha", "rocket beta guitar song goal",
+                  "alpha beta gamma delta", "dividend bond referee telescope forecast concert"]:
+        expected = brute_force_bm25(service, query)
+        chunk_ids, scores = service._search(query, k)
+        top = np.sort(expected)[::-1][:k]
+        assert scores == pytest.approx(top[:len(scores)])
+        assert expected[chunk_ids] == pytest.approx(scores)
+        assert len(scores) == min(k, int((expected > 0).sum()))
+    assert service.postings_skipped > 0
+
+
+def retrieval(service, queries=("stock market", "garlic pasta", "rocket orbit", "zebra giraffe savanna")):
+    return [[(chunk["document_id"], chunk["chunk_index"], chunk["content"], round(chunk["similarity_score"], 6))
+             for chunk in service.retrieve_relevant_chunks(query, k=5)] for query in queries]
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_saved_index_loads_with_the_same_results(backend_service, tmp_path, mmap):
+    documents = make_corpus(12) + [NEW_DOCUMENT]
+    backend_service.index_documents(documents[:-1])
+    backend_service.retrieve_relevant_chunks("stock market")
+    # Saving has to include chunks that are still pending
+    backend_service.index_document(NEW_DOCUMENT["id"], NEW_DOCUMENT["content"])
+    index_dir = str(tmp_path / "index")
+    backend_service.save(index_dir)
+    expected = retrieval(backend_service)
+
+    loaded = type(backend_service).load(index_dir, mmap=mmap)
+    assert retrieval(loaded) == expected
+    assert loaded.covers(documents)
+    assert len(loaded.document_chunks) == len(backend_service.document_chunks)
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_loaded_index_can_be_updated(backend_service, tmp_path, mmap):
+    backend_service.index_documents(make_corpus(12))
+    index_dir = str(tmp_path / "index")
+    backend_service.save(index_dir)
+
+    loaded = type(backend_service).load(index_dir, mmap=mmap)
+    loaded.index_document(NEW_DOCUMENT["id"], NEW_DOCUMENT["content"])
+    assert document_ids(loaded.retrieve_relevant_chunks("zebra giraffe savanna")) == {"savanna"}
+    assert loaded.remove_document("doc-2")
+    assert "doc-2" not in document_ids(loaded.retrieve_relevant_chunks("football referee", k=10))
+
+    # A save over the loaded version must not disturb the arrays it still maps
+    loaded.save(index_dir)
+    reloaded = type(backend_service).load(index_dir, mmap=mmap)
+    assert retrieval(reloaded) == retrieval(loaded)
+
+
+def test_session_index_is_ignored_when_documents_change(rag_service):
+    documents = make_corpus(6)
+    service = rag_service.create_rag_service("bm25")
+    service.index_documents(documents)
+    rag_service.save_session_index("session-1", service)
+
+    assert rag_service.load_session_index("session-1", documents, backend="bm25") is not None
+    changed = documents[:-1] + [dict(documents[-1], content="rewritten")]
+    assert rag_service.load_session_index("session-1", changed, backend="bm25") is None
+    assert rag_service.load_session_index("session-1", documents, backend="tfidf") is None
+
+
+def test_chunk_store_rows_can_be_read_while_it_compacts(rag_service):
+    chunks = [{"document_id": f"doc-{i % 7}", "chunk_index": str(i), "content": f"chunk {i}", "start": i, "end": i + 1}
+              for i in range(5000)]
+    errors = []
+    for _ in range(50):
+        store = rag_service.ChunkStore()
+        store.extend(chunks)
+        barrier = threading.Barrier(4)
+
+        def read():
+            barrier.wait()
+            try:
+                assert store.view(4999)["content"] == "chunk 4999"
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=read) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert errors == []
+
+
+def test_shared_index_serves_concurrent_retrievals(backend_service):
+    backend_service.index_documents(make_corpus(12))
+    barrier = threading.Barrier(4)
+    results, errors = [], []
+
+    def retrieve():
+        barrier.wait()
+        try:
+            results.append(document_ids(backend_service.retrieve_relevant_chunks("football referee", k=10)))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=retrieve) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert results == [{"doc-2", "doc-8"}] * 4
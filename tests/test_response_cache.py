@@ -0,0 +1,112 @@
+import types
+
+import pytest
+
+from service_loader import load_service_module
+
+response_cache = load_service_module("response-cache.py", "response_cache")
+rag_service = load_service_module("rag-service.py", "rag_service")
+
+
+class Clock:
+    """Stand-in for time.time that only moves when told to"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache, "time", types.SimpleNamespace(time=clock.time))
+    return clock
+
+
+def test_hits_ignore_case_and_whitespace_but_not_context(clock):
+    cache = response_cache.ResponseCache()
+    cache.put("chat", "Hello  there", "context", "Hi!", generation_seconds=2.0)
+
+    entry = cache.get("chat", " hello there ", "context")
+    assert entry["response"] == "Hi!"
+    assert entry["match"] == "exact"
+    assert cache.get("chat", "hello there", "other context") is None
+    assert cache.get("qa", "hello there", "context") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+    assert cache.stats()["savedSeconds"] == 2.0
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = response_cache.ResponseCache(ttl_seconds=60)
+    cache.put("chat", "q", "", "answer", generation_seconds=1.0)
+    clock.advance(59)
+    assert cache.get("chat", "q", "") is not None
+    clock.advance(2)
+    assert cache.get("chat", "q", "") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entries_are_evicted(clock):
+    cache = response_cache.ResponseCache(max_entries=3)
+    for query in ("a", "b", "c"):
+        cache.put("chat", query, "", query.upper(), generation_seconds=1.0)
+    cache.get("chat", "a", "")
+
+    cache.put("chat", "d", "", "D", generation_seconds=1.0)
+    assert [query for query in "abcd" if cache.get("chat", query, "")] == ["a", "c", "d"]
+    assert cache.stats()["entries"] == 3
+
+
+def test_error_responses_are_not_cached(clock):
+    cache = response_cache.ResponseCache()
+    calls = []
+
+    def generate():
+        calls.append(1)
+        return "❌ Model failed"
+
+    assert cache.get_or_generate("chat", "q", "", generate) == ("❌ Model failed", None)
+    assert cache.get_or_generate("chat", "q", "", generate)[1] is None
+    assert len(calls) == 2
+
+
+def test_near_duplicate_queries_share_a_response(clock):
+    cache = response_cache.ResponseCache(vectorizer=rag_service.hashing_vectorizer(), similarity_threshold=0.8)
+    cache.put("qa", "what is the capital of france", "doc", "Paris", generation_seconds=1.0)
+
+    entry = cache.get("qa", "what is the capital of france?", "doc")
+    assert entry["response"] == "Paris"
+    assert entry["match"] == "similar"
+    assert cache.get("qa", "who wrote the novel", "doc") is None
+    assert cache.get("qa", "what is the capital of france?", "another doc") is None
+
+
+def test_persisted_entries_survive_a_restart_until_they_expire(tmp_path, clock):
+    path = str(tmp_path / "responses.sqlite3")
+    cache = response_cache.ResponseCache(ttl_seconds=60, persist_path=path)
+    cache.put("chat", "old", "", "stale", generation_seconds=1.0)
+    clock.advance(40)
+    cache.put("chat", "new", "", "kept", generation_seconds=1.0)
+    clock.advance(30)
+
+    restarted = response_cache.ResponseCache(ttl_seconds=60, persist_path=path)
+    assert restarted.stats()["entries"] == 1
+    assert restarted.get("chat", "new", "")["response"] == "kept"
+    assert restarted.get("chat", "old", "") is None
+
+
+def test_restart_keeps_only_the_newest_entries_that_fit(tmp_path, clock):
+    path = str(tmp_path / "responses.sqlite3")
+    cache = response_cache.ResponseCache(persist_path=path)
+    for query in ("a", "b", "c"):
+        cache.put("chat", query, "", query.upper(), generation_seconds=1.0)
+        clock.advance(1)
+
+    restarted = response_cache.ResponseCache(max_entries=2, persist_path=path)
+    assert [query for query in "abc" if restarted.get("chat", query, "")] == ["b", "c"]
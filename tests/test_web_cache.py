@@ -0,0 +1,141 @@
+import threading
+import types
+
+import pytest
+
+from service_loader import load_service_module
+
+web_cache = load_service_module("web-cache.py", "web_cache")
+
+
+class Clock:
+    """Stand-in for time.time that only moves when told to"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(web_cache, "time", types.SimpleNamespace(time=clock.time))
+    return clock
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    return web_cache.WebCache(str(tmp_path / "cache.sqlite3"), stale_seconds=60)
+
+
+def test_entries_go_stale_then_expire(cache, clock):
+    cache.put("search", "q", ["result"], ttl=10, etag='"v1"')
+    assert cache.get("search", "q") == (["result"], web_cache.FRESH, {"etag": '"v1"', "last_modified": None})
+
+    clock.advance(11)
+    assert cache.get("search", "q")[:2] == (["result"], web_cache.STALE)
+    clock.advance(60)
+    assert cache.get("search", "q") == (None, None, {})
+    assert cache.stats()["tiers"]["search"] == {
+        "hits": 1, "staleHits": 1, "misses": 1, "entries": 1, "bytes": len('["result"]'), "hitRatio": 0.6667,
+    }
+
+
+def test_entries_without_ttl_stay_fresh(cache, clock):
+    cache.put("summary", "key", "text")
+    clock.advance(10 ** 6)
+    assert cache.get("summary", "key")[1] == web_cache.FRESH
+
+
+def test_touch_makes_a_stale_entry_fresh(cache, clock):
+    cache.put("page", "url", "text", ttl=10)
+    clock.advance(20)
+    cache.touch("page", "url", ttl=10)
+    assert cache.get("page", "url")[1] == web_cache.FRESH
+
+
+def test_least_recently_used_entries_are_evicted_over_max_bytes(tmp_path, clock):
+    value = "x" * 98  # 100 bytes once encoded as JSON
+    cache = web_cache.WebCache(str(tmp_path / "cache.sqlite3"), max_bytes=300)
+    for key in ("a", "b", "c"):
+        cache.put("page", key, value)
+        clock.advance(60)
+    cache.get("page", "a")
+    clock.advance(60)
+
+    cache.put("page", "d", value)
+    assert [key for key in "abcd" if cache.get("page", key)[1]] == ["a", "c", "d"]
+    assert cache.stats()["tiers"]["page"]["bytes"] == 300
+
+
+def test_hits_record_their_access_only_once_per_resolution(cache, clock):
+    cache.put("page", "url", "text")
+    writes = cache._conn.total_changes
+    for _ in range(5):
+        clock.advance(1)
+        assert cache.get("page", "url")[1] == web_cache.FRESH
+    assert cache._conn.total_changes == writes
+
+    clock.advance(cache.access_resolution)
+    cache.get("page", "url")
+    assert cache._conn.total_changes == writes + 1
+
+
+def test_eviction_frees_only_what_a_large_entry_needs(tmp_path, clock):
+    cache = web_cache.WebCache(str(tmp_path / "cache.sqlite3"), max_bytes=300)
+    for key in ("a", "b", "c"):
+        cache.put("page", key, "x" * 98)
+        clock.advance(1)
+    cache.put("page", "big", "y" * 148)  # 150 bytes push the total 150 over
+    assert [key for key in ("a", "b", "c", "big") if cache.get("page", key)[1]] == ["c", "big"]
+
+
+def test_stale_entries_are_served_while_refreshed_in_the_background(cache, clock):
+    cache.put("search", "q", "old", ttl=10)
+    clock.advance(11)
+    loaded = threading.Event()
+
+    def loader():
+        loaded.set()
+        return "new"
+
+    assert cache.get_or_load("search", "q", loader, ttl=10) == "old"
+    assert loaded.wait(5)
+    cache._refresher.shutdown(wait=True)
+    assert cache.get("search", "q")[:2] == ("new", web_cache.FRESH)
+
+
+def test_processes_share_the_cache_file(tmp_path, clock):
+    path = str(tmp_path / "cache.sqlite3")
+    web_cache.WebCache(path).put("search", "q", ["result"], ttl=10)
+    assert web_cache.WebCache(path).get("search", "q")[0] == ["result"]
+
+
+@pytest.mark.parametrize("headers,expected", [
+    ({}, 30.0),
+    ({"Cache-Control": "public, max-age=120"}, 120.0),
+    ({"cache-control": "no-store"}, None),
+])
+def test_max_age_follows_cache_control(headers, expected):
+    assert web_cache.max_age(headers, default=30.0) == expected
+
+
+def test_rejected_values_are_not_stored(cache, clock):
+    results = iter([[], ["result"]])
+    load = results.__next__
+    assert cache.get_or_load("search", "q", load, ttl=10, cacheable=bool) == []
+    assert cache.get_or_load("search", "q", load, ttl=10, cacheable=bool) == ["result"]
+    assert cache.get("search", "q")[:2] == (["result"], web_cache.FRESH)
+
+
+def test_a_rejected_refresh_keeps_the_stale_entry(cache, clock):
+    cache.put("search", "q", ["old"], ttl=10)
+    clock.advance(11)
+    assert cache.get_or_load("search", "q", lambda: [], ttl=10, cacheable=bool) == ["old"]
+    cache._refresher.shutdown(wait=True)
+    assert cache.get("search", "q")[:2] == (["old"], web_cache.STALE)